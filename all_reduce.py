@@ -0,0 +1,82 @@
+"""
+All-reduce of float32 vectors between worker processes on one machine through shared memory.
+
+Every worker writes its vector into its own row of a shared (world_size, size) array. After a barrier,
+each worker averages one slice of the columns into the shared result (a reduce-scatter), and after a second
+barrier all workers read the complete result. The next round can only start writing rows after every worker
+passed the second barrier, and can only start writing the result after every worker passed the first barrier
+of that round, i. e. finished reading the previous result, so two barriers per round suffice.
+"""
+import multiprocessing
+
+import numpy
+from numpy import ndarray
+
+
+class SharedMemoryAllReduce:
+    """Created in the parent process and passed to the worker processes, each calling for_rank once."""
+
+    def __init__(self, world_size: int, size: int, timeout: float = 600.,
+                 context=multiprocessing.get_context("spawn")):
+        self.world_size = world_size
+        self.size = size
+        self.timeout = timeout
+        self._rows = context.RawArray('f', world_size * size)
+        self._result = context.RawArray('f', size)
+        self._barrier = context.Barrier(world_size)
+        self.rank = None
+
+    def for_rank(self, rank: int) -> 'SharedMemoryAllReduce':
+        if not 0 <= rank < self.world_size:
+            raise ValueError("Rank {} is not in range for world size {}.".format(rank, self.world_size))
+
+        self.rank = rank
+        return self
+
+    def _arrays(self):
+        rows = numpy.frombuffer(self._rows, dtype=numpy.float32).reshape((self.world_size, self.size))
+        result = numpy.frombuffer(self._result, dtype=numpy.float32)
+        return rows, result
+
+    def _wait(self) -> None:
+        # raises BrokenBarrierError in all workers if one of them called abort or the timeout passed:
+        self._barrier.wait(timeout=self.timeout)
+
+    def abort(self) -> None:
+        """Called by a failing worker, so that the others fail at the next barrier instead of waiting for it."""
+        self._barrier.abort()
+
+    def mean(self, vector: ndarray) -> ndarray:
+        """Element-wise mean of the vectors of all workers. Blocks until every worker called it."""
+        if vector.shape != (self.size,):
+            raise ValueError("Expected a vector of size {}, got shape {}.".format(self.size, vector.shape))
+
+        rows, result = self._arrays()
+        rows[self.rank] = vector
+        self._wait()
+
+        chunk_size = -(-self.size // self.world_size)
+        chunk = slice(self.rank * chunk_size, (self.rank + 1) * chunk_size)
+        result[chunk] = rows[:, chunk].mean(axis=0)
+        self._wait()
+
+        return result.copy()
+
+    def broadcast(self, vector: ndarray, root: int = 0) -> ndarray:
+        """
+        The vector of the root worker, returned to all workers, which pass vectors of the same length.
+        It may be shorter than size, e. g. weights without the loss that is averaged with the gradients.
+        """
+        length = vector.shape[0]
+        if length > self.size:
+            raise ValueError("Expected a vector of at most size {}, got {}.".format(self.size, length))
+
+        # passed through the row of the root, since others may still be reading the result of a preceding mean:
+        rows, _ = self._arrays()
+        if self.rank == root:
+            rows[root, :length] = vector
+        self._wait()
+        broadcast = rows[root, :length].copy()
+        self._wait()
+
+        return broadcast
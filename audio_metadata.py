@@ -0,0 +1,171 @@
+import json
+import struct
+from pathlib import Path
+
+import os
+from typing import Dict, Iterable, Optional, List
+
+from tools import mkdir
+
+
+class AudioMetadataException(Exception):
+    pass
+
+
+class AudioMetadata:
+    """Duration, sample rate and channel count of an audio file, as stated in its header."""
+
+    def __init__(self, sample_rate: int, channel_count: int, frame_count: int):
+        self.sample_rate = sample_rate
+        self.channel_count = channel_count
+        self.frame_count = frame_count
+
+    @property
+    def duration_in_s(self) -> float:
+        return self.frame_count / self.sample_rate
+
+    def as_list(self) -> List[int]:
+        return [self.sample_rate, self.channel_count, self.frame_count]
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, AudioMetadata) and self.as_list() == other.as_list()
+
+    def __repr__(self) -> str:
+        return "AudioMetadata(sample_rate={}, channel_count={}, frame_count={})".format(*self.as_list())
+
+
+def read_audio_metadata(audio_file: Path) -> AudioMetadata:
+    """
+    Reads the metadata from the FLAC STREAMINFO block or the WAV fmt and data chunks without decoding any audio.
+    """
+    with audio_file.open('rb') as f:
+        magic = f.read(4)
+        if magic == b'ID3\x03' or magic == b'ID3\x04' or magic == b'ID3\x02':
+            _skip_id3v2_tag(f)
+            magic = f.read(4)
+
+        if magic == b'fLaC':
+            return _read_flac_stream_info(f, audio_file)
+        if magic == b'RIFF':
+            return _read_wave_chunks(f, audio_file, file_size=os.fstat(f.fileno()).st_size)
+
+    raise AudioMetadataException("Unsupported audio format: {}".format(audio_file))
+
+
+def _skip_id3v2_tag(f) -> None:
+    header = f.read(6)
+    # the tag size is stored as four 7-bit bytes after version, revision and flags:
+    size = 0
+    for byte in header[2:6]:
+        size = (size << 7) | (byte & 0x7f)
+    f.seek(10 + size)
+
+
+def _read_flac_stream_info(f, audio_file: Path) -> AudioMetadata:
+    block_header = f.read(4)
+    if len(block_header) < 4 or block_header[0] & 0x7f != 0:
+        raise AudioMetadataException("FLAC file does not start with a STREAMINFO block: {}".format(audio_file))
+
+    stream_info = f.read(34)
+    if len(stream_info) < 34:
+        raise AudioMetadataException("Truncated FLAC STREAMINFO block: {}".format(audio_file))
+
+    # 20 bits sample rate, 3 bits channel count - 1, 5 bits bits per sample - 1, 36 bits total sample count:
+    packed, = struct.unpack('>Q', stream_info[10:18])
+    sample_rate = packed >> 44
+    channel_count = ((packed >> 41) & 0x7) + 1
+    frame_count = packed & 0xfffffffff
+
+    if sample_rate == 0 or frame_count == 0:
+        raise AudioMetadataException("FLAC header does not specify sample rate and length: {}".format(audio_file))
+
+    return AudioMetadata(sample_rate=sample_rate, channel_count=channel_count, frame_count=frame_count)
+
+
+def _read_wave_chunks(f, audio_file: Path, file_size: int) -> AudioMetadata:
+    riff_rest = f.read(8)
+    if len(riff_rest) < 8 or riff_rest[4:8] != b'WAVE':
+        raise AudioMetadataException("RIFF file is not a WAVE file: {}".format(audio_file))
+
+    channel_count = None
+    sample_rate = None
+    block_align = None
+    while True:
+        chunk_header = f.read(8)
+        if len(chunk_header) < 8:
+            raise AudioMetadataException("No data chunk found in {}".format(audio_file))
+
+        chunk_id = chunk_header[:4]
+        chunk_size, = struct.unpack('<I', chunk_header[4:])
+
+        if chunk_id == b'fmt ':
+            fmt = f.read(chunk_size + chunk_size % 2)
+            _format_tag, channel_count, sample_rate, _byte_rate, block_align = struct.unpack('<HHIIH', fmt[:14])
+        elif chunk_id == b'data':
+            if block_align is None:
+                raise AudioMetadataException("data chunk before fmt chunk in {}".format(audio_file))
+            # streaming writers leave the size unset, in this case the data chunk extends to the end of the file:
+            available_size = file_size - f.tell()
+            data_size = available_size if chunk_size == 0xffffffff or chunk_size > available_size else chunk_size
+
+            return AudioMetadata(sample_rate=sample_rate, channel_count=channel_count,
+                                 frame_count=data_size // block_align)
+        else:
+            # chunks are padded to an even size:
+            f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+
+class AudioMetadataIndex:
+    """
+    Audio metadata for all audio files of a corpus directory, persisted as JSON next to it.
+    Entries are keyed by relative path and invalidated if file size or modification time changes.
+    """
+
+    def __init__(self, corpus_directory: Path, index_file: Optional[Path] = None):
+        self.corpus_directory = corpus_directory
+        self.index_file = index_file if index_file is not None else \
+            corpus_directory.parent / "{}.audio-metadata.json".format(corpus_directory.name)
+        self._entries = self._load()  # type: Dict[str, list]
+
+    def _load(self) -> Dict[str, list]:
+        if not self.index_file.is_file():
+            return dict()
+
+        try:
+            with self.index_file.open(encoding='utf8') as f:
+                return json.load(f)
+        except ValueError:
+            print("Rebuilding audio metadata index {} because loading failed.".format(self.index_file))
+            return dict()
+
+    def _key(self, audio_file: Path) -> str:
+        return str(audio_file.relative_to(self.corpus_directory))
+
+    def metadata(self, audio_file: Path) -> Optional[AudioMetadata]:
+        """Returns None if the header of the file could not be parsed."""
+        key = self._key(audio_file)
+        stat = audio_file.stat()
+        file_signature = [stat.st_size, stat.st_mtime]
+
+        entry = self._entries.get(key)
+        if entry is None or entry[:2] != file_signature:
+            try:
+                metadata_list = read_audio_metadata(audio_file).as_list()
+            except AudioMetadataException:
+                metadata_list = None
+
+            entry = file_signature + [metadata_list]
+            self._entries[key] = entry
+
+        metadata_list = entry[2]
+        return None if metadata_list is None else AudioMetadata(*metadata_list)
+
+    def metadata_by_file(self, audio_files: Iterable[Path]) -> Dict[Path, Optional[AudioMetadata]]:
+        return dict((audio_file, self.metadata(audio_file)) for audio_file in audio_files)
+
+    def save(self) -> None:
+        mkdir(self.index_file.parent)
+        temporary_file = self.index_file.with_name(".{}.{}".format(self.index_file.name, os.getpid()))
+        with temporary_file.open('w', encoding='utf8') as f:
+            json.dump(self._entries, f)
+        os.replace(str(temporary_file), str(self.index_file))
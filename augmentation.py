@@ -0,0 +1,180 @@
+"""
+Data augmentation applied while preparing training batches, i. e. in the thread or process producing
+batches rather than in the training step:
+
+ * SpecAugment: frequency and time masks, drawn for all examples at once and combined into one mask
+   that is applied to the padded batch in place, leaving the padding untouched.
+ * Waveform perturbation: speed change by resampling and additive noise from a precomputed noise bank.
+   The spectrograms of perturbed examples are calculated from their audio, bypassing the spectrogram cache.
+
+Each worker producing batches uses its own random generator, seeded by (seed, worker index), so that workers
+draw different augmentations and a run can be reproduced. Time spent is recorded as "augmentation" metric.
+"""
+import copy
+from pathlib import Path
+
+import numpy
+from numpy import ndarray
+from numpy.random import RandomState
+from typing import List, Optional, Tuple
+
+from instrumentation import metrics
+from spectrogram_batch import LabeledSpectrogram
+
+
+class SpecAugment:
+    """
+    Masks frequency_mask_count bands of up to max_frequency_mask_width frequencies and time_mask_count spans of
+    up to max_time_mask_fraction of the length of each example with mask_value, 0 being the mean of
+    z-normalized spectrograms.
+    """
+
+    def __init__(self, frequency_mask_count: int = 2, max_frequency_mask_width: int = 27, time_mask_count: int = 2,
+                 max_time_mask_fraction: float = .05, mask_value: float = 0.):
+        self.frequency_mask_count = frequency_mask_count
+        self.max_frequency_mask_width = max_frequency_mask_width
+        self.time_mask_count = time_mask_count
+        self.max_time_mask_fraction = max_time_mask_fraction
+        self.mask_value = mask_value
+
+    @staticmethod
+    def _span_masks(random: RandomState, sizes: ndarray, max_widths: ndarray, axis_length: int) -> ndarray:
+        """Boolean masks of shape (example, axis_length), each with one random span within the example's size."""
+        widths = (random.random_sample(len(sizes)) * (numpy.minimum(max_widths, sizes) + 1)).astype(numpy.int64)
+        starts = (random.random_sample(len(sizes)) * (sizes - widths + 1)).astype(numpy.int64)
+        positions = numpy.arange(axis_length)[None, :]
+        return (positions >= starts[:, None]) & (positions < (starts + widths)[:, None])
+
+    def apply(self, input_batch: ndarray, input_lengths: List[int], random: RandomState) -> None:
+        """Masks the batch of shape (example, time, frequency) in place."""
+        batch_size, time_step_count, frequency_count = input_batch.shape
+        lengths = numpy.array(input_lengths)
+        keep = numpy.ones((batch_size, time_step_count, frequency_count), dtype=bool)
+        for _ in range(self.frequency_mask_count):
+            keep &= ~self._span_masks(random, sizes=numpy.full(batch_size, frequency_count),
+                                      max_widths=numpy.full(batch_size, self.max_frequency_mask_width),
+                                      axis_length=frequency_count)[:, None, :]
+        for _ in range(self.time_mask_count):
+            keep &= ~self._span_masks(random, sizes=lengths,
+                                      max_widths=(lengths * self.max_time_mask_fraction).astype(numpy.int64),
+                                      axis_length=time_step_count)[:, :, None]
+
+        within_lengths = numpy.arange(time_step_count)[None, :] < lengths[:, None]
+        numpy.putmask(input_batch, ~keep & within_lengths[:, :, None], self.mask_value)
+
+
+class NoiseBank:
+    """Noise recordings concatenated to one array of samples, from which segments are drawn at random positions."""
+
+    def __init__(self, samples: ndarray):
+        if samples.ndim != 1 or len(samples) == 0:
+            raise ValueError("Expected a non-empty array of samples.")
+
+        self.samples = samples.astype(numpy.float32, copy=False)
+
+    @staticmethod
+    def from_audio_files(audio_files: List[Path], sample_rate: int = 16000) -> 'NoiseBank':
+        import librosa
+
+        return NoiseBank(numpy.concatenate([librosa.load(str(file), sr=sample_rate)[0] for file in audio_files]))
+
+    def save(self, path: Path) -> None:
+        """Saves the decoded samples, so that workers load them without decoding audio."""
+        numpy.save(str(path), self.samples)
+
+    @staticmethod
+    def load(path: Path) -> 'NoiseBank':
+        return NoiseBank(numpy.load(str(path), mmap_mode='r'))
+
+    def segment(self, length: int, random: RandomState) -> ndarray:
+        if length <= len(self.samples):
+            start = random.randint(0, len(self.samples) - length + 1)
+            return numpy.asarray(self.samples[start:start + length])
+
+        return numpy.resize(numpy.asarray(self.samples), length)
+
+
+class WaveformAugmentation:
+    """
+    Changes speed (and with it pitch) by one of speed_factors and, if a noise bank is given, adds noise with
+    probability noise_probability at a signal-to-noise ratio drawn from snr_range_in_db.
+    """
+
+    def __init__(self, speed_factors: Tuple[float, ...] = (.9, 1., 1.1), noise_bank: Optional[NoiseBank] = None,
+                 noise_probability: float = .5, snr_range_in_db: Tuple[float, float] = (10., 30.)):
+        self.speed_factors = speed_factors
+        self.noise_bank = noise_bank
+        self.noise_probability = noise_probability
+        self.snr_range_in_db = snr_range_in_db
+
+    @staticmethod
+    def change_speed(audio: ndarray, factor: float) -> ndarray:
+        if factor == 1.:
+            return audio
+
+        positions = numpy.arange(int(len(audio) / factor)) * factor
+        return numpy.interp(positions, numpy.arange(len(audio)), audio).astype(audio.dtype, copy=False)
+
+    def add_noise(self, audio: ndarray, snr_in_db: float, random: RandomState) -> ndarray:
+        noise = self.noise_bank.segment(len(audio), random)
+        signal_power = numpy.mean(numpy.square(audio, dtype=numpy.float64))
+        noise_power = numpy.mean(numpy.square(noise, dtype=numpy.float64))
+        if noise_power == 0:
+            return audio
+
+        scale = numpy.sqrt(signal_power / (noise_power * 10 ** (snr_in_db / 10)))
+        return (audio + scale * noise).astype(audio.dtype, copy=False)
+
+    def apply(self, audio: ndarray, random: RandomState) -> ndarray:
+        perturbed = self.change_speed(audio, self.speed_factors[random.randint(len(self.speed_factors))])
+        if self.noise_bank is not None and random.random_sample() < self.noise_probability:
+            perturbed = self.add_noise(perturbed, snr_in_db=random.uniform(*self.snr_range_in_db), random=random)
+
+        return perturbed
+
+
+class Augmentation:
+    """
+    :param waveform_probability: Probability that an example is perturbed on waveform level.
+    Only examples that provide their LabeledExample as example attribute, like CachedLabeledSpectrogram, can be.
+    """
+
+    def __init__(self, spec_augment: Optional[SpecAugment] = SpecAugment(),
+                 waveform_augmentation: Optional[WaveformAugmentation] = None,
+                 waveform_probability: float = .5, seed: int = 0, worker_index: int = 0):
+        self.spec_augment = spec_augment
+        self.waveform_augmentation = waveform_augmentation
+        self.waveform_probability = waveform_probability
+        self.seed = seed
+        self.worker_index = worker_index
+        self.random = RandomState([seed, worker_index])
+
+    def for_worker(self, worker_index: int) -> 'Augmentation':
+        """The same augmentation with a random generator of its own for the given worker, e. g. the rank."""
+        return Augmentation(spec_augment=self.spec_augment, waveform_augmentation=self.waveform_augmentation,
+                            waveform_probability=self.waveform_probability, seed=self.seed,
+                            worker_index=worker_index)
+
+    def _perturbed_spectrogram(self, labeled_spectrogram: LabeledSpectrogram) -> ndarray:
+        with metrics.timed("augmentation"):
+            example = copy.copy(labeled_spectrogram.example)
+            # decoded by the copy, so that the audio is not kept by the example the generator holds for the whole run,
+            # and then overridden with the perturbed audio:
+            example.raw_audio = self.waveform_augmentation.apply(example.raw_audio, self.random)
+            return example.z_normalized_transposed_spectrogram()
+
+    def spectrograms(self, labeled_spectrogram_batch: List[LabeledSpectrogram]) -> List[ndarray]:
+        if self.waveform_augmentation is None:
+            return [x.spectrogram() for x in labeled_spectrogram_batch]
+
+        perturbed = [hasattr(x, "example") and self.random.random_sample() < self.waveform_probability
+                     for x in labeled_spectrogram_batch]
+        return [self._perturbed_spectrogram(x) if is_perturbed else x.spectrogram()
+                for x, is_perturbed in zip(labeled_spectrogram_batch, perturbed)]
+
+    def mask_batch(self, input_batch: ndarray, input_lengths: List[int]) -> None:
+        if self.spec_augment is None:
+            return
+
+        with metrics.timed("augmentation"):
+            self.spec_augment.apply(input_batch, input_lengths, self.random)
@@ -0,0 +1,234 @@
+"""
+Times the hot paths of the data pipeline on a deterministic synthetic corpus, so that no downloaded corpus is needed.
+
+    python3 benchmark.py run --output benchmark-results.json
+    python3 benchmark.py compare benchmark-baseline.json benchmark-results.json
+
+compare exits with status 1 if any benchmark got slower than the baseline by more than the tolerance.
+"""
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy
+from numpy import ndarray
+from typing import Callable, Dict, List, Tuple
+
+from tools import mkdir, write_text
+
+_vocabulary = ["hallo", "welt", "sprache", "erkennung", "guten", "morgen", "the", "quick", "brown", "fox", "jumps",
+               "over", "lazy", "dog", "speech", "recognition"]
+
+
+class SyntheticCorpus:
+    """
+    Generates tones with noise as audio files together with transcripts in the layouts of LibriSpeech
+    (FLAC, .trans.txt) and the CLARIN corpora (WAV at 44.1kHz, _annot.json), deterministically given the seed.
+    """
+
+    librispeech_corpus_name = "synthetic-librispeech"
+    clarin_corpus_name = "synthetic-clarin"
+
+    def __init__(self, base_directory: Path, example_count: int = 20, seed: int = 42,
+                 min_duration_in_s: float = 1., max_duration_in_s: float = 4.):
+        self.base_directory = base_directory
+        self.example_count = example_count
+        self.seed = seed
+        self.min_duration_in_s = min_duration_in_s
+        self.max_duration_in_s = max_duration_in_s
+
+    def _audio(self, random_state: numpy.random.RandomState, sample_rate: int) -> ndarray:
+        duration_in_s = random_state.uniform(self.min_duration_in_s, self.max_duration_in_s)
+        t = numpy.arange(int(duration_in_s * sample_rate)) / sample_rate
+        tones = sum(random_state.uniform(.05, .2) * numpy.sin(2 * numpy.pi * random_state.uniform(100, 4000) * t)
+                    for _ in range(3))
+        return (tones + random_state.normal(0, .01, t.shape)).astype(numpy.float32)
+
+    def _labels(self) -> List[str]:
+        random_generator = random.Random(self.seed)
+        return [" ".join(random_generator.choice(_vocabulary) for _ in range(random_generator.randint(2, 8)))
+                for _ in range(self.example_count)]
+
+    def create(self) -> 'SyntheticCorpus':
+        import soundfile
+
+        random_state = numpy.random.RandomState(self.seed)
+        labels = self._labels()
+
+        # LibriSpeech: corpus/corpus/speaker/chapter/speaker-chapter-index.flac
+        chapter_directory = self.base_directory / self.librispeech_corpus_name / self.librispeech_corpus_name / \
+                            "1" / "100"
+        mkdir(chapter_directory)
+        transcript_lines = []
+        for index, label in enumerate(labels):
+            id = "1-100-{:04}".format(index)
+            soundfile.write(str(chapter_directory / "{}.flac".format(id)), self._audio(random_state, 16000), 16000)
+            transcript_lines.append("{} {}\n".format(id, label.upper()))
+        write_text(chapter_directory / "1-100.trans.txt", "".join(transcript_lines), encoding='utf8')
+
+        # CLARIN: corpus/session/speaker/id.wav with id_annot.json
+        speaker_directory = self.base_directory / self.clarin_corpus_name / "session" / "speaker"
+        mkdir(speaker_directory)
+        for index, label in enumerate(labels):
+            id = "synthetic{:04}".format(index)
+            soundfile.write(str(speaker_directory / "{}.wav".format(id)), self._audio(random_state, 44100), 44100,
+                            subtype='PCM_16')
+            annotation = {"levels": [{"items": [{"labels": [{"name": "ORT", "value": word}]}
+                                                for word in label.split()]}]}
+            write_text(speaker_directory / "{}_annot.json".format(id), json.dumps(annotation), encoding='utf8')
+
+        return self
+
+    def librispeech_provider(self):
+        from corpus_provider import CorpusProvider
+
+        return CorpusProvider(self.base_directory, corpus_names=[self.librispeech_corpus_name])
+
+    def clarin_provider(self):
+        from german_corpus_provider import GermanClarinCorpusProvider
+
+        return GermanClarinCorpusProvider(self.clarin_corpus_name, self.base_directory)
+
+
+def time_function(function: Callable[[], object], repeat: int) -> Dict[str, float]:
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+
+    return {"min_s": min(durations), "median_s": float(numpy.median(durations)), "repeat": repeat}
+
+
+def python_command(code: str) -> Callable[[], object]:
+    """Runs the code in a new interpreter in this directory, e. g. to time imports including interpreter start."""
+    return lambda: subprocess.check_call([sys.executable, "-c", code], cwd=str(Path(__file__).parent))
+
+
+def benchmarks(corpus: SyntheticCorpus, cache_directory: Path) -> List[Tuple[str, Callable[[], object]]]:
+    from grapheme_enconding import CtcGraphemeEncoding
+    from labeled_example import LabeledExample
+    from spectrogram_batch import CachedLabeledSpectrogram, input_batch_and_prediction_lengths
+
+    provider = corpus.librispeech_provider()
+    examples = provider.examples_at(range(len(provider.table)))
+    example = examples[0]
+    cached = CachedLabeledSpectrogram(example, spectrogram_cache_directory=cache_directory)
+    cached.spectrogram()
+
+    spectrograms = [CachedLabeledSpectrogram(e, spectrogram_cache_directory=cache_directory).spectrogram()
+                    for e in examples]
+    encoding = CtcGraphemeEncoding()
+    labels = [e.label for e in examples]
+    input_batch, prediction_lengths = input_batch_and_prediction_lengths(spectrograms,
+                                                                         input_to_prediction_length_ratio=2)
+    prediction_batch = numpy.random.RandomState(corpus.seed).uniform(
+        size=(len(spectrograms), input_batch.shape[1] // 2, encoding.grapheme_set_size))
+
+    def spectrogram_of_fresh_example():
+        # LabeledExample keeps decoded audio, so a fresh one includes decoding:
+        return LabeledExample(example.audio_file).z_normalized_transposed_spectrogram()
+
+    return [
+        ("interpreter_start", python_command("pass")),
+        ("import_main", python_command("import main")),
+        ("import_corpus_providers", python_command("import corpus_provider, german_corpus_provider")),
+        ("import_labeled_example_with_librosa", python_command("import labeled_example, librosa")),
+        ("corpus_provider_librispeech", corpus.librispeech_provider),
+        ("corpus_provider_clarin", corpus.clarin_provider),
+        ("labeled_example_spectrogram", spectrogram_of_fresh_example),
+        ("cached_labeled_spectrogram_load", cached.spectrogram),
+        ("input_batch_and_prediction_lengths",
+         lambda: input_batch_and_prediction_lengths(spectrograms, input_to_prediction_length_ratio=2)),
+        ("encode_label_batch", lambda: encoding.encode_label_batch(labels)),
+        ("decode_prediction_batch",
+         lambda: encoding.decode_prediction_batch(prediction_batch, prediction_lengths=prediction_lengths)),
+    ]
+
+
+def run(example_count: int = 20, repeat: int = 5) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = SyntheticCorpus(Path(directory) / "corpus", example_count=example_count).create()
+        cache_directory = Path(directory) / "spectrogram-cache"
+        mkdir(cache_directory)
+
+        results = dict((name, time_function(function, repeat=repeat))
+                       for name, function in benchmarks(corpus, cache_directory=cache_directory))
+
+    return {
+        "example_count": example_count,
+        "environment": {"python": platform.python_version(), "numpy": numpy.__version__,
+                        "machine": platform.machine()},
+        "benchmarks": results
+    }
+
+
+def regressions(baseline: dict, current: dict, tolerance: float = .2) -> List[str]:
+    """
+    :return: Descriptions of all benchmarks whose median got slower than the baseline by more than the tolerance.
+    """
+    result = []
+    for name, baseline_result in sorted(baseline["benchmarks"].items()):
+        current_result = current["benchmarks"].get(name)
+        if current_result is None:
+            continue
+
+        ratio = current_result["median_s"] / baseline_result["median_s"]
+        if ratio > 1 + tolerance:
+            result.append("{}: {:.4f}s -> {:.4f}s ({:+.0%})".format(
+                name, baseline_result["median_s"], current_result["median_s"], ratio - 1))
+
+    return result
+
+
+def summary(results: dict) -> str:
+    return "\n".join("{:40} median {:9.4f}s  min {:9.4f}s".format(name, result["median_s"], result["min_s"])
+                     for name, result in sorted(results["benchmarks"].items()))
+
+
+def main(arguments: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks the speechless data pipeline on a synthetic corpus.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    run_parser = subparsers.add_parser("run")
+    run_parser.add_argument("--output", type=Path, help="JSON file to write the results to.")
+    run_parser.add_argument("--example-count", type=int, default=20)
+    run_parser.add_argument("--repeat", type=int, default=5)
+
+    compare_parser = subparsers.add_parser("compare")
+    compare_parser.add_argument("baseline", type=Path)
+    compare_parser.add_argument("current", type=Path)
+    compare_parser.add_argument("--tolerance", type=float, default=.2,
+                                help="Relative slowdown of the median above which a benchmark counts as regression.")
+
+    args = parser.parse_args(arguments)
+
+    if args.command == "run":
+        results = run(example_count=args.example_count, repeat=args.repeat)
+        print(summary(results))
+        if args.output is not None:
+            with args.output.open('w', encoding='utf8') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        return 0
+
+    if args.command == "compare":
+        def load(path: Path) -> dict:
+            with path.open(encoding='utf8') as f:
+                return json.load(f)
+
+        found_regressions = regressions(load(args.baseline), load(args.current), tolerance=args.tolerance)
+        print("\n".join(["Regressions:"] + found_regressions) if found_regressions else "No regressions.")
+        return 1 if found_regressions else 0
+
+    parser.print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
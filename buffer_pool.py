@@ -0,0 +1,144 @@
+"""
+Preallocated arrays for padded batches, so that preparing a batch does not allocate and zero
+a new (batch, time, features) array every time.
+
+Batches in pooled buffers are padded to the rounded length of their size class; the lengths passed along with
+a batch, like the prediction lengths, carry the real lengths.
+
+Ownership contract: arrays are handed out by a BufferLease, and the holder of the lease owns them
+until calling release(). Afterwards they may be handed out again and overwritten by another batch,
+so neither the arrays nor views of them may be used after releasing. During training, Keras prefetches
+batches from the generator in another thread; the generator therefore hands each lease to InFlightLeases,
+which releases it only when Keras has finished the training step with that batch.
+"""
+from collections import deque, defaultdict
+from threading import Lock
+
+import numpy
+from numpy import ndarray
+from typing import Tuple, List, Dict, Optional
+
+from instrumentation import metrics
+
+
+class BufferPool:
+    """
+    Free buffers by size class. The time dimension (second axis) is rounded up to a multiple of
+    length_granularity, so batches of similar length share buffers; other dimensions must match exactly.
+    """
+
+    def __init__(self, length_granularity: int = 32, max_free_buffers_per_size_class: int = 16):
+        self.length_granularity = length_granularity
+        self.max_free_buffers_per_size_class = max_free_buffers_per_size_class
+        self._free_buffers_by_size_class = defaultdict(list)  # type: Dict[tuple, List[ndarray]]
+        self._lock = Lock()
+        self.allocation_count = 0
+        self.reuse_count = 0
+
+    def size_class(self, shape: Tuple[int, ...], dtype) -> tuple:
+        if len(shape) < 2:
+            return (numpy.dtype(dtype).str,) + tuple(shape)
+
+        rounded_length = -(-shape[1] // self.length_granularity) * self.length_granularity
+        return (numpy.dtype(dtype).str, shape[0], rounded_length) + tuple(shape[2:])
+
+    def lease(self) -> 'BufferLease':
+        return BufferLease(self)
+
+    def _take(self, shape: Tuple[int, ...], dtype) -> ndarray:
+        size_class = self.size_class(shape, dtype)
+        with self._lock:
+            free_buffers = self._free_buffers_by_size_class[size_class]
+            buffer = free_buffers.pop() if free_buffers else None
+            if buffer is None:
+                self.allocation_count += 1
+            else:
+                self.reuse_count += 1
+
+        if buffer is None:
+            buffer = numpy.empty(size_class[1:], dtype=size_class[0])
+            metrics.count("batch_buffer_allocations")
+        else:
+            metrics.count("batch_buffer_reuses")
+
+        return buffer
+
+    def _give_back(self, buffer: ndarray) -> None:
+        with self._lock:
+            free_buffers = self._free_buffers_by_size_class[self.size_class(buffer.shape, buffer.dtype)]
+            if len(free_buffers) < self.max_free_buffers_per_size_class:
+                free_buffers.append(buffer)
+
+    def free_buffer_count(self) -> int:
+        with self._lock:
+            return sum(len(buffers) for buffers in self._free_buffers_by_size_class.values())
+
+
+class BufferLease:
+    """Arrays of one batch, owned by the holder until release(). Contents of the arrays are not initialized."""
+
+    def __init__(self, pool: BufferPool):
+        self.pool = pool
+        self._buffers = []  # type: List[ndarray]
+        self.released = False
+
+    def array(self, shape: Tuple[int, ...], dtype) -> ndarray:
+        """
+        A whole pooled buffer of the size class of the given shape, i. e. with the time axis rounded up,
+        and thus C-contiguous as expected by Keras. Callers have to fill the padding beyond the requested length.
+        """
+        if self.released:
+            raise RuntimeError("Lease was already released.")
+
+        buffer = self.pool._take(tuple(shape), dtype)
+        self._buffers.append(buffer)
+        return buffer
+
+    def release(self) -> None:
+        if self.released:
+            raise RuntimeError("Lease was already released.")
+
+        self.released = True
+        for buffer in self._buffers:
+            self.pool._give_back(buffer)
+        self._buffers = []
+
+    def __enter__(self) -> 'BufferLease':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class InFlightLeases:
+    """
+    Leases of batches yielded to Keras, in order. Keras consumes batches in the order they were generated,
+    so the oldest lease belongs to the batch of the training step that just ended.
+    """
+
+    def __init__(self):
+        self._leases = deque()  # type: deque
+        self._lock = Lock()
+
+    def hand_over(self, lease: BufferLease) -> None:
+        """Called by the generator before yielding the batch."""
+        with self._lock:
+            self._leases.append(lease)
+
+    def step_finished(self) -> None:
+        """Called after a training step, releases the lease of its batch."""
+        with self._lock:
+            lease = self._leases.popleft() if self._leases else None  # type: Optional[BufferLease]
+        if lease is not None:
+            lease.release()
+
+    def release_all(self) -> None:
+        with self._lock:
+            leases = list(self._leases)
+            self._leases.clear()
+        for lease in leases:
+            lease.release()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._leases)
@@ -0,0 +1,137 @@
+"""
+Cache entries shared by several processes or nodes, e. g. over a network file system.
+
+Entries are written to a temporary file with a name unique to host, process and thread, and then renamed,
+so readers never see partial entries. A worker missing an entry first creates a claim file next to it
+exclusively; only the worker that succeeds computes the entry, while the others wait for it to appear.
+Claims of crashed workers are taken over once they are older than stale_after_s.
+"""
+import socket
+import threading
+import time
+from pathlib import Path
+
+import numpy
+import os
+from numpy import ndarray
+from typing import Callable, TypeVar, Optional
+
+from instrumentation import metrics
+
+T = TypeVar('T')
+
+
+def _unique_suffix() -> str:
+    return "{}.{}.{}".format(socket.gethostname(), os.getpid(), threading.get_ident())
+
+
+def save_array_atomically(path: Path, array: ndarray) -> None:
+    temporary_file = path.with_name(".{}.{}{}".format(path.stem, _unique_suffix(), path.suffix))
+    try:
+        numpy.save(str(temporary_file), array)
+        os.replace(str(temporary_file), str(path))
+    except BaseException:
+        if temporary_file.exists():
+            temporary_file.unlink()
+        raise
+
+
+class CacheEntryClaim:
+    def __init__(self, entry_file: Path, stale_after_s: float = 600.):
+        self.claim_file = entry_file.with_name(entry_file.name + ".claim")
+        self.stale_after_s = stale_after_s
+        self.acquired = False
+
+    def try_acquire(self) -> bool:
+        for _ in range(2):
+            try:
+                descriptor = os.open(str(self.claim_file), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self.is_stale():
+                    return False
+
+                # Another worker finding it stale at the same time may remove the claim this one creates next,
+                # so that both compute the entry; saving atomically keeps that safe.
+                self._remove()
+                continue
+
+            with os.fdopen(descriptor, 'w') as f:
+                f.write(_unique_suffix())
+            self.acquired = True
+            return True
+
+        return False
+
+    def is_stale(self) -> bool:
+        try:
+            return time.time() - os.stat(str(self.claim_file)).st_mtime > self.stale_after_s
+        except FileNotFoundError:
+            return False
+
+    def exists(self) -> bool:
+        return self.claim_file.exists()
+
+    def _remove(self) -> None:
+        try:
+            self.claim_file.unlink()
+        except FileNotFoundError:
+            pass
+
+    def release(self) -> None:
+        if self.acquired:
+            self._remove()
+            self.acquired = False
+
+
+def load_or_compute_once(entry_file: Path, load: Callable[[], T], compute_and_save: Callable[[], T],
+                         wait_timeout_s: float = 120., poll_interval_s: float = .05,
+                         stale_after_s: float = 600., metric_prefix: str = "cache") -> T:
+    """
+    Loads the entry if it exists, otherwise computes and saves it if no other worker claimed it,
+    and otherwise waits for the other worker to save it.
+    :param load: Raises ValueError for corrupt entries, which are then recomputed.
+    :param compute_and_save: Has to save atomically, e. g. with save_array_atomically. Also called if the entry
+    did not appear within wait_timeout_s, e. g. because the claiming worker is slow.
+    """
+    claim = CacheEntryClaim(entry_file, stale_after_s=stale_after_s)
+    waiting_since = None  # type: Optional[float]
+    corrupt = False
+
+    def try_load() -> Optional[T]:
+        nonlocal corrupt
+        if not entry_file.exists():
+            return None
+        try:
+            return load()
+        except FileNotFoundError:
+            # evicted in the meantime, see cache_maintenance:
+            return None
+        except ValueError:
+            print("Recalculating cached file {} because loading failed.".format(entry_file))
+            corrupt = True
+            return None
+
+    while True:
+        # while another worker recomputes a corrupt entry, only reload once it released its claim:
+        if not corrupt or not claim.exists():
+            corrupt = False
+            loaded = try_load()
+            if loaded is not None:
+                return loaded
+
+        if claim.try_acquire():
+            try:
+                # the entry may have been saved since it was checked above:
+                loaded = None if corrupt else try_load()
+                return loaded if loaded is not None else compute_and_save()
+            finally:
+                claim.release()
+
+        if waiting_since is None:
+            waiting_since = time.time()
+            metrics.count("{}_waits".format(metric_prefix))
+        elif time.time() - waiting_since > wait_timeout_s:
+            metrics.count("{}_wait_timeouts".format(metric_prefix))
+            return compute_and_save()
+
+        time.sleep(poll_interval_s)
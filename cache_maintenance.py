@@ -0,0 +1,227 @@
+"""
+Keeps a spectrogram cache directory within a disk budget.
+
+Reads and writes of cache entries are recorded in an SQLite index in the cache directory (SQLite, since several
+training processes update it concurrently), buffered in memory and written in batches so that recording is cheap.
+CacheMaintenance then evicts the least recently used entries when the directory exceeds its budget, removes entries
+of examples that no CorpusProvider contains anymore, and reports sizes and hit rates by corpus.
+"""
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import closing
+from pathlib import Path
+from threading import Lock
+
+import os
+from typing import List, Dict, Iterable, Optional, Tuple
+
+from tools import mkdir
+
+_entry_suffix = ".npy"
+
+
+class CacheEntry:
+    def __init__(self, file_name: str, byte_count: int, last_access: float, hit_count: int = 0,
+                 miss_count: int = 0):
+        self.file_name = file_name
+        self.byte_count = byte_count
+        self.last_access = last_access
+        self.hit_count = hit_count
+        self.miss_count = miss_count
+
+    @property
+    def id(self) -> str:
+        return self.file_name[:-len(_entry_suffix)] if self.file_name.endswith(_entry_suffix) else self.file_name
+
+
+class CacheIndex:
+    """
+    Byte count, last access time, hits and misses of the entries of a cache directory.
+    Accesses are kept in memory until flush_every are pending or flush() is called.
+    """
+
+    file_name = "index.sqlite"
+
+    def __init__(self, cache_directory: Path, flush_every: int = 256, timeout_s: float = 60.):
+        self.cache_directory = cache_directory
+        self.database_file = cache_directory / self.file_name
+        self.flush_every = flush_every
+        self.timeout_s = timeout_s
+        self._pending = OrderedDict()  # type: Dict[str, Tuple[int, float, int, int]]
+        self._lock = Lock()
+        mkdir(cache_directory)
+        with closing(self._connect()) as connection, connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS entries (file_name TEXT PRIMARY KEY, "
+                               "byte_count INTEGER NOT NULL, last_access REAL NOT NULL, "
+                               "hit_count INTEGER NOT NULL DEFAULT 0, miss_count INTEGER NOT NULL DEFAULT 0)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # a connection per use, since the index is used from several threads:
+        return sqlite3.connect(str(self.database_file), timeout=self.timeout_s)
+
+    def record_access(self, file_name: str, byte_count: int, hit: bool, at: Optional[float] = None) -> None:
+        with self._lock:
+            _, _, hit_count, miss_count = self._pending.get(file_name, (0, 0., 0, 0))
+            self._pending[file_name] = (byte_count, time.time() if at is None else at,
+                                        hit_count + int(hit), miss_count + int(not hit))
+            should_flush = len(self._pending) >= self.flush_every
+
+        if should_flush:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            pending = list(self._pending.items())
+            self._pending.clear()
+
+        if not pending:
+            return
+
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                "INSERT INTO entries (file_name, byte_count, last_access, hit_count, miss_count) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT(file_name) DO UPDATE SET "
+                "byte_count = excluded.byte_count, last_access = max(last_access, excluded.last_access), "
+                "hit_count = hit_count + excluded.hit_count, miss_count = miss_count + excluded.miss_count",
+                [(file_name,) + values for file_name, values in pending])
+
+    def entries(self) -> List[CacheEntry]:
+        self.flush()
+        with closing(self._connect()) as connection:
+            return [CacheEntry(*row) for row in connection.execute(
+                "SELECT file_name, byte_count, last_access, hit_count, miss_count FROM entries")]
+
+    def add_unrecorded(self, entries: Iterable[CacheEntry]) -> None:
+        """Adds entries written before the index existed, keeping recorded ones as they are."""
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO entries (file_name, byte_count, last_access) VALUES (?, ?, ?)",
+                [(e.file_name, e.byte_count, e.last_access) for e in entries])
+
+    def remove(self, file_names: Iterable[str]) -> None:
+        self.flush()
+        with closing(self._connect()) as connection, connection:
+            connection.executemany("DELETE FROM entries WHERE file_name = ?", [(name,) for name in file_names])
+
+
+class CorpusCacheStatistics:
+    def __init__(self, corpus: str, entries: List[CacheEntry]):
+        self.corpus = corpus
+        self.entry_count = len(entries)
+        self.byte_count = sum(e.byte_count for e in entries)
+        self.hit_count = sum(e.hit_count for e in entries)
+        self.miss_count = sum(e.miss_count for e in entries)
+
+    @property
+    def hit_rate(self) -> Optional[float]:
+        accesses = self.hit_count + self.miss_count
+        return self.hit_count / accesses if accesses else None
+
+    def __str__(self):
+        return "{}: {} entries, {:.1f} MB, {} hits, {} misses, hit rate {}".format(
+            self.corpus, self.entry_count, self.byte_count / 1e6, self.hit_count, self.miss_count,
+            "{:.1%}".format(self.hit_rate) if self.hit_rate is not None else "unknown")
+
+
+class CacheMaintenance:
+    """
+    Entries are named by example id. Methods taking corpora_by_name expect the ids of the examples of each corpus,
+    e. g. from corpus_ids_by_name; entries of ids in none of them are considered orphaned,
+    e. g. left from removed corpora or changed id filters.
+    """
+
+    orphaned_corpus_name = "(orphaned)"
+
+    def __init__(self, cache_directory: Path, disk_budget_bytes: Optional[int] = None,
+                 index: Optional[CacheIndex] = None):
+        self.cache_directory = cache_directory
+        self.disk_budget_bytes = disk_budget_bytes
+        self.index = index if index is not None else CacheIndex(cache_directory)
+
+    def synchronize(self) -> List[CacheEntry]:
+        """
+        Adds entries on disk missing in the index with their modification time as last access,
+        removes index entries whose file was deleted, and returns all entries.
+        """
+        files_on_disk = dict((file.name, file) for file in self.cache_directory.iterdir()
+                             if file.name.endswith(_entry_suffix) and not file.name.startswith("."))
+        indexed = self.index.entries()
+        indexed_names = set(e.file_name for e in indexed)
+
+        unrecorded = []
+        for name, file in files_on_disk.items():
+            if name not in indexed_names:
+                status = file.stat()
+                unrecorded.append(CacheEntry(name, byte_count=status.st_size, last_access=status.st_mtime))
+        self.index.add_unrecorded(unrecorded)
+        self.index.remove(name for name in indexed_names if name not in files_on_disk)
+
+        return [e for e in indexed if e.file_name in files_on_disk] + unrecorded
+
+    def _delete(self, entries: List[CacheEntry]) -> int:
+        for entry in entries:
+            try:
+                (self.cache_directory / entry.file_name).unlink()
+            except FileNotFoundError:
+                pass
+        self.index.remove(e.file_name for e in entries)
+
+        return sum(e.byte_count for e in entries)
+
+    def evict_to_budget(self) -> List[CacheEntry]:
+        """Deletes least recently used entries until the total size is within the budget. Returns them."""
+        entries = sorted(self.synchronize(), key=lambda e: e.last_access)
+        total = sum(e.byte_count for e in entries)
+        evicted = []
+        for entry in entries:
+            if self.disk_budget_bytes is None or total <= self.disk_budget_bytes:
+                break
+            evicted.append(entry)
+            total -= entry.byte_count
+
+        self._delete(evicted)
+        return evicted
+
+    def collect_garbage(self, corpora_by_name: Dict[str, Iterable[str]],
+                        stale_temporary_file_age_s: float = 3600.) -> List[CacheEntry]:
+        """
+        Deletes entries of ids in none of the corpora, and temporary or claim files left by crashed writers.
+        Returns the deleted entries.
+        """
+        known_ids = set(id for ids in corpora_by_name.values() for id in ids)
+        orphaned = [e for e in self.synchronize() if e.id not in known_ids]
+        self._delete(orphaned)
+
+        now = time.time()
+        for file in self.cache_directory.iterdir():
+            if (file.name.startswith(".") and file.name.endswith(_entry_suffix)) or file.name.endswith(".claim"):
+                try:
+                    if now - file.stat().st_mtime > stale_temporary_file_age_s:
+                        os.remove(str(file))
+                except FileNotFoundError:
+                    pass
+
+        return orphaned
+
+    def statistics(self, corpora_by_name: Dict[str, Iterable[str]]) -> List[CorpusCacheStatistics]:
+        corpus_name_by_id = dict((id, name) for name, ids in corpora_by_name.items() for id in ids)
+        entries_by_corpus = OrderedDict((name, []) for name in list(corpora_by_name.keys()) +
+                                        [self.orphaned_corpus_name])  # type: Dict[str, List[CacheEntry]]
+        for entry in self.synchronize():
+            entries_by_corpus[corpus_name_by_id.get(entry.id, self.orphaned_corpus_name)].append(entry)
+
+        return [CorpusCacheStatistics(name, entries) for name, entries in entries_by_corpus.items()]
+
+    def report(self, corpora_by_name: Dict[str, Iterable[str]]) -> str:
+        statistics = self.statistics(corpora_by_name)
+        total = sum(s.byte_count for s in statistics)
+        budget = "{:.1f} MB".format(self.disk_budget_bytes / 1e6) if self.disk_budget_bytes is not None else "none"
+        return "\n".join(["{}: {:.1f} MB, budget {}".format(self.cache_directory, total / 1e6, budget)] +
+                         ["\t{}".format(s) for s in statistics])
+
+
+def corpus_ids_by_name(corpus_providers: Iterable['CorpusProvider']) -> Dict[str, List[str]]:
+    """Example ids of each provider, named by its corpus names, read from the table without creating examples."""
+    return OrderedDict((" ".join(provider.corpus_names), [row.id for row in provider.table])
+                       for provider in corpus_providers)
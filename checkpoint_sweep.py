@@ -0,0 +1,215 @@
+"""
+Evaluates many checkpoints of a training run in parallel worker processes.
+
+Validation spectrograms are loaded and padded to batches once, and saved as .npy files that the workers memory-map,
+so every worker only runs the network on data already prepared. Each worker builds its network once and
+then only swaps the weights for every epoch it evaluates.
+"""
+import json
+import multiprocessing
+import os
+import re
+from pathlib import Path
+
+import numpy
+from numpy import ndarray
+from typing import List, Iterable, Callable, Optional, Tuple
+
+from dtype_policy import default_dtype_policy, DtypePolicy
+from evaluation import Evaluator, EvaluationReport
+from spectrogram_batch import LabeledSpectrogram, input_batch_and_prediction_lengths
+from tools import mkdir
+
+_weights_file_pattern = re.compile(r"weights-epoch(\d+)\.h5$")
+
+
+def checkpoint_epochs(run_directory: Path, first_epoch: Optional[int] = None,
+                      last_epoch: Optional[int] = None) -> List[int]:
+    """Epochs of all weights-epoch{N}.h5 files in the run directory within the given range, sorted."""
+    epochs = [int(match.group(1)) for match in (_weights_file_pattern.match(file.name)
+                                                for file in run_directory.iterdir()) if match]
+    return sorted(epoch for epoch in epochs
+                  if (first_epoch is None or epoch >= first_epoch) and (last_epoch is None or epoch <= last_epoch))
+
+
+def _write_atomically(path: Path, write: Callable[[Path], None]) -> None:
+    """Writes to a temporary file renamed when complete, so that an interrupted write leaves no partial file."""
+    temporary_path = path.with_name(".{}.{}{}".format(path.stem, os.getpid(), path.suffix))
+    write(temporary_path)
+    os.replace(str(temporary_path), str(path))
+
+
+def _write_json(description: dict, path: Path) -> None:
+    with path.open('w', encoding='utf8') as f:
+        json.dump(description, f)
+
+
+class PreparedBatches:
+    """
+    Validation batches padded once and saved to a directory, with labels and unpadded lengths in batches.json.
+    Each batch is saved together with its own description, so that an interrupted preparation
+    resumes with the first batch not yet saved.
+    """
+
+    description_file_name = "batches.json"
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        with (directory / self.description_file_name).open(encoding='utf8') as f:
+            self.descriptions = json.load(f)["batches"]
+
+    @staticmethod
+    def prepare(labeled_spectrogram_batches: Iterable[List[LabeledSpectrogram]], directory: Path,
+                dtype_policy: DtypePolicy = default_dtype_policy) -> 'PreparedBatches':
+        mkdir(directory)
+        descriptions = []
+        for index, labeled_spectrogram_batch in enumerate(labeled_spectrogram_batches):
+            ids = [x.id() for x in labeled_spectrogram_batch]
+            description = PreparedBatches._prepared_description(directory, index, ids)
+            if description is None:
+                description = PreparedBatches._prepare_batch(labeled_spectrogram_batch, directory, index, dtype_policy)
+
+            descriptions.append(description)
+
+        _write_atomically(directory / PreparedBatches.description_file_name,
+                          lambda path: _write_json({"batches": descriptions}, path))
+
+        return PreparedBatches(directory)
+
+    @staticmethod
+    def _prepared_description(directory: Path, index: int, ids: List[str]) -> Optional[dict]:
+        """The description of the batch with the given index if it was saved before with the same examples."""
+        description_file = directory / "batch{}.json".format(index)
+        if not description_file.exists():
+            return None
+
+        with description_file.open(encoding='utf8') as f:
+            description = json.load(f)
+
+        return description if description["ids"] == ids and (directory / description["file_name"]).exists() else None
+
+    @staticmethod
+    def _prepare_batch(labeled_spectrogram_batch: List[LabeledSpectrogram], directory: Path, index: int,
+                       dtype_policy: DtypePolicy) -> dict:
+        spectrograms = [x.spectrogram() for x in labeled_spectrogram_batch]
+        input_lengths = [spectrogram.shape[0] for spectrogram in spectrograms]
+        input_batch, _ = input_batch_and_prediction_lengths(spectrograms, input_to_prediction_length_ratio=1,
+                                                            dtype=dtype_policy.compute_dtype)
+
+        file_name = "batch{}.npy".format(index)
+        description = {"file_name": file_name, "input_lengths": input_lengths,
+                       "ids": [x.id() for x in labeled_spectrogram_batch],
+                       "labels": [x.label() for x in labeled_spectrogram_batch]}
+
+        def save_batch(path: Path) -> None:
+            with path.open('wb') as f:
+                numpy.save(f, input_batch)
+
+        _write_atomically(directory / file_name, save_batch)
+        # written last, marking the batch as complete:
+        _write_atomically(directory / "batch{}.json".format(index), lambda path: _write_json(description, path))
+
+        return description
+
+    def __len__(self):
+        return len(self.descriptions)
+
+    def input_batch(self, index: int) -> ndarray:
+        return numpy.load(str(self.directory / self.descriptions[index]["file_name"]), mmap_mode='r')
+
+    def input_lengths(self, index: int) -> List[int]:
+        return self.descriptions[index]["input_lengths"]
+
+    def labels(self, index: int) -> List[str]:
+        return self.descriptions[index]["labels"]
+
+
+class CheckpointEvaluation:
+    def __init__(self, epoch: int, loss: Optional[float], character_error_rate: float, word_error_rate: float):
+        self.epoch = epoch
+        self.loss = loss
+        self.character_error_rate = character_error_rate
+        self.word_error_rate = word_error_rate
+
+    @staticmethod
+    def from_report(epoch: int, report: EvaluationReport) -> 'CheckpointEvaluation':
+        return CheckpointEvaluation(epoch=epoch, loss=report.loss, character_error_rate=report.character_error_rate,
+                                    word_error_rate=report.word_error_rate)
+
+    def as_dict(self) -> dict:
+        return {"epoch": self.epoch, "loss": self.loss, "character_error_rate": self.character_error_rate,
+                "word_error_rate": self.word_error_rate}
+
+
+def evaluate_prepared(model, prepared_batches: PreparedBatches) -> EvaluationReport:
+    """
+    :param model: Provides prediction_batch, input_to_prediction_length_ratio and grapheme_encoding like Wav2Letter.
+    """
+    evaluator = Evaluator(model.grapheme_encoding)
+    example_evaluations = []
+    for index in range(len(prepared_batches)):
+        prediction_lengths = [length // model.input_to_prediction_length_ratio
+                              for length in prepared_batches.input_lengths(index)]
+        example_evaluations += evaluator.evaluate_batch(
+            model.prediction_batch(numpy.asarray(prepared_batches.input_batch(index))),
+            prediction_lengths=prediction_lengths, labels=prepared_batches.labels(index))
+
+    return EvaluationReport(example_evaluations)
+
+
+# state of a worker process, set by _initialize_worker:
+_worker_model = None
+_worker_prepared_batches = None  # type: Optional[PreparedBatches]
+_worker_run_directory = None  # type: Optional[Path]
+
+
+def _initialize_worker(create_model: Callable[[], object], prepared_batches_directory: Path,
+                       run_directory: Path, thread_count: int) -> None:
+    global _worker_model, _worker_prepared_batches, _worker_run_directory
+
+    # Shares the cores between workers; set before the backend is imported by create_model:
+    for variable in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                     "TF_NUM_INTRAOP_THREADS", "TF_NUM_INTEROP_THREADS"]:
+        os.environ[variable] = str(thread_count)
+
+    _worker_model = create_model()
+    _worker_prepared_batches = PreparedBatches(prepared_batches_directory)
+    _worker_run_directory = run_directory
+
+
+def _evaluate_epoch(epoch: int) -> Tuple[int, CheckpointEvaluation]:
+    _worker_model.load_weights(_worker_run_directory, epoch)
+    return epoch, CheckpointEvaluation.from_report(epoch, evaluate_prepared(_worker_model, _worker_prepared_batches))
+
+
+def create_wav2letter(input_size_per_time_step: int = 128, use_asg: bool = False):
+    from net import Wav2Letter
+
+    return Wav2Letter(input_size_per_time_step=input_size_per_time_step, use_asg=use_asg)
+
+
+def sweep(run_directory: Path, prepared_batches: PreparedBatches, epochs: List[int], worker_count: int = 2,
+          create_model: Callable[[], object] = create_wav2letter,
+          threads_per_worker: Optional[int] = None) -> List[CheckpointEvaluation]:
+    """
+    :param create_model: Picklable function creating a model as Wav2Letter, called once per worker process.
+    :param threads_per_worker: Threads of BLAS and TensorFlow in each worker, by default the cores divided
+    between the workers, so that they do not oversubscribe the CPU.
+    """
+    if threads_per_worker is None:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // worker_count)
+
+    # spawned instead of forked workers, since TensorFlow does not support being used after a fork:
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=worker_count, initializer=_initialize_worker,
+                      initargs=(create_model, prepared_batches.directory, run_directory, threads_per_worker)) as pool:
+        evaluations_by_epoch = dict(pool.imap_unordered(_evaluate_epoch, epochs))
+
+    return [evaluations_by_epoch[epoch] for epoch in epochs]
+
+
+def table(evaluations: List[CheckpointEvaluation]) -> str:
+    return "\n".join(["{:>8} {:>12} {:>8} {:>8}".format("epoch", "loss", "CER", "WER")] + [
+        "{:>8} {:>12} {:>8.2%} {:>8.2%}".format(
+            e.epoch, "{:.4f}".format(e.loss) if e.loss is not None else "unknown", e.character_error_rate,
+            e.word_error_rate) for e in evaluations])
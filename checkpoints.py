@@ -0,0 +1,221 @@
+import json
+import sys
+import time
+from pathlib import Path
+from queue import Queue
+from threading import Thread, Lock
+
+import os
+from numpy import ndarray
+from typing import List, Tuple, Optional, Callable
+
+from tools import mkdir
+
+
+class WeightSnapshot:
+    """
+    In-memory copy of the weights of a model's layers, as pairs of layer name and list of (weight name, value).
+    Can be written from another thread while training continues to change the model.
+    :param keras_version: Of the model, recorded like save_weights does, without which load_weights
+    assumes Keras 1 weights and converts e. g. convolution kernels.
+    """
+
+    def __init__(self, layers: List[Tuple[str, List[Tuple[str, ndarray]]]], keras_version: Optional[str] = None,
+                 backend: Optional[str] = None):
+        self.layers = layers
+        self.keras_version = keras_version
+        self.backend = backend
+
+    def write_hdf5(self, path: Path) -> None:
+        """Writes the layout of Keras' save_weights, so that the result can be loaded with load_weights."""
+        import h5py
+
+        with h5py.File(str(path), 'w') as f:
+            if self.keras_version is not None:
+                f.attrs['keras_version'] = self.keras_version.encode('utf8')
+            if self.backend is not None:
+                f.attrs['backend'] = self.backend.encode('utf8')
+            f.attrs['layer_names'] = [layer_name.encode('utf8') for layer_name, _ in self.layers]
+            for layer_name, weights in self.layers:
+                group = f.create_group(layer_name)
+                group.attrs['weight_names'] = [weight_name.encode('utf8') for weight_name, _ in weights]
+                for weight_name, value in weights:
+                    dataset = group.create_dataset(weight_name, value.shape, dtype=value.dtype)
+                    if value.shape:
+                        dataset[:] = value
+                    else:
+                        dataset[()] = value
+
+
+class Checkpoint:
+    """
+    :param sampler_state: State of the EpochSampler training batches were drawn from, to resume from this checkpoint.
+    """
+
+    def __init__(self, epoch: int, file_name: str, validation_loss: Optional[float] = None,
+                 saved_at: Optional[float] = None, sampler_state: Optional[dict] = None):
+        self.epoch = epoch
+        self.file_name = file_name
+        self.validation_loss = validation_loss
+        self.saved_at = saved_at
+        self.sampler_state = sampler_state
+
+    def as_dict(self) -> dict:
+        return {"epoch": self.epoch, "file_name": self.file_name, "validation_loss": self.validation_loss,
+                "saved_at": self.saved_at, "sampler_state": self.sampler_state}
+
+    @staticmethod
+    def from_dict(d: dict) -> 'Checkpoint':
+        return Checkpoint(epoch=d["epoch"], file_name=d["file_name"], validation_loss=d.get("validation_loss"),
+                          saved_at=d.get("saved_at"), sampler_state=d.get("sampler_state"))
+
+    def __repr__(self):
+        return "Checkpoint(epoch={}, validation_loss={})".format(self.epoch, self.validation_loss)
+
+
+class CheckpointIndex:
+    """Records the retained checkpoints of a net directory in checkpoints.json."""
+
+    file_name = "checkpoints.json"
+
+    def __init__(self, net_directory: Path):
+        self.net_directory = net_directory
+        self.index_file = net_directory / self.file_name
+        self.checkpoints = self._load()
+
+    def _load(self) -> List[Checkpoint]:
+        if not self.index_file.exists():
+            return []
+
+        with self.index_file.open(encoding='utf8') as f:
+            return [Checkpoint.from_dict(d) for d in json.load(f)["checkpoints"]]
+
+    def save(self) -> None:
+        temporary_file = self.index_file.with_name(".{}.{}".format(self.file_name, os.getpid()))
+        with temporary_file.open('w', encoding='utf8') as f:
+            json.dump({"checkpoints": [c.as_dict() for c in sorted(self.checkpoints, key=lambda c: c.epoch)]}, f,
+                      indent=2)
+        os.replace(str(temporary_file), str(self.index_file))
+
+    def checkpoint(self, epoch: int) -> Optional[Checkpoint]:
+        return next((c for c in self.checkpoints if c.epoch == epoch), None)
+
+    def latest(self) -> Optional[Checkpoint]:
+        return max(self.checkpoints, key=lambda c: c.epoch) if self.checkpoints else None
+
+    def best(self) -> Optional[Checkpoint]:
+        """The checkpoint with the lowest validation loss, or the latest one if no validation loss was recorded."""
+        validated = [c for c in self.checkpoints if c.validation_loss is not None]
+        if not validated:
+            return self.latest()
+
+        return min(validated, key=lambda c: (c.validation_loss, -c.epoch))
+
+    def best_epoch(self) -> Optional[int]:
+        best = self.best()
+        return None if best is None else best.epoch
+
+    def retained(self, keep_last: int) -> List[Checkpoint]:
+        by_epoch = sorted(self.checkpoints, key=lambda c: c.epoch)
+        retained = by_epoch[-keep_last:] if keep_last > 0 else []
+        best = self.best()
+        if best is not None and best not in retained:
+            retained.append(best)
+
+        return retained
+
+
+class CheckpointWriteError(Exception):
+    def __init__(self, errors: List[Exception]):
+        super().__init__("Saving {} checkpoint(s) failed, first: {}".format(len(errors), errors[0]))
+        self.errors = errors
+
+
+class CheckpointManager:
+    """
+    Writes weight snapshots from a background thread, each via a temporary file renamed when complete,
+    so that a crash never leaves a truncated checkpoint. Errors while writing are raised as a CheckpointWriteError
+    by the next save, flush or close, so that training does not continue without checkpoints unnoticed.
+    Keeps the last keep_last checkpoints and the one with the lowest validation loss, deleting the others,
+    and records them in a CheckpointIndex.
+
+    At most max_pending snapshots wait to be written; save blocks beyond that, bounding the memory used.
+    """
+
+    def __init__(self, net_directory: Path, file_name: Callable[[int], str], keep_last: int = 3,
+                 max_pending: int = 1,
+                 write: Callable[[WeightSnapshot, Path], None] = lambda snapshot, path: snapshot.write_hdf5(path)):
+        self.net_directory = net_directory
+        self.file_name = file_name
+        self.keep_last = keep_last
+        self.write = write
+        mkdir(net_directory)
+        self.index = CheckpointIndex(net_directory)
+        self._index_lock = Lock()
+        self._queue = Queue(maxsize=max_pending)
+        self.errors = []  # type: List[Exception]
+        self._thread = Thread(target=self._write_pending, name="checkpoint-writer", daemon=True)
+        self._thread.start()
+
+    def save(self, epoch: int, snapshot: WeightSnapshot, validation_loss: Optional[float] = None,
+             sampler_state: Optional[dict] = None) -> None:
+        self.raise_errors()
+        self._queue.put((epoch, snapshot, validation_loss, sampler_state))
+
+    def _write_pending(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+
+                self._write_checkpoint(*item)
+            except Exception as e:
+                print("Saving checkpoint failed: {}".format(e), file=sys.stderr)
+                self.errors.append(e)
+            finally:
+                self._queue.task_done()
+
+    def _write_checkpoint(self, epoch: int, snapshot: WeightSnapshot, validation_loss: Optional[float],
+                          sampler_state: Optional[dict]) -> None:
+        file_name = self.file_name(epoch)
+        path = self.net_directory / file_name
+        temporary_path = self.net_directory / ".{}.{}{}".format(path.stem, os.getpid(), path.suffix)
+        self.write(snapshot, temporary_path)
+        os.replace(str(temporary_path), str(path))
+
+        with self._index_lock:
+            self.index.checkpoints = [c for c in self.index.checkpoints if c.epoch != epoch] + [
+                Checkpoint(epoch=epoch, file_name=file_name, validation_loss=validation_loss, saved_at=time.time(),
+                           sampler_state=sampler_state)]
+            retained = self.index.retained(self.keep_last)
+            removed = [c for c in self.index.checkpoints if c not in retained]
+            self.index.checkpoints = retained
+            self.index.save()
+
+        for checkpoint in removed:
+            removed_path = self.net_directory / checkpoint.file_name
+            if removed_path.exists():
+                removed_path.unlink()
+
+    def best(self) -> Optional[Checkpoint]:
+        with self._index_lock:
+            return self.index.best()
+
+    def flush(self) -> None:
+        """Blocks until all snapshots saved so far are written."""
+        self._queue.join()
+        self.raise_errors()
+
+    def raise_errors(self) -> None:
+        """Raises the errors of writes that failed since the last call, if any."""
+        if self.errors:
+            errors = self.errors
+            self.errors = []
+            raise CheckpointWriteError(errors)
+
+    def close(self) -> None:
+        self._queue.join()
+        self._queue.put(None)
+        self._thread.join()
+        self.raise_errors()
@@ -0,0 +1,82 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from threading import BoundedSemaphore, Lock
+
+from typing import Callable, Iterable, List, Dict, Tuple
+
+
+class CorpusPreparation:
+    """
+    Fetches, unpacks and indexes corpora one after another and records how long each stage took.
+    See ConcurrentCorpusPreparation for a version that overlaps the stages of several corpora.
+    """
+
+    stages = ("fetch", "unpack", "index")
+
+    def __init__(self):
+        self.stage_durations = []  # type: List[Tuple[str, str, float]]
+        self._stage_durations_lock = Lock()
+
+    @contextmanager
+    def stage(self, stage: str, corpus_name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._stage_durations_lock:
+                self.stage_durations.append((stage, corpus_name, time.perf_counter() - start))
+
+    def download_and_unpack(self, archive: 'CorpusArchive') -> Path:
+        if not archive.is_unpacked():
+            with self.stage("fetch", archive.corpus_name):
+                archive.download_if_not_yet_done()
+            with self.stage("unpack", archive.corpus_name):
+                archive.unpack_if_not_yet_done()
+
+        return archive.target_directory
+
+    def create_providers(self, provider_factories: Iterable[Callable[['CorpusPreparation'], 'CorpusProvider']]) -> \
+            List['CorpusProvider']:
+        return [create_provider(self) for create_provider in provider_factories]
+
+    def total_duration_by_stage(self) -> Dict[str, float]:
+        return dict((stage, sum(duration for s, corpus_name, duration in self.stage_durations if s == stage))
+                    for stage in self.stages)
+
+    def stage_duration_summary(self) -> str:
+        return ", ".join("{}: {:.2f}s".format(stage, duration)
+                         for stage, duration in self.total_duration_by_stage().items())
+
+
+class ConcurrentCorpusPreparation(CorpusPreparation):
+    """
+    Prepares several corpora at once so that downloading, unpacking and label parsing of different corpora overlap.
+    Each stage has its own bound on how many corpora may be in it at the same time,
+    e. g. to avoid saturating the network or the disk.
+    """
+
+    def __init__(self, fetch_limit: int = 2, unpack_limit: int = 2, index_limit: int = 4):
+        super().__init__()
+        self.limits_by_stage = {"fetch": fetch_limit, "unpack": unpack_limit, "index": index_limit}
+        self._slots_by_stage = dict(
+            (stage, BoundedSemaphore(limit)) for stage, limit in self.limits_by_stage.items())  # type: Dict[str, BoundedSemaphore]
+
+    @contextmanager
+    def stage(self, stage: str, corpus_name: str):
+        with self._slots_by_stage[stage]:
+            with super().stage(stage, corpus_name):
+                yield
+
+    def create_providers(self, provider_factories: Iterable[Callable[[CorpusPreparation], 'CorpusProvider']]) -> \
+            List['CorpusProvider']:
+        provider_factories = list(provider_factories)
+        if len(provider_factories) == 0:
+            return []
+
+        # Every corpus gets its own thread; the stage semaphores bound how many of them do actual work at a time:
+        with ThreadPoolExecutor(max_workers=len(provider_factories)) as executor:
+            futures = [executor.submit(create_provider, self) for create_provider in provider_factories]
+
+            return [future.result() for future in futures]
@@ -1,18 +1,26 @@
 import random
 import re
-import subprocess
+import shutil
 import tarfile
-from functools import reduce
+import tempfile
 from pathlib import Path
 from tarfile import *
 
+import os
 from collections import Counter
 from typing import List, Iterable, Optional, Dict, Callable, Tuple
-from urllib import request
 
+import numpy
+from numpy import ndarray
+
+from audio_metadata import AudioMetadataIndex
+from corpus_preparation import CorpusPreparation
+from corpus_table import CorpusTable, CorpusTableRow
 from grapheme_enconding import frequent_characters_in_english
 from labeled_example import LabeledExample
+from pcm_cache import PcmCache
 from tools import mkdir, distinct, name_without_extension, extension, count_summary, group
+from transcript_normalization import TranscriptNormalizer
 
 
 class ParsingException(Exception):
@@ -53,6 +61,92 @@ class TrainingTestSplit:
         return split
 
 
+class CorpusArchive:
+    """
+    Compressed archive of a single corpus, fetched from an URL, an scp location or a local directory
+    and unpacked into base_directory / corpus_name.
+    Both the downloaded archive and the unpacked directory only appear under their final name once complete.
+    """
+
+    def __init__(self, corpus_name: str, base_directory: Path, base_source_url_or_directory: str,
+                 tar_gz_extension: str, root_compressed_directory_name_to_skip: Optional[str]):
+        self.corpus_name = corpus_name
+        self.base_directory = base_directory
+        self.base_source_url_or_directory = base_source_url_or_directory
+        self.root_compressed_directory_name_to_skip = root_compressed_directory_name_to_skip
+
+        file_name = corpus_name + tar_gz_extension
+        self.source_url_or_path = base_source_url_or_directory + file_name
+        self.tar_file = base_directory / file_name
+        self.target_directory = base_directory / corpus_name
+
+    def is_unpacked(self) -> bool:
+        return self.target_directory.is_dir()
+
+    def download_if_not_yet_done(self) -> Path:
+        if not self.tar_file.is_file():
+            print("Downloading corpus {} to {}".format(self.source_url_or_path, self.tar_file))
+            partial_file = self._temporary_path_next_to(self.tar_file)
+            try:
+                self._download(target_path=partial_file)
+                os.replace(str(partial_file), str(self.tar_file))
+            finally:
+                if partial_file.exists():
+                    partial_file.unlink()
+
+        return self.tar_file
+
+    def _download(self, target_path: Path):
+        # imported here since only needed for downloading, but slow to import:
+        if self.base_source_url_or_directory.startswith("http"):
+            from urllib import request
+
+            request.urlretrieve(self.source_url_or_path, str(target_path))
+        elif Path(self.source_url_or_path).is_file():
+            shutil.copyfile(self.source_url_or_path, str(target_path))
+        else:
+            import subprocess
+
+            try:
+                subprocess.check_output(["scp", self.source_url_or_path, str(target_path)], stderr=subprocess.STDOUT)
+            except subprocess.CalledProcessError as e:
+                raise IOError("Copying failed: " + str(e.output))
+
+    def unpack_if_not_yet_done(self) -> Path:
+        if not self.is_unpacked():
+            partial_directory = Path(tempfile.mkdtemp(dir=str(self.base_directory),
+                                                      prefix=".{}.".format(self.corpus_name)))
+            try:
+                with tarfile.open(str(self.tar_file), 'r:gz') as tar:
+                    tar.extractall(str(partial_directory),
+                                   members=self._tar_members_root_directory_skipped_if_specified(tar))
+                try:
+                    os.rename(str(partial_directory), str(self.target_directory))
+                except OSError:
+                    # another process unpacked the corpus meanwhile, which only appears once complete:
+                    if not self.is_unpacked():
+                        raise
+            finally:
+                if partial_directory.exists():
+                    shutil.rmtree(str(partial_directory))
+
+        return self.target_directory
+
+    def _tar_members_root_directory_skipped_if_specified(self, tar: TarFile) -> List[TarInfo]:
+        members = tar.getmembers()
+
+        if self.root_compressed_directory_name_to_skip is not None:
+            for member in members:
+                member.name = member.name.replace(self.root_compressed_directory_name_to_skip, '')
+
+        return members
+
+    def _temporary_path_next_to(self, path: Path) -> Path:
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=str(path.parent), prefix=".{}.".format(path.name))
+        os.close(file_descriptor)
+        return Path(temporary_path)
+
+
 class CorpusProvider:
     def __init__(self, base_directory: Path,
                  base_source_url_or_directory: str = "http://www.openslr.org/resources/12/",
@@ -66,9 +160,15 @@ class CorpusProvider:
                  tags_to_ignore: Iterable[str] = list(),
                  id_filter_regex=re.compile('[\s\S]*'),
                  training_test_split: Callable[[List[LabeledExample]], Tuple[
-                     List[LabeledExample], List[LabeledExample]]] = TrainingTestSplit.randomly_by_directory(.9)):
+                     List[LabeledExample], List[LabeledExample]]] = TrainingTestSplit.randomly_by_directory(.9),
+                 preparation: Optional[CorpusPreparation] = None,
+                 pcm_cache: Optional[PcmCache] = None):
+        if preparation is None:
+            preparation = CorpusPreparation()
+
         self.id_filter_regex = id_filter_regex
         self.tags_to_ignore = tags_to_ignore
+        self.tag_remover = TranscriptNormalizer.removing(tags_to_ignore)
         self.allowed_characters = allowed_characters
         self.subdirectory_depth = subdirectory_depth
         self.root_compressed_directory_name_to_skip = root_compressed_directory_name_to_skip
@@ -77,20 +177,37 @@ class CorpusProvider:
         self.tar_gz_extension = tar_gz_extension
         self.mel_frequency_count = mel_frequency_count
         self.corpus_names = corpus_names
+        self.preparation = preparation
+        self.pcm_cache = pcm_cache
         mkdir(base_directory)
 
-        self.corpus_directories = [self._download_and_unpack_if_not_yet_done(corpus_name=corpus_name) for corpus_name in
-                                   corpus_names]
+        self.archives = [CorpusArchive(corpus_name=corpus_name,
+                                       base_directory=base_directory,
+                                       base_source_url_or_directory=base_source_url_or_directory,
+                                       tar_gz_extension=tar_gz_extension,
+                                       root_compressed_directory_name_to_skip=root_compressed_directory_name_to_skip)
+                         for corpus_name in corpus_names]
+
+        self.corpus_directories = [preparation.download_and_unpack(archive) for archive in self.archives]
 
-        directories = self.corpus_directories
+        with preparation.stage("index", " ".join(corpus_names)):
+            self._index_corpus_directories()
+
+    def _files_in(self, corpus_directory: Path) -> List[Path]:
+        directories = [corpus_directory]
         for i in range(self.subdirectory_depth):
             directories = [subdirectory
                            for directory in directories
                            for subdirectory in directory.iterdir() if subdirectory.is_dir()]
 
-        self.files = [file
-                      for directory in directories
-                      for file in directory.iterdir() if file.is_file()]
+        return [file
+                for directory in directories
+                for file in directory.iterdir() if file.is_file()]
+
+    def _index_corpus_directories(self):
+        files_by_corpus_directory = [(corpus_directory, self._files_in(corpus_directory))
+                                     for corpus_directory in self.corpus_directories]
+        self.files = [file for corpus_directory, files in files_by_corpus_directory for file in files]
 
         self.unfiltered_audio_files = [file for file in self.files if
                                        (file.name.endswith(".flac") or file.name.endswith(".wav"))]
@@ -99,64 +216,46 @@ class CorpusProvider:
         self.filtered_out_count = len(self.unfiltered_audio_files) - len(audio_files)
 
         labels_with_tags_by_id = self._extract_labels_by_id(self.files)
+
+        audio_file_set = set(audio_files)
+        audio_metadata_by_file = dict()
+        for corpus_directory, files in files_by_corpus_directory:
+            audio_metadata_index = AudioMetadataIndex(corpus_directory)
+            audio_metadata_by_file.update(
+                audio_metadata_index.metadata_by_file(file for file in files if file in audio_file_set))
+            audio_metadata_index.save()
+
         found_audio_ids = set(name_without_extension(f) for f in audio_files)
         found_label_ids = labels_with_tags_by_id.keys()
         self.audio_ids_without_label = list(found_audio_ids - found_label_ids)
         self.label_ids_without_audio = list(found_label_ids - found_audio_ids)
 
-        def example(audio_file: Path) -> LabeledExample:
-            return LabeledExample(audio_file, label_from_id=lambda id: self._remove_tags_to_ignore(
-                labels_with_tags_by_id[id]),
-                                  mel_frequency_count=self.mel_frequency_count,
-                                  original_label_with_tags_from_id=lambda id: labels_with_tags_by_id[id])
-
-        self.examples = sorted(
-            [example(file) for file in audio_files if name_without_extension(file) in labels_with_tags_by_id.keys()],
-            key=lambda x: x.id)
-        self.examples_by_id = dict([(e.id, e) for e in self.examples])
-
-    def _remove_tags_to_ignore(self, text: str) -> str:
-        return reduce(lambda text, tag: text.replace(tag, ""), self.tags_to_ignore, text)
-
-    def _download_and_unpack_if_not_yet_done(self, corpus_name: str) -> Path:
-        file_name = corpus_name + self.tar_gz_extension
-        file_url_or_path = self.base_url_or_directory + file_name
-
-        target_directory = self.base_directory / corpus_name
+        labeled_audio_files = [file for file in audio_files if name_without_extension(file) in labels_with_tags_by_id]
+        labels_with_tags = [labels_with_tags_by_id[name_without_extension(file)] for file in labeled_audio_files]
+        self.table = CorpusTable(zip(labeled_audio_files, self.tag_remover.normalize_all(labels_with_tags),
+                                     labels_with_tags, [audio_metadata_by_file[file] for file in labeled_audio_files]))
 
-        if not target_directory.exists():
-            tar_file = self._download_if_not_yet_done(file_url_or_path, self.base_directory / file_name)
-            self._unpack_tar_if_not_yet_done(tar_file, target_directory=target_directory)
+    def example(self, index: int) -> LabeledExample:
+        """Creates a new LabeledExample for the row, which is not retained, so neither is its decoded audio."""
+        return self.table[index].labeled_example(mel_frequency_count=self.mel_frequency_count,
+                                                 pcm_cache=self.pcm_cache)
 
-        return target_directory
+    def examples_at(self, indices: Iterable[int]) -> List[LabeledExample]:
+        return [self.example(int(index)) for index in indices]
 
-    def _unpack_tar_if_not_yet_done(self, tar_file: Path, target_directory: Path):
-        if not target_directory.is_dir():
-            with tarfile.open(str(tar_file), 'r:gz') as tar:
-                tar.extractall(str(target_directory),
-                               members=self._tar_members_root_directory_skipped_if_specified(tar))
+    def example_by_id(self, id: str) -> LabeledExample:
+        return self.example(self.table.index_of(id))
 
-    def _tar_members_root_directory_skipped_if_specified(self, tar: TarFile) -> List[TarInfo]:
-        members = tar.getmembers()
-
-        if self.root_compressed_directory_name_to_skip is not None:
-            for member in members:
-                member.name = member.name.replace(self.root_compressed_directory_name_to_skip, '')
+    @property
+    def examples(self) -> List[LabeledExample]:
+        """
+        Creates a LabeledExample for each row of the table, sorted by id, on every access.
+        For analysis of large corpora, prefer iterating over the much more compact table.
+        """
+        return self.examples_at(range(len(self.table)))
 
-        return members
-
-    def _download_if_not_yet_done(self, source_path_or_url: str, target_path: Path) -> Path:
-        if not target_path.is_file():
-            print("Downloading corpus {} to {}".format(source_path_or_url, target_path))
-            if self.base_url_or_directory.startswith("http"):
-                request.urlretrieve(source_path_or_url, str(target_path))
-            else:
-                try:
-                    subprocess.check_output(["scp", source_path_or_url, str(target_path)], stderr=subprocess.STDOUT)
-                except subprocess.CalledProcessError as e:
-                    raise IOError("Copying failed: " + str(e.output))
-
-        return target_path
+    def _remove_tags_to_ignore(self, text: str) -> str:
+        return self.tag_remover(text)
 
     def _extract_labels_by_id(self, files: Iterable[Path]) -> Dict[str, str]:
         label_files = [file for file in files if file.name.endswith(".txt")]
@@ -181,7 +280,7 @@ class CorpusProvider:
                 len(self.audio_ids_without_label), str(self.audio_ids_without_label[:10]),
                 len(self.label_ids_without_audio), self.label_ids_without_audio[:10],
                 self.tag_summary(),
-                len(self.examples),
+                len(self.table),
                 len(self.invalid_examples_texts()), self.invalid_examples_summary(),
                 len(empty_examples), [e.id for e in empty_examples[:10]],
                 self.duplicate_label_count(), self.most_duplicated_labels()]
@@ -204,7 +303,7 @@ class CorpusProvider:
                 self.label_ids_without_audio) > 0 else "",
 
             "Removed label tags: {}\n".format(tags_summary) if tags_summary != "" else "",
-            len(self.examples),
+            len(self.table),
             len(self.invalid_examples_texts()),
             self.invalid_examples_summary(),
             len(self.empty_examples()),
@@ -216,7 +315,7 @@ class CorpusProvider:
         return "".join([e + '\n' for e in self.invalid_examples_texts()])
 
     def original_sample_rate_summary(self):
-        return count_summary(self.some_original_sample_rates())
+        return count_summary(self.original_sample_rates())
 
     def tag_summary(self):
         return count_summary(self.tags_from_all_examples())
@@ -228,28 +327,52 @@ class CorpusProvider:
         return [
             "Invalid characters {} in {}".format(
                 distinct([c for c in x.label if c not in self.allowed_characters]), str(x))
-            for x in self.examples if not self.is_allowed(x.label)]
+            for x in self.table if not self.is_allowed(x.label)]
+
+    def fill_pcm_cache(self) -> int:
+        """Decodes and resamples all examples not yet in the PCM cache. Returns the number of newly cached examples."""
+        return self.pcm_cache.fill((row.id, row.audio_file) for row in self.table)
+
+    def original_sample_rates(self) -> List[int]:
+        """Cheap for examples whose audio metadata could be read from the file header, otherwise requires decoding."""
+        return [int(sample_rate) if sample_rate != 0 else self.example(index).original_sample_rate
+                for index, sample_rate in enumerate(self.table.sample_rates)]
+
+    def durations_in_s(self) -> ndarray:
+        durations = self.table.durations_in_s()
+        for index in numpy.flatnonzero(numpy.isnan(durations)):
+            durations[index] = self.example(index).duration_in_s()
+
+        return durations
+
+    def total_duration_in_s(self) -> float:
+        return float(self.durations_in_s().sum())
+
+    def examples_sorted_by_duration(self) -> List[LabeledExample]:
+        return self.examples_at(numpy.argsort(self.durations_in_s(), kind='stable'))
 
-    def some_original_sample_rates(self):
-        return [example.original_sample_rate for example in
-                random.sample(self.examples, min(50, len(self.examples)))]
+    def examples_with_duration_between(self, min_duration_in_s: float = 0,
+                                       max_duration_in_s: float = float("inf")) -> List[LabeledExample]:
+        durations = self.durations_in_s()
+        return self.examples_at(
+            numpy.flatnonzero((min_duration_in_s <= durations) & (durations <= max_duration_in_s)))
 
     def file_extensions(self):
         return [extension(file)
                 for directory in self.corpus_directories
                 for file in directory.glob('**/*.*') if file.is_file()]
 
-    def empty_examples(self):
-        return [example for example in self.examples if example.label == ""]
+    def empty_examples(self) -> List[CorpusTableRow]:
+        return [row for row in self.table if row.label == ""]
 
     def duplicate_label_count(self):
-        return len(self.examples) - len(set(e.label for e in self.examples))
+        return len(self.table) - len(set(row.label for row in self.table))
 
     def most_duplicated_labels(self):
-        return Counter([example.label for example in self.examples]).most_common(10)
+        return Counter([row.label for row in self.table]).most_common(10)
 
     def tags_from_all_examples(self):
         return [counted_tag
-                for example in self.examples
+                for row in self.table
                 for tag in self.tags_to_ignore
-                for counted_tag in [tag] * example.tag_count(tag)]
+                for counted_tag in [tag] * row.tag_count(tag)]
@@ -0,0 +1,171 @@
+import sys
+from bisect import bisect_left
+from pathlib import Path
+
+import numpy
+from numpy import ndarray
+from typing import List, Iterable, Optional, Tuple, Iterator
+
+from audio_metadata import AudioMetadata
+
+
+class _StringColumn:
+    """Strings concatenated into a single buffer, addressed by offsets."""
+
+    def __init__(self, strings: List[str]):
+        self.buffer = "".join(strings)
+        self.offsets = numpy.zeros(len(strings) + 1, dtype=numpy.int64)
+        numpy.cumsum([len(s) for s in strings], out=self.offsets[1:])
+
+    def __len__(self) -> int:
+        return self.offsets.shape[0] - 1
+
+    def __getitem__(self, index: int) -> str:
+        return self.buffer[self.offsets[index]:self.offsets[index + 1]]
+
+    def nbytes(self) -> int:
+        # the size of the str object, which takes one byte per character for Latin-1 text like German umlauts,
+        # but two or four for text with other characters:
+        return sys.getsizeof(self.buffer) + self.offsets.nbytes
+
+
+class CorpusTableRow:
+    """Lightweight view on a single example of a CorpusTable."""
+
+    __slots__ = ("table", "index")
+
+    def __init__(self, table: 'CorpusTable', index: int):
+        self.table = table
+        self.index = index
+
+    @property
+    def id(self) -> str:
+        return self.table.ids[self.index]
+
+    @property
+    def label(self) -> str:
+        return self.table.labels[self.index]
+
+    @property
+    def original_label_with_tags(self) -> str:
+        return self.table.original_labels_with_tags[self.index]
+
+    @property
+    def audio_file(self) -> Path:
+        return self.table.directories[self.table.directory_indices[self.index]] / (
+            self.id + self.table.extensions[self.table.extension_indices[self.index]])
+
+    @property
+    def audio_directory(self) -> Path:
+        return self.table.directories[self.table.directory_indices[self.index]]
+
+    @property
+    def audio_metadata(self) -> Optional[AudioMetadata]:
+        sample_rate = int(self.table.sample_rates[self.index])
+        if sample_rate == 0:
+            return None
+
+        return AudioMetadata(sample_rate=sample_rate, channel_count=int(self.table.channel_counts[self.index]),
+                             frame_count=int(self.table.frame_counts[self.index]))
+
+    def duration_in_s(self) -> float:
+        return float(self.table.durations_in_s()[self.index])
+
+    def tag_count(self, tag: str) -> int:
+        return self.original_label_with_tags.count(tag)
+
+    def labeled_example(self, **kwargs):
+        """
+        Creates a new LabeledExample for this row. It retains its decoded audio only as long as the caller keeps it.
+        :param kwargs: Passed to the LabeledExample constructor, e. g. mel_frequency_count or pcm_cache.
+        """
+        from labeled_example import LabeledExample
+
+        label = self.label
+        original_label_with_tags = self.original_label_with_tags
+        return LabeledExample(self.audio_file, id=self.id,
+                              label_from_id=lambda id: label,
+                              original_label_with_tags_from_id=lambda id: original_label_with_tags,
+                              audio_metadata=self.audio_metadata, **kwargs)
+
+    def raw_audio(self, **kwargs) -> ndarray:
+        """Decodes the audio without keeping it in memory afterwards."""
+        return self.labeled_example(**kwargs).raw_audio
+
+    def __str__(self) -> str:
+        label = self.label
+        return self.id + (": {}".format(label) if label else "")
+
+
+class CorpusTable:
+    """
+    Column-oriented, id-sorted representation of the examples of a corpus:
+    ids and labels in single string buffers, audio files as directory and extension indices into small lookup lists,
+    and audio metadata in numeric arrays. Rows are materialized as CorpusTableRow views only on access.
+    """
+
+    def __init__(self, rows: Iterable[Tuple[Path, str, str, Optional[AudioMetadata]]]):
+        """
+        :param rows: Tuples of audio file, label and original label with tags, and audio metadata if known.
+        The audio file name without extension is used as id.
+        """
+        rows = sorted(rows, key=lambda row: row[0].stem)
+
+        self.directories = []  # type: List[Path]
+        self.extensions = []  # type: List[str]
+        directory_indices_by_directory = dict()
+        extension_indices_by_extension = dict()
+
+        def index_of(value, indices_by_value: dict, values: list) -> int:
+            if value not in indices_by_value:
+                indices_by_value[value] = len(values)
+                values.append(value)
+            return indices_by_value[value]
+
+        self.ids = _StringColumn([audio_file.stem for audio_file, _, _, _ in rows])
+        self.labels = _StringColumn([label for _, label, _, _ in rows])
+        self.original_labels_with_tags = _StringColumn([original for _, _, original, _ in rows])
+        self.directory_indices = numpy.array(
+            [index_of(Path(audio_file.parent), directory_indices_by_directory, self.directories)
+             for audio_file, _, _, _ in rows], dtype=numpy.uint32)
+        self.extension_indices = numpy.array(
+            [index_of(audio_file.suffix, extension_indices_by_extension, self.extensions)
+             for audio_file, _, _, _ in rows], dtype=numpy.uint8)
+
+        metadata = [row[3] for row in rows]
+        self.sample_rates = numpy.array([0 if m is None else m.sample_rate for m in metadata], dtype=numpy.int32)
+        self.channel_counts = numpy.array([0 if m is None else m.channel_count for m in metadata], dtype=numpy.uint8)
+        self.frame_counts = numpy.array([0 if m is None else m.frame_count for m in metadata], dtype=numpy.int64)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, index: int) -> CorpusTableRow:
+        if not -len(self) <= index < len(self):
+            raise IndexError(index)
+
+        return CorpusTableRow(self, index % len(self))
+
+    def __iter__(self) -> Iterator[CorpusTableRow]:
+        return (CorpusTableRow(self, index) for index in range(len(self)))
+
+    def index_of(self, id: str) -> int:
+        index = bisect_left(self.ids, id)
+        if index == len(self) or self.ids[index] != id:
+            raise KeyError(id)
+
+        return index
+
+    def row(self, id: str) -> CorpusTableRow:
+        return CorpusTableRow(self, self.index_of(id))
+
+    def durations_in_s(self) -> ndarray:
+        """Durations from audio metadata, NaN where the metadata is unknown."""
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return numpy.where(self.sample_rates > 0, self.frame_counts / self.sample_rates, numpy.nan)
+
+    def nbytes(self) -> int:
+        return sum(column.nbytes() for column in (self.ids, self.labels, self.original_labels_with_tags)) + sum(
+            array.nbytes for array in
+            (self.directory_indices, self.extension_indices, self.sample_rates, self.channel_counts,
+             self.frame_counts))
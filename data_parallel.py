@@ -0,0 +1,125 @@
+"""
+Data-parallel training: one replica of the model per process, each on its own shard of the data
+(see EpochSampler). Before every optimizer step, gradients are averaged over all replicas,
+so that all replicas apply the same update and stay identical.
+"""
+import multiprocessing
+from abc import ABCMeta, abstractmethod
+
+import numpy
+from numpy import ndarray
+from typing import List, Tuple, Iterable, Callable, Optional
+
+from all_reduce import SharedMemoryAllReduce
+from instrumentation import metrics
+
+
+class GradientReplica:
+    """A model whose gradients can be computed and applied in separate steps."""
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def get_weights(self) -> List[ndarray]: raise NotImplementedError
+
+    @abstractmethod
+    def set_weights(self, weights: List[ndarray]) -> None: raise NotImplementedError
+
+    @abstractmethod
+    def loss_and_gradients(self, batch) -> Tuple[float, List[ndarray]]: raise NotImplementedError
+
+    @abstractmethod
+    def apply_gradients(self, gradients: List[ndarray]) -> None: raise NotImplementedError
+
+
+def flatten(arrays: List[ndarray]) -> ndarray:
+    return numpy.concatenate([numpy.ravel(array) for array in arrays]).astype(numpy.float32, copy=False)
+
+
+def unflatten(vector: ndarray, like: List[ndarray]) -> List[ndarray]:
+    arrays = []
+    start = 0
+    for array in like:
+        arrays.append(vector[start:start + array.size].reshape(array.shape).astype(array.dtype, copy=False))
+        start += array.size
+
+    return arrays
+
+
+def parameter_count(arrays: List[ndarray]) -> int:
+    return sum(array.size for array in arrays)
+
+
+class DataParallelTrainer:
+    """
+    Trains the replica of one process. Only rank 0 is meant to write checkpoints, in on_epoch_end,
+    which is called on all ranks; since all replicas are identical, any rank could.
+    """
+
+    def __init__(self, replica: GradientReplica, all_reduce: SharedMemoryAllReduce):
+        self.replica = replica
+        self.all_reduce = all_reduce
+        self.rank = all_reduce.rank
+        self._weight_shapes = replica.get_weights()
+
+    def synchronize_weights(self) -> None:
+        """Replaces the weights of all replicas by those of rank 0, e. g. after initializing them randomly."""
+        weights = self.replica.get_weights()
+        self.replica.set_weights(unflatten(self.all_reduce.broadcast(flatten(weights)), like=weights))
+
+    def step(self, batch) -> float:
+        """Returns the loss averaged over all replicas."""
+        loss, gradients = self.replica.loss_and_gradients(batch)
+        with metrics.timed("gradient_all_reduce"):
+            # the loss is appended to be averaged in the same round:
+            averaged = self.all_reduce.mean(numpy.append(flatten(gradients), numpy.float32(loss)))
+        self.replica.apply_gradients(unflatten(averaged[:-1], like=gradients))
+
+        return float(averaged[-1])
+
+    def train(self, batches: Iterable, steps_per_epoch: int, epochs: int, initial_epoch: int = 0,
+              on_batch_end: Optional[Callable[[float], None]] = None,
+              on_epoch_end: Optional[Callable[[int, List[float]], None]] = None) -> None:
+        """
+        :param batches: Batches of the shard of this rank. All ranks must take the same number of steps.
+        :param on_epoch_end: Called with the epoch and the averaged losses of its steps.
+        """
+        self.synchronize_weights()
+        batch_iterator = iter(batches)
+        for epoch in range(initial_epoch, epochs):
+            losses = []
+            for _ in range(steps_per_epoch):
+                losses.append(self.step(next(batch_iterator)))
+                if on_batch_end is not None:
+                    on_batch_end(losses[-1])
+
+            if on_epoch_end is not None:
+                on_epoch_end(epoch, losses)
+
+
+def run_processes(world_size: int, size: int, target: Callable, arguments: tuple = ()) -> List[int]:
+    """
+    Starts target(all_reduce, *arguments) in world_size spawned processes, with all_reduce set to the rank
+    of each, and waits for them to finish.
+    :param size: Size of the vectors to average, e. g. the parameter count plus one for the loss.
+    :param target: A picklable, module-level function.
+    :return: Exit codes by rank.
+    """
+    context = multiprocessing.get_context("spawn")
+    all_reduce = SharedMemoryAllReduce(world_size, size, context=context)
+    processes = [context.Process(target=_run_rank, args=(target, all_reduce, rank, arguments),
+                                 name="replica-{}".format(rank)) for rank in range(world_size)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    return [process.exitcode for process in processes]
+
+
+def _run_rank(target: Callable, all_reduce: SharedMemoryAllReduce, rank: int, arguments: tuple) -> None:
+    try:
+        target(all_reduce.for_rank(rank), *arguments)
+    except BaseException:
+        # lets the other ranks fail right away instead of after the barrier timeout:
+        all_reduce.abort()
+        raise
@@ -0,0 +1,31 @@
+import numpy
+from numpy import ndarray
+
+
+class DtypePolicy:
+    """
+    Floating point types of features: compute_dtype for spectrograms handed to batching and the net,
+    storage_dtype for spectrograms in the cache. Storing float16 halves the cache again at the cost of precision
+    (about 3 significant digits, which is enough for z-normalized spectrograms).
+    """
+
+    def __init__(self, compute_dtype: str = 'float32', storage_dtype: str = 'float32'):
+        self.compute_dtype = numpy.dtype(compute_dtype)
+        self.storage_dtype = numpy.dtype(storage_dtype)
+
+        for dtype in [self.compute_dtype, self.storage_dtype]:
+            if dtype.kind != 'f':
+                raise ValueError("Expected a floating point type, got {}.".format(dtype))
+
+    def for_compute(self, array: ndarray) -> ndarray:
+        """Returns the array itself if it already has the compute type."""
+        return array.astype(self.compute_dtype, copy=False)
+
+    def for_storage(self, array: ndarray) -> ndarray:
+        return array.astype(self.storage_dtype, copy=False)
+
+    def __repr__(self):
+        return "DtypePolicy(compute_dtype='{}', storage_dtype='{}')".format(self.compute_dtype, self.storage_dtype)
+
+
+default_dtype_policy = DtypePolicy()
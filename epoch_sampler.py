@@ -0,0 +1,78 @@
+import numpy
+from typing import List, Iterable, Optional
+
+
+class EpochSampler:
+    """
+    Draws batches of example indices epoch by epoch: each epoch is a permutation seeded by (seed, epoch),
+    split into world_size disjoint shards of equal length, of which this worker (rank) takes one.
+    Examples beyond the largest multiple of world_size are left out of that epoch, so that all workers
+    take the same number of batches; the permutation changes each epoch, so different ones are left out.
+
+    The position only depends on the number of batches trained, so the sampler resumes mid-epoch
+    from state_dict() saved with a checkpoint. The number of batches generated may be ahead of it,
+    since Keras prefetches batches; batch_trained() has to be called once each training step ended.
+    """
+
+    def __init__(self, example_count: int, batch_size: int, seed: int = 0, rank: int = 0, world_size: int = 1):
+        if not 0 <= rank < world_size:
+            raise ValueError("Rank {} is not in range for world size {}.".format(rank, world_size))
+        if example_count // world_size < batch_size:
+            raise ValueError("{} examples are not enough for a batch of {} on each of {} workers.".format(
+                example_count, batch_size, world_size))
+
+        self.example_count = example_count
+        self.batch_size = batch_size
+        self.seed = seed
+        self.rank = rank
+        self.world_size = world_size
+        self.batches_per_epoch = example_count // world_size // batch_size
+        self.trained_batch_count = 0
+        # the shard of the epoch batches were last drawn from, since a permutation is as large as the corpus:
+        self._shard_epoch = None  # type: Optional[int]
+        self._shard = None  # type: Optional[numpy.ndarray]
+
+    def shard(self, epoch: int) -> numpy.ndarray:
+        """Indices of the examples of this worker in the given epoch, in order."""
+        permutation = numpy.random.RandomState([self.seed, epoch]).permutation(self.example_count)
+        shard_length = self.example_count // self.world_size
+        return permutation[self.rank * shard_length:(self.rank + 1) * shard_length]
+
+    def batch(self, batch_number: int) -> List[int]:
+        """Indices of the examples in the batch with the given number, counted from the start of the first epoch."""
+        epoch, batch_in_epoch = divmod(batch_number, self.batches_per_epoch)
+        if epoch != self._shard_epoch:
+            self._shard = self.shard(epoch)
+            self._shard_epoch = epoch
+
+        start = batch_in_epoch * self.batch_size
+        return self._shard[start:start + self.batch_size].tolist()
+
+    def index_batches(self) -> Iterable[List[int]]:
+        """Batches endlessly, starting after the batches trained so far."""
+        batch_number = self.trained_batch_count
+        while True:
+            yield self.batch(batch_number)
+            batch_number += 1
+
+    @property
+    def epoch(self) -> int:
+        return self.trained_batch_count // self.batches_per_epoch
+
+    def batch_trained(self) -> None:
+        self.trained_batch_count += 1
+
+    def state_dict(self) -> dict:
+        """Equal for all workers, which train in lockstep."""
+        return {"seed": self.seed, "world_size": self.world_size, "example_count": self.example_count,
+                "batch_size": self.batch_size, "trained_batch_count": self.trained_batch_count}
+
+    def load_state_dict(self, state: dict) -> None:
+        configuration = dict((key, getattr(self, key)) for key in
+                             ["seed", "world_size", "example_count", "batch_size"])
+        saved_configuration = dict((key, state[key]) for key in configuration.keys())
+        if configuration != saved_configuration:
+            raise ValueError("Cannot resume sampler with {} from state with {}.".format(
+                configuration, saved_configuration))
+
+        self.trained_batch_count = state["trained_batch_count"]
@@ -0,0 +1,195 @@
+import numpy
+from numpy import ndarray
+from typing import List, Sequence, Optional, Dict, Hashable
+
+from grapheme_enconding import GraphemeEncodingBase, CtcGraphemeEncoding
+from posterior_cache import PosteriorStore
+
+# Keras' ctc_batch_cost takes the logarithm of the probabilities after adding this:
+_ctc_epsilon = 1e-8
+
+
+def edit_distances(hypotheses: List[Sequence[Hashable]], references: List[Sequence[Hashable]]) -> ndarray:
+    """
+    Levenshtein distances between each hypothesis and its reference, computed for the whole batch at once.
+    Cells on an anti-diagonal of the distance matrix only depend on the previous two anti-diagonals,
+    so each step updates one anti-diagonal of all examples with a single vectorized operation.
+    """
+    batch_size = len(references)
+    if batch_size == 0:
+        return numpy.zeros((0,), dtype=numpy.int64)
+
+    ids_by_token = dict()  # type: Dict[Hashable, int]
+
+    def encoded(sequences: List[Sequence[Hashable]], padding: int) -> ndarray:
+        result = numpy.full((batch_size, max(len(s) for s in sequences)), padding, dtype=numpy.int64)
+        for index, sequence in enumerate(sequences):
+            result[index, :len(sequence)] = [ids_by_token.setdefault(token, len(ids_by_token)) for token in sequence]
+        return result
+
+    reference_lengths = numpy.array([len(r) for r in references])
+    hypothesis_lengths = numpy.array([len(h) for h in hypotheses])
+    encoded_references = encoded(references, padding=-1)
+    encoded_hypotheses = encoded(hypotheses, padding=-2)
+    max_reference_length = encoded_references.shape[1]
+    max_hypothesis_length = encoded_hypotheses.shape[1]
+
+    distances = numpy.zeros((batch_size, max_reference_length + 1, max_hypothesis_length + 1), dtype=numpy.int64)
+    distances[:, :, 0] = numpy.arange(max_reference_length + 1)
+    distances[:, 0, :] = numpy.arange(max_hypothesis_length + 1)
+
+    for diagonal in range(2, max_reference_length + max_hypothesis_length + 1):
+        i = numpy.arange(max(1, diagonal - max_hypothesis_length), min(max_reference_length, diagonal - 1) + 1)
+        j = diagonal - i
+        substitution_costs = encoded_references[:, i - 1] != encoded_hypotheses[:, j - 1]
+        distances[:, i, j] = numpy.minimum(numpy.minimum(distances[:, i - 1, j], distances[:, i, j - 1]) + 1,
+                                           distances[:, i - 1, j - 1] + substitution_costs)
+
+    return distances[numpy.arange(batch_size), reference_lengths, hypothesis_lengths]
+
+
+def ctc_losses(prediction_batch: ndarray, prediction_lengths: List[int], encoded_labels: List[List[int]],
+               blank: int) -> ndarray:
+    """
+    Negative log likelihoods of the labels given the grapheme probabilities, as calculated by Keras' ctc_batch_cost,
+    using the forward algorithm in log space, vectorized over the batch and label positions.
+    :param prediction_batch: In shape (example, time, grapheme).
+    """
+    batch_size = prediction_batch.shape[0]
+    log_probabilities = numpy.log(prediction_batch.astype(numpy.float64) + _ctc_epsilon)
+    # ctc_batch_cost normalizes the logarithms with a softmax:
+    log_probabilities -= numpy.logaddexp.reduce(log_probabilities, axis=2, keepdims=True)
+
+    label_lengths = numpy.array([len(label) for label in encoded_labels])
+    state_count = 2 * max(max(label_lengths), 1) + 1
+    # labels interleaved with blanks, padded with blanks:
+    states = numpy.full((batch_size, state_count), blank, dtype=numpy.int64)
+    for index, label in enumerate(encoded_labels):
+        states[index, 1:2 * len(label):2] = label
+
+    # skipping a blank is allowed only between different graphemes:
+    can_skip = numpy.zeros((batch_size, state_count), dtype=bool)
+    can_skip[:, 2:] = (states[:, 2:] != blank) & (states[:, 2:] != states[:, :-2])
+    valid_states = numpy.arange(state_count)[None, :] < (2 * label_lengths + 1)[:, None]
+
+    batch_indices = numpy.arange(batch_size)[:, None]
+    alpha = numpy.full((batch_size, state_count), -numpy.inf)
+    alpha[:, :2] = log_probabilities[batch_indices, 0, states[:, :2]]
+    alpha[~valid_states] = -numpy.inf
+
+    lengths = numpy.array(prediction_lengths)
+    for time in range(1, int(lengths.max())):
+        previous = alpha
+        alpha = previous.copy()
+        alpha[:, 1:] = numpy.logaddexp(alpha[:, 1:], previous[:, :-1])
+        alpha[:, 2:] = numpy.where(can_skip[:, 2:], numpy.logaddexp(alpha[:, 2:], previous[:, :-2]), alpha[:, 2:])
+        alpha += log_probabilities[batch_indices, time, states]
+        alpha[~valid_states] = -numpy.inf
+        # examples that already ended keep their final values:
+        alpha = numpy.where((time < lengths)[:, None], alpha, previous)
+
+    last_states = 2 * label_lengths
+    final = numpy.logaddexp(alpha[numpy.arange(batch_size), last_states],
+                            numpy.where(label_lengths > 0, alpha[numpy.arange(batch_size), last_states - 1], -numpy.inf))
+    return -final
+
+
+class ExampleEvaluation:
+    def __init__(self, expected: str, predicted: str, loss: Optional[float], character_edit_count: int,
+                 word_edit_count: int):
+        self.expected = expected
+        self.predicted = predicted
+        self.loss = loss
+        self.character_edit_count = character_edit_count
+        self.word_edit_count = word_edit_count
+
+    @property
+    def character_count(self) -> int:
+        return len(self.expected)
+
+    @property
+    def word_count(self) -> int:
+        return len(self.expected.split())
+
+    def as_dict(self) -> dict:
+        return {"expected": self.expected, "predicted": self.predicted, "loss": self.loss,
+                "character_edit_count": self.character_edit_count, "word_edit_count": self.word_edit_count}
+
+
+class EvaluationReport:
+    def __init__(self, example_evaluations: List[ExampleEvaluation]):
+        self.example_evaluations = example_evaluations
+
+    @property
+    def example_count(self) -> int:
+        return len(self.example_evaluations)
+
+    @property
+    def loss(self) -> Optional[float]:
+        losses = [e.loss for e in self.example_evaluations]
+        if not losses or None in losses:
+            return None
+
+        return float(numpy.mean(losses))
+
+    @property
+    def character_error_rate(self) -> float:
+        return sum(e.character_edit_count for e in self.example_evaluations) / \
+               max(1, sum(e.character_count for e in self.example_evaluations))
+
+    @property
+    def word_error_rate(self) -> float:
+        return sum(e.word_edit_count for e in self.example_evaluations) / \
+               max(1, sum(e.word_count for e in self.example_evaluations))
+
+    def as_dict(self) -> dict:
+        return {"example_count": self.example_count, "loss": self.loss,
+                "character_error_rate": self.character_error_rate, "word_error_rate": self.word_error_rate,
+                "examples": [e.as_dict() for e in self.example_evaluations]}
+
+    def __str__(self):
+        return "{} examples: loss {}, character error rate {:.2%}, word error rate {:.2%}".format(
+            self.example_count, "{:.4f}".format(self.loss) if self.loss is not None else "unknown",
+            self.character_error_rate, self.word_error_rate)
+
+
+class Evaluator:
+    """
+    Computes loss, greedy transcriptions and edit distances from the same grapheme probabilities,
+    so the network runs only once per batch. The loss is only available for CTC.
+    """
+
+    def __init__(self, grapheme_encoding: GraphemeEncodingBase):
+        self.grapheme_encoding = grapheme_encoding
+
+    def evaluate_batch(self, prediction_batch: ndarray, prediction_lengths: List[int],
+                       labels: List[str]) -> List[ExampleEvaluation]:
+        predictions = self.grapheme_encoding.decode_prediction_batch(prediction_batch,
+                                                                     prediction_lengths=prediction_lengths)
+        losses = ctc_losses(prediction_batch, prediction_lengths,
+                            encoded_labels=[self.grapheme_encoding.encode(label) for label in labels],
+                            blank=self.grapheme_encoding.ctc_blank) \
+            if isinstance(self.grapheme_encoding, CtcGraphemeEncoding) else [None] * len(labels)
+
+        character_edit_counts = edit_distances(predictions, labels)
+        word_edit_counts = edit_distances([p.split() for p in predictions], [l.split() for l in labels])
+
+        return [ExampleEvaluation(expected=label, predicted=predicted,
+                                  loss=float(loss) if loss is not None else None,
+                                  character_edit_count=int(character_edit_count),
+                                  word_edit_count=int(word_edit_count))
+                for label, predicted, loss, character_edit_count, word_edit_count
+                in zip(labels, predictions, losses, character_edit_counts, word_edit_counts)]
+
+    def evaluate_stored(self, posterior_store: PosteriorStore, labels_by_id: Dict[str, str],
+                        batch_size: int = 64) -> EvaluationReport:
+        """Evaluates probabilities saved in a PosteriorStore instead of running the network."""
+        ids = sorted(labels_by_id.keys())
+        example_evaluations = []
+        for start in range(0, len(ids), batch_size):
+            batch_ids = ids[start:start + batch_size]
+            prediction_batch, prediction_lengths = posterior_store.prediction_batch(batch_ids)
+            example_evaluations += self.evaluate_batch(prediction_batch, prediction_lengths=prediction_lengths,
+                                                       labels=[labels_by_id[id] for id in batch_ids])
+
+        return EvaluationReport(example_evaluations)
@@ -0,0 +1,144 @@
+"""
+Features derived from a spectrogram of shape (time, frequencies), e. g. the cached z-normalized mel spectrogram,
+with a few matrix operations instead of decoding the audio and calculating a new STFT. Each transform has a key
+naming it with its parameters, under which its results are cached, see DerivedLabeledSpectrogram.
+"""
+from abc import ABCMeta, abstractmethod
+
+import numpy
+from numpy import ndarray
+from typing import Sequence
+
+
+class FeatureTransform:
+    __metaclass__ = ABCMeta
+
+    @property
+    @abstractmethod
+    def key(self) -> str: raise NotImplementedError
+
+    @abstractmethod
+    def apply(self, features: ndarray) -> ndarray:
+        """Maps features of shape (time, feature) to features of shape (time, feature)."""
+        raise NotImplementedError
+
+    def time_step_reduction(self) -> int:
+        """
+        Factor by which the number of time steps is reduced. Spectrogram frames per prediction of a net are this
+        times its input_to_prediction_length_ratio, see LabeledSpectrogramBatchGenerator.time_step_reduction.
+        """
+        return 1
+
+
+def dct_matrix(input_size: int, output_size: int) -> ndarray:
+    """Orthonormal DCT-II as a matrix of shape (input_size, output_size), to be multiplied from the right."""
+    positions = numpy.arange(input_size)[:, None] + .5
+    frequencies = numpy.arange(output_size)[None, :]
+    matrix = numpy.cos(numpy.pi / input_size * positions * frequencies) * numpy.sqrt(2. / input_size)
+    matrix[:, 0] /= numpy.sqrt(2.)
+    return matrix
+
+
+class Mfcc(FeatureTransform):
+    """
+    The first coefficient_count cepstral coefficients of a log mel spectrogram. Of the z-normalized log mel
+    spectrogram, these equal the usual MFCCs up to a scale and an offset of the first coefficient per utterance.
+    """
+
+    def __init__(self, coefficient_count: int = 13):
+        self.coefficient_count = coefficient_count
+
+    @property
+    def key(self) -> str:
+        return "mfcc{}".format(self.coefficient_count)
+
+    def apply(self, features: ndarray) -> ndarray:
+        return features.dot(dct_matrix(features.shape[1], self.coefficient_count).astype(features.dtype))
+
+
+class Deltas(FeatureTransform):
+    """
+    Appends the deltas up to the given order, each the regression over width frames like in HTK,
+    with the first and last frame repeated at the edges. Order 2 triples the feature count.
+    """
+
+    def __init__(self, order: int = 2, width: int = 9):
+        if width < 3 or width % 2 == 0:
+            raise ValueError("Expected an odd width of at least 3, got {}.".format(width))
+
+        self.order = order
+        self.width = width
+
+    @property
+    def key(self) -> str:
+        return "deltas{}w{}".format(self.order, self.width)
+
+    def _delta(self, features: ndarray) -> ndarray:
+        half_width = self.width // 2
+        padded = numpy.pad(features, ((half_width, half_width), (0, 0)), mode='edge')
+        time_step_count = features.shape[0]
+        delta = numpy.zeros_like(features)
+        for n in range(1, half_width + 1):
+            delta += n * (padded[half_width + n:half_width + n + time_step_count] -
+                          padded[half_width - n:half_width - n + time_step_count])
+
+        return delta / (2 * sum(n ** 2 for n in range(1, half_width + 1)))
+
+    def apply(self, features: ndarray) -> ndarray:
+        orders = [features]
+        for _ in range(self.order):
+            orders.append(self._delta(orders[-1]))
+
+        return numpy.concatenate(orders, axis=1)
+
+
+class StackedFrames(FeatureTransform):
+    """
+    Concatenates frame_count consecutive frames to one, keeping every subsampling-th, so that there are
+    len / subsampling time steps (rounded up), the last frame being repeated at the end.
+    """
+
+    def __init__(self, frame_count: int = 3, subsampling: int = 3):
+        self.frame_count = frame_count
+        self.subsampling = subsampling
+
+    @property
+    def key(self) -> str:
+        return "stacked{}s{}".format(self.frame_count, self.subsampling)
+
+    def time_step_reduction(self) -> int:
+        return self.subsampling
+
+    def apply(self, features: ndarray) -> ndarray:
+        time_step_count, feature_count = features.shape
+        output_length = -(-time_step_count // self.subsampling)
+        starts = numpy.arange(output_length)[:, None] * self.subsampling
+        indices = numpy.minimum(starts + numpy.arange(self.frame_count)[None, :], time_step_count - 1)
+        return features[indices].reshape((output_length, self.frame_count * feature_count))
+
+
+class FeaturePipeline(FeatureTransform):
+    """Transforms applied one after the other, e. g. FeaturePipeline([Mfcc(), Deltas()])."""
+
+    def __init__(self, transforms: Sequence[FeatureTransform]):
+        if not transforms:
+            raise ValueError("Expected at least one transform.")
+
+        self.transforms = list(transforms)
+
+    @property
+    def key(self) -> str:
+        return "-".join(transform.key for transform in self.transforms)
+
+    def time_step_reduction(self) -> int:
+        reduction = 1
+        for transform in self.transforms:
+            reduction *= transform.time_step_reduction()
+
+        return reduction
+
+    def apply(self, features: ndarray) -> ndarray:
+        for transform in self.transforms:
+            features = transform.apply(features)
+
+        return features
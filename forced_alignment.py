@@ -0,0 +1,176 @@
+"""
+CTC forced alignment: the most probable path of grapheme predictions that yields a known label, and with it
+the frames, and thus times, of each character and word.
+
+The Viterbi recursion runs over the label extended by blanks between and around its characters, as in the CTC loss,
+vectorized over a padded batch of examples and extended label positions, so that only time is iterated in Python.
+"""
+import numpy
+from numpy import ndarray
+from typing import List, Optional
+
+from grapheme_enconding import CtcGraphemeEncoding
+
+_impossible = -numpy.inf
+
+
+class CharacterSpan:
+    """Frames from start_frame to end_frame (exclusive) of one character of the label, and the according times."""
+
+    def __init__(self, character: str, start_frame: int, end_frame: int, seconds_per_frame: float):
+        self.character = character
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.start_in_s = start_frame * seconds_per_frame
+        self.end_in_s = end_frame * seconds_per_frame
+
+    def __str__(self):
+        return "{} {:.2f}s-{:.2f}s".format(self.character, self.start_in_s, self.end_in_s)
+
+
+class WordSpan:
+    def __init__(self, characters: List[CharacterSpan]):
+        self.characters = characters
+        self.word = "".join(c.character for c in characters)
+        self.start_frame = characters[0].start_frame
+        self.end_frame = characters[-1].end_frame
+        self.start_in_s = characters[0].start_in_s
+        self.end_in_s = characters[-1].end_in_s
+
+    def __str__(self):
+        return "{} {:.2f}s-{:.2f}s".format(self.word, self.start_in_s, self.end_in_s)
+
+
+class Alignment:
+    """
+    :param log_probability: Of the most probable path, -inf if the label cannot be aligned,
+    e. g. because it needs more frames than predicted, in which case there are no spans.
+    """
+
+    def __init__(self, label: str, log_probability: float, character_spans: List[CharacterSpan]):
+        self.label = label
+        self.log_probability = log_probability
+        self.character_spans = character_spans
+
+    @property
+    def is_possible(self) -> bool:
+        return self.log_probability != _impossible
+
+    @property
+    def word_spans(self) -> List[WordSpan]:
+        words = []
+        current = []
+        for span in self.character_spans + [None]:
+            if span is None or span.character == " ":
+                if current:
+                    words.append(WordSpan(current))
+                current = []
+            else:
+                current.append(span)
+
+        return words
+
+
+class CtcForcedAligner:
+    """
+    Aligns labels to predictions of a net trained with CTC loss, e. g. from Wav2Letter.prediction_batch.
+    A prediction frame lasts input_to_prediction_length_ratio spectrogram time steps of hop_length samples each.
+    """
+
+    def __init__(self, grapheme_encoding: CtcGraphemeEncoding, input_to_prediction_length_ratio: int,
+                 hop_length: int = 128, sample_rate: int = 16000):
+        self.grapheme_encoding = grapheme_encoding
+        self.seconds_per_frame = input_to_prediction_length_ratio * hop_length / sample_rate
+
+    def _extended_labels(self, labels: List[str]):
+        """Labels with blanks between and around the characters, padded with blanks, and their lengths."""
+        encoded = [self.grapheme_encoding.encode(label) for label in labels]
+        extended_lengths = numpy.array([2 * len(e) + 1 for e in encoded])
+        extended = numpy.full((len(labels), extended_lengths.max()), self.grapheme_encoding.ctc_blank,
+                              dtype=numpy.int64)
+        for index, e in enumerate(encoded):
+            extended[index, 1:2 * len(e):2] = e
+
+        return extended, extended_lengths
+
+    def align_batch(self, prediction_batch: ndarray, prediction_lengths: List[int],
+                    labels: List[str]) -> List[Alignment]:
+        """
+        :param prediction_batch: Grapheme probabilities in shape (example, time, grapheme).
+        """
+        batch_size, frame_count, _ = prediction_batch.shape
+        if batch_size == 0:
+            return []
+
+        lengths = numpy.array(prediction_lengths)
+        extended, extended_lengths = self._extended_labels(labels)
+        state_count = extended.shape[1]
+        examples = numpy.arange(batch_size)
+        states = numpy.arange(state_count)[None, :]
+        valid_states = states < extended_lengths[:, None]
+        # a skip from state s - 2 is allowed into characters that differ from the previous character:
+        skip_allowed = numpy.zeros((batch_size, state_count), dtype=bool)
+        skip_allowed[:, 2:] = (extended[:, 2:] != self.grapheme_encoding.ctc_blank) & \
+                              (extended[:, 2:] != extended[:, :-2])
+
+        with numpy.errstate(divide='ignore'):
+            log_probabilities = numpy.log(prediction_batch.astype(numpy.float64, copy=False))
+
+        def emissions(frame: int) -> ndarray:
+            return numpy.where(valid_states, numpy.take_along_axis(log_probabilities[:, frame], extended, axis=1),
+                               _impossible)
+
+        scores = numpy.full((batch_size, state_count), _impossible)
+        scores[:, :2] = emissions(0)[:, :2]
+        # 0: stayed in the state, 1: came from the previous state, 2: skipped the blank before the state:
+        steps = numpy.zeros((frame_count, batch_size, state_count), dtype=numpy.int8)
+        final_scores = numpy.full((batch_size, state_count), _impossible)
+        final_scores[lengths == 1] = scores[lengths == 1]
+
+        for frame in range(1, frame_count):
+            from_previous = numpy.full_like(scores, _impossible)
+            from_previous[:, 1:] = scores[:, :-1]
+            from_skip = numpy.full_like(scores, _impossible)
+            from_skip[:, 2:] = numpy.where(skip_allowed[:, 2:], scores[:, :-2], _impossible)
+
+            candidates = numpy.stack([scores, from_previous, from_skip])
+            steps[frame] = numpy.argmax(candidates, axis=0)
+            scores = numpy.max(candidates, axis=0) + emissions(frame)
+
+            ending = lengths == frame + 1
+            final_scores[ending] = scores[ending]
+
+        # the path ends in the last character or the blank after it:
+        last_states = numpy.stack([extended_lengths - 1, numpy.maximum(extended_lengths - 2, 0)], axis=1)
+        last_scores = final_scores[examples[:, None], last_states]
+        state = last_states[examples, numpy.argmax(last_scores, axis=1)]
+        log_probability_by_example = numpy.max(last_scores, axis=1)
+
+        paths = numpy.full((batch_size, frame_count), -1, dtype=numpy.int64)
+        for frame in range(frame_count - 1, -1, -1):
+            active = frame < lengths
+            paths[active, frame] = state[active]
+            state = numpy.where(active, state - steps[frame, examples, state], state)
+
+        return [self._alignment(label, float(log_probability), paths[index, :lengths[index]])
+                for index, (label, log_probability) in enumerate(zip(labels, log_probability_by_example))]
+
+    def _alignment(self, label: str, log_probability: float, path: ndarray) -> Alignment:
+        if log_probability == _impossible:
+            return Alignment(label, log_probability, character_spans=[])
+
+        character_frames = numpy.flatnonzero(path % 2 == 1)
+        character_indices = (path[character_frames] - 1) // 2
+        # each character of the label occupies one run of consecutive frames of the path:
+        run_starts = numpy.flatnonzero(numpy.diff(numpy.append(-1, character_indices)) != 0)
+        run_ends = numpy.append(run_starts[1:], len(character_indices)) - 1
+
+        return Alignment(label, log_probability, character_spans=[
+            CharacterSpan(label[character_indices[start]], start_frame=int(character_frames[start]),
+                          end_frame=int(character_frames[end]) + 1, seconds_per_frame=self.seconds_per_frame)
+            for start, end in zip(run_starts, run_ends)])
+
+    def align(self, predictions: ndarray, label: str, prediction_length: Optional[int] = None) -> Alignment:
+        """Aligns a single example with predictions in shape (time, grapheme)."""
+        return self.align_batch(predictions[None], [predictions.shape[0] if prediction_length is None
+                                                     else prediction_length], [label])[0]
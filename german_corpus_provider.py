@@ -5,10 +5,12 @@ from pathlib import Path
 from typing import Iterable, Dict, Callable, Optional, List, Tuple
 from xml.etree import ElementTree
 
+from corpus_preparation import CorpusPreparation
 from corpus_provider import CorpusProvider, ParsingException, TrainingTestSplit
 from grapheme_enconding import frequent_characters_in_german
 from labeled_example import LabeledExample
 from tools import read_text, single, single_or_none, name_without_extension
+from transcript_normalization import TranscriptNormalizer
 
 _tags_to_ignore = [
     "<usb>",  # truncated in the beginning
@@ -29,15 +31,47 @@ _tags_to_ignore = [
 
 
 class UmlautDecoder:
-    none = lambda text: text
-    quote_before_umlaut = lambda text: text. \
-        replace('\\"a', 'ä').replace('\\"o', 'ö').replace('\\"u', 'ü').replace('\\"s', 'ß'). \
-        replace('"a', 'ä').replace('"o', 'ö').replace('"u', 'ü').replace('"s', 'ß')
-    quote_after_umlaut = lambda text: text. \
-        replace('a\\"', 'ä').replace('o\\"', 'ö').replace('u\\"', 'ü').replace('s\\"', 'ß'). \
-        replace('a"', 'ä').replace('o"', 'ö').replace('u"', 'ü').replace('s"', 'ß')
-    try_quote_before_umlaut_then_after = lambda text: UmlautDecoder.quote_after_umlaut(
-        UmlautDecoder.quote_before_umlaut(text))
+    none = TranscriptNormalizer()
+    quote_before_umlaut = TranscriptNormalizer([
+        ('\\"a', 'ä'), ('\\"o', 'ö'), ('\\"u', 'ü'), ('\\"s', 'ß'),
+        ('"a', 'ä'), ('"o', 'ö'), ('"u', 'ü'), ('"s', 'ß')])
+    quote_after_umlaut = TranscriptNormalizer([
+        ('a\\"', 'ä'), ('o\\"', 'ö'), ('u\\"', 'ü'), ('s\\"', 'ß'),
+        ('a"', 'ä'), ('o"', 'ö'), ('u"', 'ü'), ('s"', 'ß')])
+    try_quote_before_umlaut_then_after = quote_before_umlaut.then(quote_after_umlaut)
+
+
+# replace('é', 'e') because of TODO
+# replace('xe4', 'ä') because of F09S1MP-Mikro_Prompt_20 (+7 more): " timo hat b  xe4ten gesagt"
+# replace('.', ' ') because of ALC: 5204018034_h_00 contains "in l.a."
+# replace('-', ' ') because of some examples in e. g. ZIPTEL, PD2, SC10 like the following:
+# SC10: awed5070: "darf ich eine ic-fahrt zwischendurch unterbrechen"
+_clarin_normalizer = TranscriptNormalizer([('é', 'e'), ('xe4', 'ä'), ('.', ' '), ('-', ' ')], lowercase=True)
+
+# replace("co2", "co zwei") for e. g. 2014-03-19-16-39-20_Kinect-Beam
+# replace('ț', 't') for e. g. 2015-01-27-11-32-50_Kinect-Beam:
+# "durchlaufende wagen bis constanța wie sie vor dem krieg existierten wurden allerdings nicht mehr eingeführt"
+# replace('š', 's') for e. g. 2015-01-27-13-33-01_Kinect-Beam
+# replace('č', 'c') for e. g. 2015-01-28-11-49-53_Kinect-Beam
+# replace('ę', 'e') for e. g. 2015-01-28-12-35-21_Kinect-Beam:
+# "es ist beschämend dass dieser umstand herrn pęks aufmerksamkeit entgangen ist"
+# replace('ō', 'o') for e. g. 2015-02-03-13-43-46_Kinect-Beam:
+# "alle varianten von sankyo werden im aikidō üblicherweise in eine immobilisation überführt"
+# replace('á', 'a') for e. g. 2015-02-03-13-45-08_Kinect-Beam:
+# "in dieser hinsicht glaube ich dass sich herr szájer herr swoboda ..."
+# replace('í', 'i') for e. g. 2015-02-09-12-35-23_Kinect-Beam:
+# "das andauernde leben in der einsamkeit zermürbt gísli ..."
+# replace('ł', 'l') for e. g. 2015-02-10-13-41-20_Kinect-Beam:
+# "gegenüber dieser bedrohung gelang dem polnischen führer piłsudski ..."
+# replace('à', 'a') for e. g. 2015-02-10-14-29-03_Kinect-Beam:
+# "... à hundert franken"
+# replace('ė', 'e') in 2015-01-27-13-33-01_Kinect-Beam:
+# "...vom preußischen grenzort laugszargen über tauragė ..."
+# replace('ú','u') in 2015-02-04-13-03-47_Kinect-Beam:
+# "... die von renault in setúbal hergestellte produktlinie ..."
+_voxforge_normalizer = TranscriptNormalizer([
+    ("co2", "co zwei"), ('ț', 't'), ('š', 's'), ('č', 'c'), ('ę', 'e'), ('ō', 'o'), ('á', 'a'), ('í', 'i'),
+    ('ł', 'l'), ('à', 'a'), ('ė', 'e'), ('ú', 'u')])
 
 
 class GermanClarinCorpusProvider(CorpusProvider):
@@ -57,8 +91,10 @@ class GermanClarinCorpusProvider(CorpusProvider):
                  tags_to_ignore: Iterable[str] = _tags_to_ignore,
                  id_filter_regex=re.compile('[\s\S]*'),
                  training_test_split: Callable[[List[LabeledExample]], Tuple[
-                     List[LabeledExample], List[LabeledExample]]] = TrainingTestSplit.randomly_by_directory(.9)):
+                     List[LabeledExample], List[LabeledExample]]] = TrainingTestSplit.randomly_by_directory(.9),
+                 preparation: Optional[CorpusPreparation] = None):
         self.umlaut_decoder = umlaut_decoder
+        self.german_normalizer = self._create_german_normalizer()
 
         super().__init__(base_directory=base_directory,
                          base_source_url_or_directory=base_source_url_or_directory,
@@ -70,7 +106,20 @@ class GermanClarinCorpusProvider(CorpusProvider):
                          tags_to_ignore=tags_to_ignore,
                          id_filter_regex=id_filter_regex,
                          mel_frequency_count=mel_frequency_count,
-                         training_test_split=training_test_split)
+                         training_test_split=training_test_split,
+                         preparation=preparation)
+
+    def _create_german_normalizer(self) -> Callable[[str], str]:
+        if isinstance(self.umlaut_decoder, TranscriptNormalizer):
+            return _clarin_normalizer.then(self.umlaut_decoder)
+
+        return lambda text: self.umlaut_decoder(_clarin_normalizer(text))
+
+    def _decode_german_all(self, texts: List[str]) -> List[str]:
+        if isinstance(self.german_normalizer, TranscriptNormalizer):
+            return self.german_normalizer.normalize_all(texts)
+
+        return [self._decode_german(text) for text in texts]
 
     def _extract_label_from_par(self, par_file: Path) -> str:
         par_text = read_text(par_file, encoding='utf8')
@@ -83,10 +132,9 @@ class GermanClarinCorpusProvider(CorpusProvider):
             [file for file in files if file.name.endswith(json_ending) if
              self.id_filter_regex.match(file.name[:-len(json_ending)])]
 
-        json_extracted = dict(
-            (file.name[:-len(json_ending)], self._extract_label_from_json(file)) for
-            file
-            in json_annotation_files)
+        json_extracted = dict(zip(
+            [file.name[:-len(json_ending)] for file in json_annotation_files],
+            self._decode_german_all([self._extract_undecoded_label_from_json(file) for file in json_annotation_files])))
 
         # TODO decide whether to parse .par files
         # par_annotation_files = [file for file in files if file.name.endswith(".par")]
@@ -102,6 +150,9 @@ class GermanClarinCorpusProvider(CorpusProvider):
         return json_extracted
 
     def _extract_label_from_json(self, json_file: Path) -> str:
+        return self._decode_german(self._extract_undecoded_label_from_json(json_file))
+
+    def _extract_undecoded_label_from_json(self, json_file: Path) -> str:
         json_text = read_text(json_file, encoding='utf8')
         label_names = ("ORT", "word")
         try:
@@ -137,20 +188,12 @@ class GermanClarinCorpusProvider(CorpusProvider):
             if words is None and has_empty_levels:
                 return ""
 
-            return self._decode_german(" ".join(words))
+            return " ".join(words)
         except Exception:
             raise ParsingException("Error parsing annotation {}: {}".format(json_file, json_text[:500]))
 
     def _decode_german(self, text: str) -> str:
-        # replace('é', 'e') because of TODO
-        # replace('xe4', 'ä') because of F09S1MP-Mikro_Prompt_20 (+7 more): " timo hat b  xe4ten gesagt"
-        # replace('.', ' ') because of ALC: 5204018034_h_00 contains "in l.a."
-        # replace('-', ' ') because of some examples in e. g. ZIPTEL, PD2, SC10 like the following:
-        # SC10: awed5070: "darf ich eine ic-fahrt zwischendurch unterbrechen"
-        decoded = self.umlaut_decoder(
-            text.lower().replace('é', 'e').replace('xe4', 'ä').replace('.', ' ').replace('-', ' '))
-
-        return decoded
+        return self.german_normalizer(text)
 
 
 # from the VM1 readme:
@@ -179,30 +222,36 @@ vm1_id_German_filter_regex = re.compile("[klmngzjw][\s\S]*")
 vm2_id_German_filter_regex = re.compile("g[\s\S]*|m[\s\S]*_GER")
 
 
-def clarin_corpus_providers_sorted_by_size(base_directory: Path) -> List[GermanClarinCorpusProvider]:
+def clarin_corpus_provider_factories_sorted_by_size(base_directory: Path) -> List[
+    Callable[[CorpusPreparation], GermanClarinCorpusProvider]]:
+    def factory(corpus_name: str, **kwargs) -> Callable[[CorpusPreparation], GermanClarinCorpusProvider]:
+        return lambda preparation: GermanClarinCorpusProvider(corpus_name, base_directory, preparation=preparation,
+                                                              **kwargs)
+
     return [
-        GermanClarinCorpusProvider("all.SC1.3.cmdi.15010.1490631864", base_directory,
-                                   umlaut_decoder=UmlautDecoder.quote_after_umlaut),
-        GermanClarinCorpusProvider("all.PD2.4.cmdi.16693.1490681127", base_directory),
-        GermanClarinCorpusProvider("all.ZIPTEL.3.cmdi.63058.1490624016", base_directory),
-        GermanClarinCorpusProvider("all.SC10.4.cmdi.13781.1490631055", base_directory,
-                                   umlaut_decoder=UmlautDecoder.try_quote_before_umlaut_then_after),
-        GermanClarinCorpusProvider("all.HEMPEL.4.cmdi.11610.1490680796", base_directory),
-        GermanClarinCorpusProvider("all.PD1.3.cmdi.16312.1490681066", base_directory),
-        GermanClarinCorpusProvider("all.VM1.3.cmdi.1508.1490625070", base_directory,
-                                   id_filter_regex=vm1_id_German_filter_regex,
-                                   training_test_split=TrainingTestSplit.training_only),
-        GermanClarinCorpusProvider("all.RVG-J.1.cmdi.18181.1490681704", base_directory),
-        GermanClarinCorpusProvider("all.ALC.4.cmdi.16602.1490632862", base_directory,
-                                   training_test_split=TrainingTestSplit.training_only),
-        GermanClarinCorpusProvider("all.VM2.3.cmdi.4260.1490625316", base_directory,
-                                   id_filter_regex=vm2_id_German_filter_regex,
-                                   training_test_split=TrainingTestSplit.training_only)
+        factory("all.SC1.3.cmdi.15010.1490631864", umlaut_decoder=UmlautDecoder.quote_after_umlaut),
+        factory("all.PD2.4.cmdi.16693.1490681127"),
+        factory("all.ZIPTEL.3.cmdi.63058.1490624016"),
+        factory("all.SC10.4.cmdi.13781.1490631055", umlaut_decoder=UmlautDecoder.try_quote_before_umlaut_then_after),
+        factory("all.HEMPEL.4.cmdi.11610.1490680796"),
+        factory("all.PD1.3.cmdi.16312.1490681066"),
+        factory("all.VM1.3.cmdi.1508.1490625070", id_filter_regex=vm1_id_German_filter_regex,
+                training_test_split=TrainingTestSplit.training_only),
+        factory("all.RVG-J.1.cmdi.18181.1490681704"),
+        factory("all.ALC.4.cmdi.16602.1490632862", training_test_split=TrainingTestSplit.training_only),
+        factory("all.VM2.3.cmdi.4260.1490625316", id_filter_regex=vm2_id_German_filter_regex,
+                training_test_split=TrainingTestSplit.training_only)
     ]
 
 
+def clarin_corpus_providers_sorted_by_size(base_directory: Path, preparation: Optional[CorpusPreparation] = None) -> \
+        List[GermanClarinCorpusProvider]:
+    return (preparation or CorpusPreparation()).create_providers(
+        clarin_corpus_provider_factories_sorted_by_size(base_directory))
+
+
 class GermanVoxforgeCorpusProvider(GermanClarinCorpusProvider):
-    def __init__(self, base_directory: Path):
+    def __init__(self, base_directory: Path, preparation: Optional[CorpusPreparation] = None):
         super().__init__(
             corpus_name="german-speechdata-package-v2",
             base_directory=base_directory,
@@ -212,7 +261,8 @@ class GermanVoxforgeCorpusProvider(GermanClarinCorpusProvider):
             umlaut_decoder=UmlautDecoder.none,
             # exclude files starting with dot:
             id_filter_regex=re.compile('[^.][\s\S]*', ),
-            training_test_split=TrainingTestSplit.by_directory())
+            training_test_split=TrainingTestSplit.by_directory(),
+            preparation=preparation)
 
     def _extract_labels_by_id(self, files: Iterable[Path]):
         xml_ending = ".xml"
@@ -229,46 +279,33 @@ class GermanVoxforgeCorpusProvider(GermanClarinCorpusProvider):
         xml_files = [file for file in files if file.name.endswith(xml_ending) if
                      self.id_filter_regex.match(name_without_extension(file))]
 
+        labels = self._decode_german_all([self._extract_undecoded_label_from_xml(file) for file in xml_files])
+
         return dict(
-            (name_without_extension(file) + microphone_ending, self._extract_label_from_xml(file))
-            for file in xml_files
+            (name_without_extension(file) + microphone_ending, label)
+            for file, label in zip(xml_files, labels)
             for microphone_ending in microphone_endings
             if (Path(file.parent) / (name_without_extension(file) + microphone_ending + ".wav")).exists())
 
-    def _decode_german(self, text: str) -> str:
-        # replace("co2", "co zwei") for e. g. 2014-03-19-16-39-20_Kinect-Beam
-        # replace('ț', 't') for e. g. 2015-01-27-11-32-50_Kinect-Beam:
-        # "durchlaufende wagen bis constanța wie sie vor dem krieg existierten wurden allerdings nicht mehr eingeführt"
-        # replace('š', 's') for e. g. 2015-01-27-13-33-01_Kinect-Beam
-        # replace('č', 'c') for e. g. 2015-01-28-11-49-53_Kinect-Beam
-        # replace('ę', 'e') for e. g. 2015-01-28-12-35-21_Kinect-Beam:
-        # "es ist beschämend dass dieser umstand herrn pęks aufmerksamkeit entgangen ist"
-        # replace('ō', 'o') for e. g. 2015-02-03-13-43-46_Kinect-Beam:
-        # "alle varianten von sankyo werden im aikidō üblicherweise in eine immobilisation überführt"
-        # replace('á', 'a') for e. g. 2015-02-03-13-45-08_Kinect-Beam:
-        # "in dieser hinsicht glaube ich dass sich herr szájer herr swoboda ..."
-        # replace('í', 'i') for e. g. 2015-02-09-12-35-23_Kinect-Beam:
-        # "das andauernde leben in der einsamkeit zermürbt gísli ..."
-        # replace('ł', 'l') for e. g. 2015-02-10-13-41-20_Kinect-Beam:
-        # "gegenüber dieser bedrohung gelang dem polnischen führer piłsudski ..."
-        # replace('à', 'a') for e. g. 2015-02-10-14-29-03_Kinect-Beam:
-        # "... à hundert franken"
-        # replace('ė', 'e') in 2015-01-27-13-33-01_Kinect-Beam:
-        # "...vom preußischen grenzort laugszargen über tauragė ..."
-        # replace('ú','u') in 2015-02-04-13-03-47_Kinect-Beam:
-        # "... die von renault in setúbal hergestellte produktlinie ..."
-        return super()._decode_german(text).replace("co2", "co zwei").replace('ț', 't'). \
-            replace('š', 's').replace('č', 'c').replace('ę', 'e').replace('ō', 'o').replace('á', 'a'). \
-            replace('í', 'i').replace('ł', 'l').replace('à', 'a').replace('ė', 'e').replace('ú', 'u')
+    def _create_german_normalizer(self) -> Callable[[str], str]:
+        return super()._create_german_normalizer().then(_voxforge_normalizer)
 
     def _extract_label_from_xml(self, xml_file: Path) -> str:
+        return self._decode_german(self._extract_undecoded_label_from_xml(xml_file))
+
+    def _extract_undecoded_label_from_xml(self, xml_file: Path) -> str:
         try:
-            return self._decode_german(
-                ElementTree.parse(str(xml_file)).getroot().find('.//cleaned_sentence').text.lower())
+            return ElementTree.parse(str(xml_file)).getroot().find('.//cleaned_sentence').text.lower()
         except Exception:
             raise ParsingException("Error parsing annotation {}".format(xml_file))
 
 
-def german_corpus_providers(base_directory: Path) -> List[CorpusProvider]:
-    return clarin_corpus_providers_sorted_by_size(base_directory=base_directory) + \
-           [GermanVoxforgeCorpusProvider(base_directory=base_directory)]
+def german_corpus_providers(base_directory: Path, preparation: Optional[CorpusPreparation] = None) -> List[
+    CorpusProvider]:
+    """
+    :param preparation: Pass a corpus_preparation.ConcurrentCorpusPreparation to fetch, unpack and index the corpora
+    in parallel.
+    """
+    return (preparation or CorpusPreparation()).create_providers(
+        clarin_corpus_provider_factories_sorted_by_size(base_directory=base_directory) +
+        [lambda preparation: GermanVoxforgeCorpusProvider(base_directory=base_directory, preparation=preparation)])
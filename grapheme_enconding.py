@@ -3,7 +3,9 @@ from abc import abstractmethod
 from itertools import groupby
 
 from numpy import argmax, ones, ndarray, array
-from typing import List
+from typing import List, Optional
+
+from buffer_pool import BufferLease
 
 frequent_characters_in_english = list(string.ascii_lowercase + " '")
 frequent_characters_in_german = frequent_characters_in_english + list("äöüß")
@@ -26,12 +28,20 @@ class GraphemeEncodingBase:
     def encode(self, label: str) -> List[int]:
         pass
 
-    def encode_label_batch(self, labels: List[str]):
+    def encode_label_batch(self, labels: List[str], buffer_lease: Optional[BufferLease] = None):
+        """
+        :param buffer_lease: If given, the labels are written into a pooled buffer owned by the lease.
+        """
         batch_size = len(labels)
         label_lengths = [len(label) for label in labels]
-        label_batch = -ones((batch_size, max(label_lengths)), dtype='int32')
+        shape = (batch_size, max(label_lengths))
+        if buffer_lease is None:
+            label_batch = -ones(shape, dtype='int32')
+        else:
+            label_batch = buffer_lease.array(shape, dtype='int32')
         for index, label in enumerate(labels):
             label_batch[index, :len(label)] = array(self.encode(label))
+            label_batch[index, len(label):] = -1
 
         return label_batch
 
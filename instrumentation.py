@@ -0,0 +1,155 @@
+"""
+Counters and latency histograms for the stages of the data and training pipeline.
+
+Disabled by default; enable with metrics.enable() or by setting the environment variable SPEECHLESS_METRICS=1.
+When disabled, timed(...) returns a shared no-op context manager and count(...) returns immediately.
+"""
+import json
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+
+import os
+from typing import Dict, List
+
+
+def _default_bucket_bounds() -> List[float]:
+    # from 10µs to about 170s, each bound doubling the previous one:
+    return [1e-5 * 2 ** i for i in range(25)]
+
+
+class Histogram:
+    def __init__(self, bucket_bounds: List[float]):
+        self.bucket_bounds = bucket_bounds
+        # the last bucket counts observations above the highest bound:
+        self.bucket_counts = [0] * (len(bucket_bounds) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.max = 0.
+
+    def observe(self, value: float) -> None:
+        self.bucket_counts[bisect_left(self.bucket_bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket containing the quantile."""
+        if self.count == 0:
+            return 0.
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.bucket_bounds + [self.max], self.bucket_counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self) -> dict:
+        return {"count": self.count, "sum_s": self.sum, "mean_s": self.sum / self.count if self.count else 0.,
+                "max_s": self.max, "p50_s": self.quantile(.5), "p99_s": self.quantile(.99)}
+
+
+class _NoOpContext:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_no_op_context = _NoOpContext()
+
+
+class Metrics:
+    def __init__(self, enabled: bool = False, bucket_bounds: List[float] = None):
+        self.enabled = enabled
+        self.bucket_bounds = bucket_bounds if bucket_bounds is not None else _default_bucket_bounds()
+        self._lock = Lock()
+        self.counters = dict()  # type: Dict[str, float]
+        self.histograms = dict()  # type: Dict[str, Histogram]
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters = dict()
+            self.histograms = dict()
+
+    def count(self, name: str, value: float = 1) -> None:
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, duration_in_s: float) -> None:
+        if not self.enabled:
+            return
+
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = Histogram(self.bucket_bounds)
+                self.histograms[name] = histogram
+            histogram.observe(duration_in_s)
+
+    def timed(self, name: str):
+        """Context manager recording the duration of its body into the latency histogram with the given name."""
+        if not self.enabled:
+            return _no_op_context
+
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"counters": dict(self.counters),
+                    "histograms": dict((name, histogram.as_dict()) for name, histogram in self.histograms.items())}
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+    def to_prometheus_text(self, prefix: str = "speechless_") -> str:
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                metric = prefix + name + "_total"
+                lines += ["# TYPE {} counter".format(metric), "{} {}".format(metric, value)]
+
+            for name, histogram in sorted(self.histograms.items()):
+                metric = prefix + name + "_seconds"
+                lines.append("# TYPE {} histogram".format(metric))
+                cumulative = 0
+                for bound, count in zip(histogram.bucket_bounds, histogram.bucket_counts):
+                    cumulative += count
+                    lines.append('{}_bucket{{le="{:g}"}} {}'.format(metric, bound, cumulative))
+                lines += ['{}_bucket{{le="+Inf"}} {}'.format(metric, histogram.count),
+                          "{}_sum {}".format(metric, histogram.sum),
+                          "{}_count {}".format(metric, histogram.count)]
+
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        snapshot = self.snapshot()
+        return "\n".join(
+            ["{:32} n={:<8} mean {:8.2f}ms  p99 <= {:8.2f}ms  total {:8.2f}s".format(
+                name, h["count"], 1000 * h["mean_s"], 1000 * h["p99_s"], h["sum_s"])
+                for name, h in sorted(snapshot["histograms"].items())] +
+            ["{:32} {}".format(name, value) for name, value in sorted(snapshot["counters"].items())])
+
+
+metrics = Metrics(enabled=os.environ.get("SPEECHLESS_METRICS", "0") not in ("", "0"))
@@ -1,15 +1,19 @@
+import copy
 import math
 from enum import Enum
 from pathlib import Path
 
-import audioread
-import librosa
 import os
 from lazy import lazy
 from numpy import ndarray, mean, std, vectorize, dot
 from typing import List, Callable, Optional
 
+from audio_metadata import AudioMetadata
+from dtype_policy import DtypePolicy, default_dtype_policy
+from instrumentation import metrics
+from pcm_cache import PcmCache
 from tools import name_without_extension
+from voice_activity import FrameEnergyVoiceActivityDetector
 
 
 class SpectrogramFrequencyScale(Enum):
@@ -24,7 +28,8 @@ class SpectrogramType(Enum):
 
 
 def z_normalize(array: ndarray) -> ndarray:
-    return (array - mean(array)) / std(array)
+    with metrics.timed("z_normalize"):
+        return (array - mean(array)) / std(array)
 
 
 class LabeledExample:
@@ -36,7 +41,11 @@ class LabeledExample:
                  fourier_window_length: int = 512,
                  hop_length: int = 128,
                  mel_frequency_count: int = 128,
-                 original_label_with_tags_from_id: Callable[[str], Optional[str]] = lambda id: None):
+                 original_label_with_tags_from_id: Callable[[str], Optional[str]] = lambda id: None,
+                 audio_metadata: Optional[AudioMetadata] = None,
+                 pcm_cache: Optional[PcmCache] = None,
+                 dtype_policy: DtypePolicy = default_dtype_policy,
+                 voice_activity_detector: Optional[FrameEnergyVoiceActivityDetector] = None):
         if id is None:
             id = name_without_extension(audio_file)
 
@@ -49,6 +58,14 @@ class LabeledExample:
         self.hop_length = hop_length
         self.mel_frequency_count = mel_frequency_count
         self.original_label_with_tags = original_label_with_tags_from_id(id)
+        # If given, duration and original sample rate are taken from it instead of decoding the audio file:
+        self.audio_metadata = audio_metadata
+        # If given, decoded and resampled audio is read from and written to it:
+        self.pcm_cache = pcm_cache
+        self.dtype_policy = dtype_policy
+        # If given, leading and trailing silence is removed from the decoded audio:
+        self.voice_activity_detector = voice_activity_detector
+        self.removed_silence_frame_count = None  # type: Optional[int]
 
     @property
     def audio_directory(self):
@@ -59,12 +76,44 @@ class LabeledExample:
 
     @lazy
     def raw_audio(self) -> ndarray:
-        y, sample_rate = librosa.load(str(self.audio_file), sr=self.sample_rate)
+        audio = self._decoded_audio()
+        if self.voice_activity_detector is None:
+            return audio
+
+        with metrics.timed("vad"):
+            trimmed = self.voice_activity_detector.trim(audio)
+        self.removed_silence_frame_count = trimmed.removed_frame_count
+        return trimmed.audio
+
+    def _decoded_audio(self) -> ndarray:
+        if self.pcm_cache is not None and self.pcm_cache.sample_rate == self.sample_rate:
+            return self.pcm_cache.audio(self.id, self.audio_file)
+
+        # librosa is imported only where needed, since importing it takes about a second:
+        import librosa
+
+        with metrics.timed("audio_decode_and_resample"):
+            y, sample_rate = librosa.load(str(self.audio_file), sr=self.sample_rate)
 
         return y
 
+    def with_voice_activity_detector(self,
+                                     voice_activity_detector: FrameEnergyVoiceActivityDetector) -> 'LabeledExample':
+        """A copy of this example whose audio is trimmed by the given detector."""
+        trimmed = copy.copy(self)
+        # the copy must decode its own audio if this one did already:
+        trimmed.__dict__.pop("raw_audio", None)
+        trimmed.voice_activity_detector = voice_activity_detector
+        trimmed.removed_silence_frame_count = None
+        return trimmed
+
     @lazy
     def original_sample_rate(self) -> int:
+        if self.audio_metadata is not None:
+            return self.audio_metadata.sample_rate
+
+        import audioread
+
         with audioread.audio_open(os.path.realpath(str(self.audio_file))) as input_file:
             return input_file.samplerate
 
@@ -75,21 +124,35 @@ class LabeledExample:
         return abs(self._complex_spectrogram())
 
     def _complex_spectrogram(self) -> ndarray:
-        return librosa.stft(y=self.raw_audio, n_fft=self.fourier_window_length, hop_length=self.hop_length)
+        import librosa
+
+        raw_audio = self.raw_audio
+        with metrics.timed("stft"):
+            return librosa.stft(y=raw_audio, n_fft=self.fourier_window_length, hop_length=self.hop_length)
 
     def mel_frequencies(self) -> List[float]:
+        import librosa
+
         # according to librosa.filters.mel code
         return librosa.mel_frequencies(self.mel_frequency_count + 2, fmax=self.sample_rate / 2)
 
     def _convert_spectrogram_to_mel_scale(self, linear_frequency_spectrogram: ndarray) -> ndarray:
-        return dot(
-            librosa.filters.mel(sr=self.sample_rate, n_fft=self.fourier_window_length, n_mels=self.mel_frequency_count),
-            linear_frequency_spectrogram)
+        import librosa
+
+        with metrics.timed("mel_projection"):
+            return dot(
+                librosa.filters.mel(sr=self.sample_rate, n_fft=self.fourier_window_length,
+                                    n_mels=self.mel_frequency_count),
+                linear_frequency_spectrogram)
 
     def highest_detectable_frequency(self) -> float:
         return self.sample_rate / 2
 
     def duration_in_s(self) -> float:
+        # the metadata contain the duration before trimming:
+        if self.audio_metadata is not None and self.voice_activity_detector is None:
+            return self.audio_metadata.duration_in_s
+
         return self.raw_audio.shape[0] / self.sample_rate
 
     def spectrogram(self, type: SpectrogramType = SpectrogramType.power_level,
@@ -110,9 +173,10 @@ class LabeledExample:
 
     def z_normalized_transposed_spectrogram(self):
         """
-        :return: Array with shape (time, frequencies)
+        :return: Array with shape (time, frequencies) of the compute type of the dtype policy.
         """
-        return z_normalize(self.spectrogram(frequency_scale=SpectrogramFrequencyScale.mel).T)
+        return z_normalize(
+            self.dtype_policy.for_compute(self.spectrogram(frequency_scale=SpectrogramFrequencyScale.mel).T))
 
     def frequency_count_from_spectrogram(self, spectrogram: ndarray) -> int:
         return spectrogram.shape[0]
@@ -132,9 +196,12 @@ class LabeledExample:
             l = 10 * math.log10(x)
             return min_decibel if l < min_decibel else l
 
-        return vectorize(power_to_decibel)(spectrogram)
+        with metrics.timed("power_level"):
+            return vectorize(power_to_decibel)(spectrogram)
 
     def reconstructed_audio_from_spectrogram(self) -> ndarray:
+        import librosa
+
         return librosa.istft(self._complex_spectrogram(), win_length=self.fourier_window_length,
                              hop_length=self.hop_length)
 
@@ -1,12 +1,52 @@
+"""
+Plots of examples. Interactive plots use pyplot, while saved plots are rendered with the Agg backend onto
+explicit Figure objects that are closed after saving, so that saving many plots neither needs a display
+nor accumulates figures in pyplot's global state.
+
+render_spectrogram_gallery renders cached spectrograms of many examples across a process pool, e. g. for
+inspecting a whole corpus.
+"""
+import multiprocessing
 from pathlib import Path
 from textwrap import wrap
 
 import librosa
-import matplotlib.pyplot as plt
+import numpy
+from lazy import lazy
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 from matplotlib.ticker import ScalarFormatter, FuncFormatter
 from numpy import ndarray
+from typing import List, Optional, Tuple
 
 from labeled_example import LabeledExample, SpectrogramType, SpectrogramFrequencyScale
+from tools import mkdir
+
+
+class ScalarFormatterWithUnit(ScalarFormatter):
+    def __init__(self, unit: str):
+        super().__init__()
+        self.unit = unit
+
+    def __call__(self, x, pos=None) -> str:
+        return super().__call__(x, pos) + self.unit
+
+
+def _new_figure(size_in_inches: Tuple[float, float] = (19.20, 10.80), dpi: int = 100) -> Figure:
+    figure = Figure(figsize=size_in_inches, dpi=dpi)
+    FigureCanvasAgg(figure)
+    return figure
+
+
+def _save_and_close(figure: Figure, path: Path) -> Path:
+    try:
+        figure.savefig(str(path))
+    finally:
+        # releases the rendered image and artists right away instead of when garbage collected:
+        figure.clear()
+        figure.canvas = None
+
+    return path
 
 
 class LabeledExamplePlotter:
@@ -14,67 +54,90 @@ class LabeledExamplePlotter:
         self.example = example
 
     def _plot_audio(self, audio: ndarray) -> None:
+        import matplotlib.pyplot as plt
+
         plt.title(str(self))
         plt.xlabel("time / samples (sample rate {}Hz)".format(self.example.sample_rate))
         plt.ylabel("y")
         plt.plot(audio)
         plt.show()
 
+    @lazy
+    def _power_spectrogram(self) -> ndarray:
+        """Calculated once for all spectrogram types that are plotted."""
+        return self.example.spectrogram(SpectrogramType.power)
+
+    def _spectrogram(self, type: SpectrogramType, frequency_scale: SpectrogramFrequencyScale) -> ndarray:
+        if type == SpectrogramType.power:
+            s = self._power_spectrogram
+        elif type == SpectrogramType.amplitude:
+            s = numpy.sqrt(self._power_spectrogram)
+        elif type == SpectrogramType.power_level:
+            s = self.example._power_level_from_power_spectrogram(self._power_spectrogram)
+        else:
+            raise ValueError(type)
+
+        return self.example._convert_spectrogram_to_mel_scale(s) \
+            if frequency_scale == SpectrogramFrequencyScale.mel else s
+
     def show_spectrogram(self, type: SpectrogramType = SpectrogramType.power_level):
+        import matplotlib.pyplot as plt
+
         self.prepare_spectrogram_plot(type)
         plt.show()
 
     def save_spectrogram(self, target_directory: Path,
                          type: SpectrogramType = SpectrogramType.power_level,
                          frequency_scale: SpectrogramFrequencyScale = SpectrogramFrequencyScale.linear) -> Path:
-        self.prepare_spectrogram_plot(type, frequency_scale)
+        figure = _new_figure()
+        self._draw_spectrogram(figure, type, frequency_scale)
         path = Path(target_directory, "{}_{}{}_spectrogram.png".format(
             self.example.id,
             "mel_" if frequency_scale == SpectrogramFrequencyScale.mel else "", type.value.replace(" ", "_")))
 
-        plt.savefig(str(path))
-        return path
+        return _save_and_close(figure, path)
 
     def plot_raw_audio(self) -> None:
         self._plot_audio(self.example.raw_audio)
 
     def prepare_spectrogram_plot(self, type: SpectrogramType = SpectrogramType.power_level,
                                  frequency_scale: SpectrogramFrequencyScale = SpectrogramFrequencyScale.linear) -> None:
-        spectrogram = self.example.spectrogram(type, frequency_scale=frequency_scale)
+        """Draws onto a new pyplot figure, e. g. to be shown."""
+        import matplotlib.pyplot as plt
+
+        figure = plt.figure()
+        self._draw_spectrogram(figure, type, frequency_scale)
+        figure.set_size_inches(19.20, 10.80)
 
-        figure, axes = plt.subplots(1, 1)
+    def _draw_spectrogram(self, figure: Figure, type: SpectrogramType,
+                          frequency_scale: SpectrogramFrequencyScale) -> None:
+        spectrogram = self._spectrogram(type, frequency_scale=frequency_scale)
+
+        axes = figure.add_subplot(1, 1, 1)
         use_mel = frequency_scale == SpectrogramFrequencyScale.mel
 
-        plt.title("\n".join(wrap(
+        axes.set_title("\n".join(wrap(
             "{0}{1} spectrogram for {2}".format(("mel " if use_mel else ""), type.value, str(self)), width=100)))
-        plt.xlabel("time (data every {}ms)".format(round(1000 / self.example.time_step_rate())))
-        plt.ylabel("frequency (data evenly distributed on {} scale, {} total)".format(
+        axes.set_xlabel("time (data every {}ms)".format(round(1000 * self.example.hop_length /
+                                                              self.example.sample_rate)))
+        axes.set_ylabel("frequency (data evenly distributed on {} scale, {} total)".format(
             frequency_scale.value, self.example.frequency_count_from_spectrogram(spectrogram)))
         mel_frequencies = self.example.mel_frequencies()
-        plt.imshow(
+        image = axes.imshow(
             spectrogram, cmap='gist_heat', origin='lower', aspect='auto', extent=
             [0, self.example.duration_in_s(),
-             librosa.hz_to_mel(mel_frequencies[0])[0] if use_mel else 0,
-             librosa.hz_to_mel(mel_frequencies[-1])[0] if use_mel else self.example.highest_detectable_frequency()])
+             librosa.hz_to_mel(mel_frequencies[0]) if use_mel else 0,
+             librosa.hz_to_mel(mel_frequencies[-1]) if use_mel else self.example.highest_detectable_frequency()])
 
-        plt.colorbar(label="{} ({})".format(
+        figure.colorbar(image, ax=axes, label="{} ({})".format(
             type.value,
             "in{} dB, not aligned to a particular base level".format(" something similar to" if use_mel else "") if
             type == SpectrogramType.power_level else "only proportional to physical scale"))
 
-        class ScalarFormatterWithUnit(ScalarFormatter):
-            def __init__(self, unit: str):
-                super().__init__()
-                self.unit = unit
-
-            def __call__(self, x, pos=None) -> str:
-                return super().__call__(x, pos) + self.unit
-
         axes.xaxis.set_major_formatter(ScalarFormatterWithUnit("s"))
         axes.yaxis.set_major_formatter(
             FuncFormatter(lambda value, pos: "{}mel = {}Hz".format(int(value), int(
-                librosa.mel_to_hz(value)[0]))) if use_mel else ScalarFormatterWithUnit("Hz"))
-        figure.set_size_inches(19.20, 10.80)
+                librosa.mel_to_hz(value)))) if use_mel else ScalarFormatterWithUnit("Hz"))
 
     def plot_reconstructed_audio_from_spectrogram(self) -> None:
         self._plot_audio(self.example.reconstructed_audio_from_spectrogram())
@@ -91,3 +154,80 @@ class LabeledExamplePlotter:
             for frequency_scale in SpectrogramFrequencyScale:
                 self.save_spectrogram(target_directory=target_directory, type=type,
                                       frequency_scale=frequency_scale)
+
+
+def downsampled(spectrogram: ndarray, max_time_step_count: int) -> ndarray:
+    """Averages consecutive time steps of a spectrogram of shape (time, frequencies) to at most the given count."""
+    factor = -(-spectrogram.shape[0] // max_time_step_count)
+    if factor <= 1:
+        return spectrogram
+
+    starts = numpy.arange(0, spectrogram.shape[0], factor)
+    counts = numpy.diff(numpy.append(starts, spectrogram.shape[0]))
+    return numpy.add.reduceat(spectrogram, starts, axis=0) / counts[:, None]
+
+
+class SpectrogramRendering:
+    """What a worker of render_spectrogram_gallery needs to render one cached spectrogram, without the example."""
+
+    def __init__(self, id: str, label: Optional[str], spectrogram_cache_file: Path, seconds_per_time_step: float,
+                 target_file: Path, size_in_inches: Tuple[float, float], dpi: int,
+                 max_time_step_count: Optional[int]):
+        self.id = id
+        self.label = label
+        self.spectrogram_cache_file = spectrogram_cache_file
+        self.seconds_per_time_step = seconds_per_time_step
+        self.target_file = target_file
+        self.size_in_inches = size_in_inches
+        self.dpi = dpi
+        self.max_time_step_count = max_time_step_count
+
+    def render(self) -> Path:
+        spectrogram = numpy.load(str(self.spectrogram_cache_file)).astype(numpy.float32)
+        duration_in_s = spectrogram.shape[0] * self.seconds_per_time_step
+        if self.max_time_step_count is not None:
+            spectrogram = downsampled(spectrogram, self.max_time_step_count)
+
+        figure = _new_figure(self.size_in_inches, dpi=self.dpi)
+        axes = figure.add_subplot(1, 1, 1)
+        axes.set_title("\n".join(wrap("{}: {}".format(self.id, self.label or ""), width=100)))
+        axes.set_xlabel("time")
+        axes.set_ylabel("mel frequency band")
+        image = axes.imshow(spectrogram.T, cmap='gist_heat', origin='lower', aspect='auto',
+                            extent=[0, duration_in_s, 0, spectrogram.shape[1]])
+        figure.colorbar(image, ax=axes, label="z-normalized power level")
+        axes.xaxis.set_major_formatter(ScalarFormatterWithUnit("s"))
+
+        return _save_and_close(figure, self.target_file)
+
+
+def _render(rendering: SpectrogramRendering) -> Path:
+    return rendering.render()
+
+
+def render_spectrogram_gallery(labeled_spectrograms: List['CachedLabeledSpectrogram'], target_directory: Path,
+                               process_count: Optional[int] = None,
+                               size_in_inches: Tuple[float, float] = (19.20, 10.80), dpi: int = 100,
+                               max_time_step_count: Optional[int] = None) -> List[Path]:
+    """
+    Saves a plot of the cached spectrogram of each example as <id>.png, rendered by process_count processes
+    (by default one per CPU). Spectrograms not yet cached are calculated and cached first, in this process.
+    :param max_time_step_count: If given, longer spectrograms are averaged over time to this many time steps
+    for previews, e. g. together with a smaller size_in_inches.
+    """
+    mkdir(target_directory)
+    renderings = []
+    for labeled_spectrogram in labeled_spectrograms:
+        if not labeled_spectrogram.spectrogram_cache_file.exists():
+            labeled_spectrogram.spectrogram()
+
+        example = labeled_spectrogram.example
+        renderings.append(SpectrogramRendering(
+            id=labeled_spectrogram.id(), label=labeled_spectrogram.label(),
+            spectrogram_cache_file=labeled_spectrogram.spectrogram_cache_file,
+            seconds_per_time_step=example.hop_length / example.sample_rate,
+            target_file=target_directory / "{}.png".format(labeled_spectrogram.id()), size_in_inches=size_in_inches,
+            dpi=dpi, max_time_step_count=max_time_step_count))
+
+    with multiprocessing.get_context("spawn").Pool(process_count) as pool:
+        return pool.map(_render, renderings, chunksize=max(1, len(renderings) // (4 * (process_count or 4))))
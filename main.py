@@ -1,11 +1,19 @@
+"""
+Command line interface of speechless, e. g.
+
+    python3 main.py train
+    python3 main.py summarize
+
+Modules importing librosa, keras or matplotlib are only imported by the commands that need them,
+so that commands like summarize, which only read corpus metadata, start quickly.
+"""
+import argparse
+import sys
 from pathlib import Path
 from time import strftime
 
-from corpus_provider import CorpusProvider
-from german_corpus_provider import german_corpus_providers
-from labeled_example import LabeledExample
-from recording import Recorder
-from spectrogram_batch import LabeledSpectrogramBatchGenerator
+from typing import List
+
 from tools import mkdir, home_directory
 
 base_directory = home_directory() / "speechless-data"
@@ -18,13 +26,16 @@ german_corpus_directory = corpus_base_direcory / "German"
 spectrogram_cache_base_directory = base_directory / "spectrogram-cache"
 english_spectrogram_cache_directory = spectrogram_cache_base_directory / "English"
 german_spectrogram_cache_directory = spectrogram_cache_base_directory / "German"
+best_net_directory = nets_base_directory / "20170314-134351-adam-small-learning-rate-complete-95"
 
 
 def timestamp() -> str:
     return strftime("%Y%m%d-%H%M%S")
 
 
-def train_wav2letter(mel_frequency_count: int = 128, epoch_size: int = 100) -> None:
+def train_wav2letter(mel_frequency_count: int = 128, epoch_size: int = 100, augment: bool = False,
+                     epochs: int = 100000000) -> None:
+    from augmentation import Augmentation
     from net import Wav2Letter
 
     labeled_spectrogram_batch_generator = batch_generator(mel_frequency_count=mel_frequency_count)
@@ -34,28 +45,101 @@ def train_wav2letter(mel_frequency_count: int = 128, epoch_size: int = 100) -> N
 
     run_name = timestamp() + "-german-adam-small-learning-rate-complete-95"
 
-    wav2letter.train(labeled_spectrogram_batch_generator.as_training_batches(),
+    sampler = labeled_spectrogram_batch_generator.epoch_sampler()
+    wav2letter.train(lambda: labeled_spectrogram_batch_generator.as_training_batches(sampler),
                      tensor_board_log_directory=tensorboard_log_base_directory / run_name,
                      net_directory=nets_base_directory / run_name,
-                     test_labeled_spectrogram_batch=labeled_spectrogram_batch_generator.preview_batch(),
-                     samples_per_epoch=labeled_spectrogram_batch_generator.batch_size * epoch_size)
+                     test_labeled_spectrogram_batch=batch_generator(
+                         is_training=False, mel_frequency_count=mel_frequency_count).preview_batch(),
+                     samples_per_epoch=labeled_spectrogram_batch_generator.batch_size * epoch_size,
+                     sampler=sampler,
+                     augmentation=Augmentation() if augment else None,
+                     epochs=epochs)
+
+
+def train_wav2letter_data_parallel(process_count: int, mel_frequency_count: int = 128, epoch_size: int = 100,
+                                   augment: bool = False, epochs: int = 100000000) -> None:
+    """Trains one replica per process, each on its own shard of the training examples."""
+    from data_parallel import run_processes
+    from grapheme_enconding import AsgGraphemeEncoding
+    from net_architecture import trainable_parameter_count, wav2letter_convolutions
+
+    # fails here instead of in every replica if there are too few examples:
+    try:
+        batch_generator(mel_frequency_count=mel_frequency_count, world_size=process_count).epoch_sampler(
+            world_size=process_count)
+    except ValueError as e:
+        raise ValueError("Cannot train on {} processes: {}".format(process_count, e))
+
+    # the size of the net, without importing the backend in this process:
+    parameter_count = trainable_parameter_count(
+        wav2letter_convolutions(AsgGraphemeEncoding().grapheme_set_size), mel_frequency_count)
+    run_name = timestamp() + "-german-adam-small-learning-rate-complete-95-{}-replicas".format(process_count)
+    # one more for the loss, averaged together with the gradients:
+    exit_codes = run_processes(process_count, size=parameter_count + 1, target=_train_wav2letter_replica,
+                               arguments=(mel_frequency_count, epoch_size, run_name, augment, epochs))
+    if any(exit_codes):
+        raise RuntimeError("Replicas exited with codes {}.".format(exit_codes))
+
+
+def _train_wav2letter_replica(all_reduce: 'SharedMemoryAllReduce', mel_frequency_count: int, epoch_size: int,
+                              run_name: str, augment: bool, epochs: int) -> None:
+    import os
+
+    # Shares the cores between replicas; set before the backend is imported with net:
+    os.environ["OMP_NUM_THREADS"] = str(max(1, os.cpu_count() // all_reduce.world_size))
+
+    labeled_spectrogram_batch_generator = batch_generator(mel_frequency_count=mel_frequency_count,
+                                                          world_size=all_reduce.world_size)
+    sampler = labeled_spectrogram_batch_generator.epoch_sampler(rank=all_reduce.rank,
+                                                                world_size=all_reduce.world_size)
+
+    from augmentation import Augmentation
+    from net import Wav2Letter
+
+    wav2letter = Wav2Letter(input_size_per_time_step=mel_frequency_count, use_asg=True)
+    wav2letter.train_data_parallel(lambda: labeled_spectrogram_batch_generator.as_training_batches(sampler),
+                                   test_labeled_spectrogram_batch=batch_generator(
+                                       is_training=False, mel_frequency_count=mel_frequency_count).preview_batch(),
+                                   net_directory=nets_base_directory / run_name,
+                                   steps_per_epoch=epoch_size,
+                                   all_reduce=all_reduce,
+                                   sampler=sampler,
+                                   augmentation=Augmentation() if augment else None,
+                                   epochs=epochs)
+
+
+def training_corpus() -> 'CorpusProvider':
+    from corpus_provider import CorpusProvider
+
+    return CorpusProvider(english_corpus_directory, corpus_names=["dev-clean"])
 
 
-def batch_generator(is_training: bool = True, mel_frequency_count: int = 128) -> LabeledSpectrogramBatchGenerator:
+def batch_generator(is_training: bool = True, mel_frequency_count: int = 128,
+                    world_size: int = 1) -> 'LabeledSpectrogramBatchGenerator':
+    """
+    :param world_size: Number of data-parallel replicas, each of which gets a batch of its own training examples.
+    """
+    from cache_maintenance import CacheIndex
+    from spectrogram_batch import LabeledSpectrogramBatchGenerator
+
     # TODO use specified mel frequency count
-    corpus = CorpusProvider(english_corpus_directory, corpus_names=["dev-clean"])
+    corpus = training_corpus()
     # TODO fix this, sample randomly:
-    split_index = int(len(corpus.examples) * .95)
+    split_index = int(len(corpus.table) * .95)
 
     tiny_batch_size = 2
-    examples = corpus.examples[:split_index][:tiny_batch_size] if is_training else corpus.examples[split_index:]
+    examples = corpus.examples_at(range(split_index)[:tiny_batch_size * world_size] if is_training else
+                                  range(split_index, len(corpus.table)))
     return LabeledSpectrogramBatchGenerator(examples=examples,
                                             spectrogram_cache_directory=german_spectrogram_cache_directory,
-                                            batch_size=tiny_batch_size)
+                                            batch_size=tiny_batch_size,
+                                            cache_index=CacheIndex(german_spectrogram_cache_directory))
 
 
-def record() -> LabeledExample:
+def record() -> 'LabeledExample':
     from labeled_example_plotter import LabeledExamplePlotter
+    from recording import Recorder
 
     print("Wait in silence to begin recording; wait in silence to terminate")
     mkdir(recording_directory)
@@ -67,6 +151,8 @@ def record() -> LabeledExample:
 
 
 def predict_recording() -> None:
+    from labeled_example import LabeledExample
+
     wav2letter = load_best_wav2letter_model()
 
     def predict(sample: LabeledExample) -> str:
@@ -96,32 +182,160 @@ def predict_recording() -> None:
     print_example_predictions()
 
 
-def validate_best_model() -> None:
-    wav2_letter = load_best_wav2letter_model()
+def validate_best_model(net_directory: Path = best_net_directory) -> None:
+    wav2_letter = load_best_wav2letter_model(net_directory=net_directory)
 
     generator = batch_generator(is_training=False)
 
-    print(wav2_letter.loss(generator.as_validation_batches()))
+    print(wav2_letter.evaluate(generator.as_validation_batches(), print_batch_reports=True))
 
 
-def load_best_wav2letter_model(mel_frequency_count: int = 128):
+def load_best_wav2letter_model(mel_frequency_count: int = 128, net_directory: Path = best_net_directory):
+    from checkpoints import CheckpointIndex
     from net import Wav2Letter
 
+    best_epoch = CheckpointIndex(net_directory).best_epoch()
+
     return Wav2Letter(
         input_size_per_time_step=mel_frequency_count,
-        load_model_from_directory=Path(nets_base_directory / "20170314-134351-adam-small-learning-rate-complete-95"),
-        load_epoch=1689)
+        load_model_from_directory=net_directory,
+        # this run was trained before checkpoint indices were recorded:
+        load_epoch=best_epoch if best_epoch is not None else 1689)
+
+
+def evaluate_checkpoints(net_directory: Path, first_epoch: int = None, last_epoch: int = None,
+                         worker_count: int = 2) -> None:
+    from checkpoint_sweep import PreparedBatches, checkpoint_epochs, sweep, table
+
+    prepared_batches = PreparedBatches.prepare(batch_generator(is_training=False).as_validation_batches(),
+                                               directory=base_directory / "prepared-validation-batches")
+    evaluations = sweep(net_directory, prepared_batches,
+                        epochs=checkpoint_epochs(net_directory, first_epoch=first_epoch, last_epoch=last_epoch),
+                        worker_count=worker_count)
+    print(table(evaluations))
 
 
 def summarize_german_corpus() -> None:
     import csv
+    from corpus_preparation import ConcurrentCorpusPreparation
+    from german_corpus_provider import german_corpus_providers
+
+    preparation = ConcurrentCorpusPreparation()
     with (base_directory / "summary.csv").open('w', encoding='utf8') as csv_summary_file:
         writer = csv.writer(csv_summary_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
 
-        for corpus_provider in german_corpus_providers(german_corpus_directory):
+        for corpus_provider in german_corpus_providers(german_corpus_directory, preparation=preparation):
             print(corpus_provider.summary())
             writer.writerow(corpus_provider.csv_row())
 
-
-train_wav2letter(epoch_size=10)
-# summarize_german_corpus()
+    print("Corpus preparation time by stage: " + preparation.stage_duration_summary())
+
+
+def precompute_spectrograms(mel_frequency_count: int = 128) -> None:
+    """Fills the spectrogram cache for the training and validation examples."""
+    import time
+
+    for is_training in [True, False]:
+        generator = batch_generator(is_training=is_training, mel_frequency_count=mel_frequency_count)
+        start = time.perf_counter()
+        for labeled_spectrogram in generator.labeled_spectrograms:
+            labeled_spectrogram.spectrogram()
+        generator.cache_index.flush()
+
+        print("{} {} spectrograms cached in {:.1f}s.".format(len(generator.labeled_spectrograms),
+                                                           "training" if is_training else "validation",
+                                                           time.perf_counter() - start))
+
+
+def maintain_spectrogram_cache(disk_budget_in_gb: float = None, collect_garbage: bool = False) -> None:
+    """Removes entries of examples not in the training corpus and evicts entries exceeding the budget."""
+    from cache_maintenance import CacheMaintenance, corpus_ids_by_name
+
+    disk_budget_bytes = None if disk_budget_in_gb is None else int(disk_budget_in_gb * 1e9)
+    maintenance = CacheMaintenance(german_spectrogram_cache_directory, disk_budget_bytes=disk_budget_bytes)
+    corpora_by_name = corpus_ids_by_name([training_corpus()])
+
+    if collect_garbage:
+        print("Removed {} orphaned entries.".format(len(maintenance.collect_garbage(corpora_by_name))))
+    if disk_budget_in_gb is not None:
+        print("Evicted {} least recently used entries.".format(len(maintenance.evict_to_budget())))
+
+    print(maintenance.report(corpora_by_name))
+
+
+def render_spectrogram_gallery(preview: bool = False, process_count: int = None) -> None:
+    """Saves plots of the cached spectrograms of the training and validation examples for inspection."""
+    from labeled_example_plotter import render_spectrogram_gallery
+
+    for is_training in [True, False]:
+        generator = batch_generator(is_training=is_training)
+        target_directory = base_directory / "gallery" / ("training" if is_training else "validation")
+        paths = render_spectrogram_gallery(generator.labeled_spectrograms, target_directory,
+                                           process_count=process_count,
+                                           size_in_inches=(6.4, 3.6) if preview else (19.20, 10.80),
+                                           max_time_step_count=640 if preview else None)
+        print("Saved {} spectrogram plots to {}.".format(len(paths), target_directory))
+
+
+def main(arguments: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Trains and uses a speech recognizer based on wav2letter.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    train_parser = subparsers.add_parser("train", help="Trains a new net on the English corpus.")
+    train_parser.add_argument("--mel-frequency-count", type=int, default=128)
+    train_parser.add_argument("--epoch-size", type=int, default=10, help="Batches per epoch.")
+    train_parser.add_argument("--processes", type=int, default=1,
+                              help="Number of data-parallel replicas, each training in its own process.")
+    train_parser.add_argument("--augment", action="store_true", help="Applies SpecAugment masks to training batches.")
+    train_parser.add_argument("--epochs", type=int, default=100000000, help="Epochs until training stops.")
+
+    validate_parser = subparsers.add_parser("validate", help="Prints loss and error rates of the best model.")
+    validate_parser.add_argument("--net-directory", type=Path, default=best_net_directory)
+
+    subparsers.add_parser("predict", help="Prints predictions of the best model for the example recordings.")
+    subparsers.add_parser("summarize", help="Summarizes the German corpora into summary.csv.")
+
+    precompute_parser = subparsers.add_parser("precompute", help="Fills the spectrogram cache.")
+    precompute_parser.add_argument("--mel-frequency-count", type=int, default=128)
+
+    cache_parser = subparsers.add_parser("cache", help="Reports size and hit rates of the spectrogram cache "
+                                                       "by corpus and optionally shrinks it.")
+    cache_parser.add_argument("--budget-gb", type=float, default=None,
+                              help="Evicts least recently used entries until the cache fits.")
+    cache_parser.add_argument("--gc", action="store_true",
+                              help="Removes entries of examples that are in no corpus anymore.")
+
+    gallery_parser = subparsers.add_parser("gallery", help="Saves plots of the cached spectrograms.")
+    gallery_parser.add_argument("--preview", action="store_true", help="Renders small, downsampled plots.")
+    gallery_parser.add_argument("--processes", type=int, default=None, help="Number of rendering processes.")
+
+    args = parser.parse_args(arguments)
+
+    if args.command == "train":
+        if args.processes > 1:
+            train_wav2letter_data_parallel(args.processes, mel_frequency_count=args.mel_frequency_count,
+                                           epoch_size=args.epoch_size, augment=args.augment, epochs=args.epochs)
+        else:
+            train_wav2letter(mel_frequency_count=args.mel_frequency_count, epoch_size=args.epoch_size,
+                             augment=args.augment, epochs=args.epochs)
+    elif args.command == "validate":
+        validate_best_model(net_directory=args.net_directory)
+    elif args.command == "predict":
+        predict_recording()
+    elif args.command == "summarize":
+        summarize_german_corpus()
+    elif args.command == "precompute":
+        precompute_spectrograms(mel_frequency_count=args.mel_frequency_count)
+    elif args.command == "gallery":
+        render_spectrogram_gallery(preview=args.preview, process_count=args.processes)
+    elif args.command == "cache":
+        maintain_spectrogram_cache(disk_budget_in_gb=args.budget_gb, collect_garbage=args.gc)
+    else:
+        parser.print_help()
+        return 2
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
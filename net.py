@@ -1,8 +1,8 @@
 from functools import reduce
-from itertools import cycle
 from pathlib import Path
 
 import numpy
+import keras
 from keras import backend
 from keras.callbacks import Callback, TensorBoard
 from keras.engine import Input, Layer, Model
@@ -10,12 +10,24 @@ from keras.layers import Convolution1D, Lambda, Dropout
 from keras.models import Sequential
 from keras.optimizers import Optimizer, Adam
 from lazy import lazy
-from numpy import ndarray, zeros, array, mean, reshape
-from os import makedirs
-from typing import List, Callable, Iterable
-
+from numpy import ndarray, zeros, array, reshape
+from typing import List, Callable, Iterable, Optional, Tuple, Union
+
+from buffer_pool import BufferPool, BufferLease, InFlightLeases
+from all_reduce import SharedMemoryAllReduce
+from augmentation import Augmentation
+from checkpoints import CheckpointManager, WeightSnapshot, CheckpointIndex
+from data_parallel import GradientReplica, DataParallelTrainer
+from dtype_policy import DtypePolicy, default_dtype_policy
+from epoch_sampler import EpochSampler
+from evaluation import Evaluator, EvaluationReport
+from forced_alignment import CtcForcedAligner, Alignment
 from grapheme_enconding import CtcGraphemeEncoding, frequent_characters_in_english, AsgGraphemeEncoding
-from spectrogram_batch import LabeledSpectrogram
+from instrumentation import metrics
+from net_architecture import ConvolutionSpecification, wav2letter_convolutions, trainable_parameter_count
+from posterior_cache import PosteriorStore
+from spectrogram_batch import LabeledSpectrogram, input_batch_and_prediction_lengths
+from training_throughput import BatchStatistics, TrainingThroughput, ThroughputLog
 
 
 class Wav2Letter:
@@ -40,7 +52,19 @@ class Wav2Letter:
                  frozen_layer_count: int = 0,
                  use_asg: bool = False,
                  asg_transition_probabilities: ndarray = None,
-                 asg_initial_probabilities: ndarray = None):
+                 asg_initial_probabilities: ndarray = None,
+                 dtype_policy: DtypePolicy = default_dtype_policy,
+                 input_time_step_reduction: int = 1):
+        """
+        :param input_time_step_reduction: Spectrogram frames per input time step, e. g. when frames are stacked,
+        see LabeledSpectrogramBatchGenerator.time_step_reduction. Audio times are calculated with it.
+        """
+
+        if dtype_policy.compute_dtype != numpy.dtype(backend.floatx()):
+            raise ValueError("Compute type {} of the dtype policy differs from the Keras float type {}.".format(
+                dtype_policy.compute_dtype, backend.floatx()))
+        self.dtype_policy = dtype_policy
+        self.buffer_pool = BufferPool()
 
         self.grapheme_encoding = AsgGraphemeEncoding(allowed_characters=allowed_characters) \
             if use_asg else CtcGraphemeEncoding(allowed_characters=allowed_characters)
@@ -54,6 +78,7 @@ class Wav2Letter:
             if asg_initial_probabilities is None else asg_initial_probabilities
 
         self.use_asg = use_asg
+        self.input_time_step_reduction = input_time_step_reduction
         self.frozen_layer_count = frozen_layer_count
         self.output_activation = output_activation
         self.activation = activation
@@ -61,11 +86,16 @@ class Wav2Letter:
         self.input_size_per_time_step = input_size_per_time_step
         self.optimizer = optimizer
         self.load_epoch = load_epoch
+        # identifies the loaded weights, e. g. for caching predictions:
+        self.checkpoint_key = None
+        self.loaded_net_directory = None  # type: Optional[Path]
         self.dropout = dropout
+        self.convolutions = wav2letter_convolutions(grapheme_set_size, output_activation=output_activation,
+                                                    use_raw_wave_input=use_raw_wave_input)
         self.predictive_net = self.create_predictive_net()
         self.prediction_phase_flag = 0.
         if load_model_from_directory is not None:
-            self.predictive_net.load_weights(str(load_model_from_directory / self.model_file_name(load_epoch)))
+            self.load_weights(load_model_from_directory, load_epoch)
 
     @staticmethod
     def _default_asg_transition_probabilities(grapheme_set_size: int) -> ndarray:
@@ -93,48 +123,31 @@ class Wav2Letter:
          As described here: https://arxiv.org/pdf/1609.03193v2.pdf
         """
 
-        def convolution(name: str, filter_count: int, filter_length: int, striding: int = 1,
-                        activation: str = self.activation,
-                        input_dim: int = None,
-                        never_dropout: bool = False) -> List[Layer]:
-            return ([] if self.dropout is None or never_dropout else [
+        def convolution(specification: ConvolutionSpecification, input_dim: Optional[int]) -> List[Layer]:
+            return ([] if self.dropout is None or specification.never_dropout else [
                 Dropout(self.dropout, input_shape=(None, input_dim),
-                        name="dropout_before_{}".format(name))]) + [
-                       Convolution1D(nb_filter=filter_count, filter_length=filter_length, subsample_length=striding,
-                                     activation=activation, name=name, input_dim=input_dim, border_mode="same")]
-
-        main_filter_count = 250
-
-        def input_convolutions() -> List[Convolution1D]:
-            raw_wave_convolution_if_needed = convolution(
-                "wave_conv", filter_count=main_filter_count, filter_length=250, striding=160,
-                input_dim=self.input_size_per_time_step) if self.use_raw_wave_input else []
-
-            return raw_wave_convolution_if_needed + convolution(
-                "striding_conv", filter_count=main_filter_count, filter_length=48, striding=2,
-                input_dim=None if self.use_raw_wave_input else self.input_size_per_time_step)
-
-        def inner_convolutions() -> List[Convolution1D]:
-            return [layer for i in
-                    range(1, 8) for layer in
-                    convolution("inner_conv_{}".format(i), filter_count=main_filter_count, filter_length=7)]
-
-        def output_convolutions() -> List[Convolution1D]:
-            out_filter_count = 2000
-            return [layer for conv in [
-                convolution("big_conv_1", filter_count=out_filter_count, filter_length=32, never_dropout=True),
-                convolution("big_conv_2", filter_count=out_filter_count, filter_length=1, never_dropout=True),
-                convolution("output_conv", filter_count=self.grapheme_encoding.grapheme_set_size, filter_length=1,
-                            activation=self.output_activation, never_dropout=True)
-            ] for layer in conv]
+                        name="dropout_before_{}".format(specification.name))]) + [
+                       Convolution1D(nb_filter=specification.filter_count, filter_length=specification.filter_length,
+                                     subsample_length=specification.striding,
+                                     activation=specification.activation or self.activation,
+                                     name=specification.name, input_dim=input_dim, border_mode="same")]
 
-        layers = input_convolutions() + inner_convolutions() + output_convolutions()
+        # only the first layer is given its input size, the others infer it:
+        layers = [layer for index, specification in enumerate(self.convolutions) for layer in
+                  convolution(specification, input_dim=self.input_size_per_time_step if index == 0 else None)]
 
         for layer in layers[:self.frozen_layer_count]:
             layer.trainable = False
 
         return Sequential(layers)
 
+    @property
+    def trainable_parameter_count(self) -> int:
+        """Count of the weights the loss net trains, derived from the layer shapes without building it."""
+        return trainable_parameter_count(self.convolutions, self.input_size_per_time_step,
+                                         use_dropout=self.dropout is not None,
+                                         frozen_layer_count=self.frozen_layer_count)
+
     @lazy
     def input_to_prediction_length_ratio(self):
         """Returns which factor shorter the output is compared to the input caused by striding."""
@@ -202,34 +215,141 @@ class Wav2Letter:
     def predict_single(self, spectrogram: ndarray) -> str:
         return self.predict([spectrogram])[0]
 
-    def loss(self, labeled_spectrogram_batches: Iterable[List[LabeledSpectrogram]]):
-        batches = list(labeled_spectrogram_batches)
-        sample_count = len([spectrogram for batch in batches for spectrogram in batch])
-        self.loss_net.evaluate_generator(self._generator(cycle(batches), print_batch_loss=True),
-                                         val_samples=sample_count)
+    def evaluate(self, labeled_spectrogram_batches: Iterable[List[LabeledSpectrogram]],
+                 print_batch_reports: bool = False,
+                 posterior_store: Optional[PosteriorStore] = None) -> EvaluationReport:
+        """
+        Runs the predictive net once per batch and derives loss, transcriptions and error rates from the result.
+        :param posterior_store: If given, predictions of these weights are read from it if available
+        and added to it otherwise.
+        """
+        evaluator = Evaluator(self.grapheme_encoding)
+        example_evaluations = []
+        for index, labeled_spectrogram_batch in enumerate(labeled_spectrogram_batches):
+            prediction_batch, prediction_lengths = self._prediction_batch_and_lengths(
+                labeled_spectrogram_batch, posterior_store=posterior_store)
+            batch_evaluations = evaluator.evaluate_batch(prediction_batch,
+                                                         prediction_lengths=prediction_lengths,
+                                                         labels=[x.label() for x in labeled_spectrogram_batch])
+            example_evaluations += batch_evaluations
+            if print_batch_reports:
+                print("Batch {}: {}; so far {}".format(index, EvaluationReport(batch_evaluations),
+                                                        EvaluationReport(example_evaluations)))
+
+        if posterior_store is not None:
+            posterior_store.save()
+
+        return EvaluationReport(example_evaluations)
+
+    def align(self, labeled_spectrogram_batches: Iterable[List[LabeledSpectrogram]], hop_length: int = 128,
+              sample_rate: int = 16000, posterior_store: Optional[PosteriorStore] = None) -> List[Alignment]:
+        """
+        Aligns the label of each example to the predictions, yielding character and word times.
+        :param hop_length: Of the spectrograms, in samples of the given sample rate.
+        """
+        if self.use_asg:
+            raise ValueError("Forced alignment is only implemented for nets trained with CTC loss.")
+
+        aligner = CtcForcedAligner(self.grapheme_encoding,
+                                   input_to_prediction_length_ratio=self.input_to_prediction_length_ratio *
+                                                                    self.input_time_step_reduction,
+                                   hop_length=hop_length, sample_rate=sample_rate)
+        alignments = []
+        for labeled_spectrogram_batch in labeled_spectrogram_batches:
+            prediction_batch, prediction_lengths = self._prediction_batch_and_lengths(
+                labeled_spectrogram_batch, posterior_store=posterior_store)
+            alignments += aligner.align_batch(prediction_batch, prediction_lengths,
+                                              labels=[x.label() for x in labeled_spectrogram_batch])
+
+        return alignments
+
+    def cache_posteriors(self, labeled_spectrogram_batches: Iterable[List[LabeledSpectrogram]],
+                         posterior_store: PosteriorStore) -> None:
+        """Saves the predictions for all examples not yet in the store, for decoding without the network later."""
+        for labeled_spectrogram_batch in labeled_spectrogram_batches:
+            missing = [x for x in labeled_spectrogram_batch if x.id() not in posterior_store]
+            if missing:
+                self._prediction_batch_and_lengths(missing, posterior_store=posterior_store)
+
+        posterior_store.save()
+
+    def _prediction_batch_and_lengths(self, labeled_spectrogram_batch: List[LabeledSpectrogram],
+                                      posterior_store: Optional[PosteriorStore] = None) -> Tuple[ndarray, List[int]]:
+        ids = [x.id() for x in labeled_spectrogram_batch]
+        if posterior_store is not None and all(id in posterior_store for id in ids):
+            return posterior_store.prediction_batch(ids)
+
+        # the input is not needed anymore once Keras returned the predictions:
+        with self.buffer_pool.lease() as buffer_lease:
+            input_batch, prediction_lengths = self._input_batch_and_prediction_lengths(
+                [x.spectrogram() for x in labeled_spectrogram_batch], buffer_lease=buffer_lease)
+            prediction_batch = self.prediction_batch(input_batch)
+        if posterior_store is not None:
+            posterior_store.add_batch(ids, prediction_batch, prediction_lengths=prediction_lengths)
+
+        return prediction_batch, prediction_lengths
+
+    def loss(self, labeled_spectrogram_batches: Iterable[List[LabeledSpectrogram]]) -> float:
+        return self.evaluate(labeled_spectrogram_batches).loss
 
     def _generator(self, labeled_spectrogram_batches: Iterable[List[LabeledSpectrogram]],
-                   print_batch_loss: bool = False):
-        losses = []
-        for index, labeled_spectrogram_batch in enumerate(labeled_spectrogram_batches):
+                   throughput: Optional[TrainingThroughput] = None,
+                   in_flight_leases: Optional[InFlightLeases] = None,
+                   augmentation: Optional[Augmentation] = None):
+        """
+        :param in_flight_leases: If given, batches are written into pooled buffers, whose leases are handed over
+        to it and must be released after the training step with the batch ended.
+        :param augmentation: Applied here, i. e. in the thread Keras prepares batches in, not in the training step.
+        """
+        for labeled_spectrogram_batch in labeled_spectrogram_batches:
             batch_size = len(labeled_spectrogram_batch)
             dummy_labels_for_dummy_loss_function = zeros((batch_size,))
-            training_input_dictionary = self._training_input_dictionary(
-                labeled_spectrogram_batch=labeled_spectrogram_batch)
-            yield (training_input_dictionary, dummy_labels_for_dummy_loss_function)
-
-            if print_batch_loss:
-                loss = self.loss_net.evaluate(training_input_dictionary, dummy_labels_for_dummy_loss_function,
-                                              batch_size=batch_size)
-                losses.append(loss)
-                print("Batch {} has loss {}, so far {} on average".format(index, loss, mean(losses)))
+            buffer_lease = self.buffer_pool.lease() if in_flight_leases is not None else None
+            try:
+                with metrics.timed("batch_preparation"):
+                    training_input_dictionary = self._training_input_dictionary(
+                        labeled_spectrogram_batch=labeled_spectrogram_batch, throughput=throughput,
+                        buffer_lease=buffer_lease, augmentation=augmentation)
+            except BaseException:
+                # not yet handed over, so no training step would release it:
+                if buffer_lease is not None:
+                    buffer_lease.release()
+                raise
+            if in_flight_leases is not None:
+                in_flight_leases.hand_over(buffer_lease)
+            metrics.count("batches")
+            metrics.count("examples", batch_size)
+
+            # time until Keras asks for the next batch, mostly spent in the training step:
+            with metrics.timed("keras_step"):
+                yield (training_input_dictionary, dummy_labels_for_dummy_loss_function)
 
     def train(self,
-              labeled_spectrogram_batches: Iterable[List[LabeledSpectrogram]],
+              labeled_spectrogram_batches: Union[Iterable[List[LabeledSpectrogram]],
+                                                 Callable[[], Iterable[List[LabeledSpectrogram]]]],
               test_labeled_spectrogram_batch: Iterable[LabeledSpectrogram],
               tensor_board_log_directory: Path,
               net_directory: Path,
-              samples_per_epoch: int):
+              samples_per_epoch: int,
+              seconds_per_frame: float = 128 / 16000,
+              keep_last_checkpoints: int = 3,
+              sampler: Optional[EpochSampler] = None,
+              augmentation: Optional[Augmentation] = None,
+              epochs: int = 100000000):
+        """
+        :param labeled_spectrogram_batches: The training batches, or, if a sampler is given, a function creating them
+        from it, e. g. lambda: generator.as_training_batches(sampler), see _training_batches.
+        :param seconds_per_frame: Audio duration per spectrogram frame, i. e. hop length divided by sample rate,
+        used to report the audio seconds trained per second.
+        :param test_labeled_spectrogram_batch: Held-out examples that are not trained on, whose predictions are
+        printed and whose loss is recorded as validation loss with each checkpoint.
+        :param keep_last_checkpoints: Number of most recent checkpoints kept in addition to the one with the lowest
+        validation loss.
+        :param sampler: Sampler the training batches are drawn from. Its position is saved with each
+        checkpoint and, if weights were loaded from a checkpoint recording one, restored before the batches
+        are created.
+        :param augmentation: Applied to the training batches, not to the test batch.
+        """
         def print_expectations_vs_prediction():
             print("\n\n".join(
                 'Expected:  "{}"\nPredicted: "{}"'.format(expected, predicted) for expected, predicted
@@ -238,59 +358,260 @@ class Wav2Letter:
 
         print_expectations_vs_prediction()
 
-        self.loss_net.fit_generator(self._generator(labeled_spectrogram_batches), nb_epoch=100000000,
+        training_batches = self._training_batches(labeled_spectrogram_batches, sampler=sampler)
+
+        throughput = TrainingThroughput(seconds_per_frame=seconds_per_frame * self.input_time_step_reduction)
+        in_flight_leases = InFlightLeases()
+        self.loss_net.fit_generator(self._generator(training_batches, throughput=throughput,
+                                                    in_flight_leases=in_flight_leases, augmentation=augmentation),
+                                    nb_epoch=epochs,
                                     samples_per_epoch=samples_per_epoch,
                                     callbacks=self.create_callbacks(
                                         callback=print_expectations_vs_prediction,
                                         tensor_board_log_directory=tensor_board_log_directory,
-                                        net_directory=net_directory),
+                                        net_directory=net_directory,
+                                        throughput=throughput,
+                                        in_flight_leases=in_flight_leases,
+                                        sampler=sampler,
+                                        validation_loss=lambda: self.batch_loss(test_labeled_spectrogram_batch),
+                                        keep_last_checkpoints=keep_last_checkpoints),
                                     initial_epoch=self.load_epoch if (self.load_epoch is not None) else 0)
 
+    def _training_batches(self, labeled_spectrogram_batches: Union[Iterable[List[LabeledSpectrogram]],
+                                                                   Callable[[], Iterable[List[LabeledSpectrogram]]]],
+                          sampler: Optional[EpochSampler]) -> Iterable[List[LabeledSpectrogram]]:
+        """
+        With a sampler, batches have to be created by a function, which is only called after the position of the
+        sampler was restored, so that batches created eagerly from it cannot start at the beginning instead.
+        """
+        if sampler is None:
+            return labeled_spectrogram_batches() if callable(labeled_spectrogram_batches) \
+                else labeled_spectrogram_batches
+
+        if not callable(labeled_spectrogram_batches):
+            raise ValueError("Expected a function creating the training batches from the sampler, "
+                             "to be called after restoring its position.")
+
+        self._restore_sampler(sampler)
+        return labeled_spectrogram_batches()
+
+    def _restore_sampler(self, sampler: EpochSampler) -> None:
+        if self.loaded_net_directory is not None:
+            loaded_checkpoint = CheckpointIndex(self.loaded_net_directory).checkpoint(self.load_epoch)
+            if loaded_checkpoint is not None and loaded_checkpoint.sampler_state is not None:
+                sampler.load_state_dict(loaded_checkpoint.sampler_state)
+
+    def train_data_parallel(self,
+                            labeled_spectrogram_batches: Union[Iterable[List[LabeledSpectrogram]],
+                                                               Callable[[], Iterable[List[LabeledSpectrogram]]]],
+                            test_labeled_spectrogram_batch: List[LabeledSpectrogram],
+                            net_directory: Path,
+                            steps_per_epoch: int,
+                            all_reduce: SharedMemoryAllReduce,
+                            sampler: Optional[EpochSampler] = None,
+                            keep_last_checkpoints: int = 3,
+                            epochs: int = 100000000,
+                            augmentation: Optional[Augmentation] = None):
+        """
+        Trains this replica in one of several processes, see data_parallel.run_processes.
+        Weights are taken from rank 0 at the start, and only rank 0 writes checkpoints.
+        :param labeled_spectrogram_batches: Batches of the shard of this rank, or, if a sampler is given, a function
+        creating them from it, see train. The sampler has the rank and world size of all_reduce.
+        :param test_labeled_spectrogram_batch: Held-out examples whose loss is recorded as validation loss.
+        :param augmentation: Seeded for the rank of this replica.
+        """
+        # one more for the loss, averaged together with the gradients:
+        if all_reduce.size != self.trainable_parameter_count + 1:
+            raise ValueError("All-reduce size {} does not fit {} trainable parameters and the loss.".format(
+                all_reduce.size, self.trainable_parameter_count))
+
+        training_batches = self._training_batches(labeled_spectrogram_batches, sampler=sampler)
+        is_chief = all_reduce.rank == 0
+        checkpoints = CheckpointManager(net_directory, file_name=self.model_file_name,
+                                        keep_last=keep_last_checkpoints) if is_chief else None
+
+        def on_batch_end(loss: float) -> None:
+            if sampler is not None:
+                sampler.batch_trained()
+
+        def on_epoch_end(epoch: int, losses: List[float]) -> None:
+            if not is_chief:
+                return
+
+            print("Epoch {}: loss {:.4f}".format(epoch, float(numpy.mean(losses))))
+            if epoch > 0:
+                checkpoints.save(epoch, self.weight_snapshot(),
+                                 validation_loss=self.batch_loss(test_labeled_spectrogram_batch),
+                                 sampler_state=sampler.state_dict() if sampler is not None else None)
+
+        try:
+            replica = KerasGradientReplica(
+                self, augmentation=augmentation.for_worker(all_reduce.rank) if augmentation is not None else None)
+            DataParallelTrainer(replica, all_reduce).train(
+                training_batches, steps_per_epoch=steps_per_epoch, epochs=epochs,
+                initial_epoch=self.load_epoch if (self.load_epoch is not None) else 0,
+                on_batch_end=on_batch_end, on_epoch_end=on_epoch_end)
+        finally:
+            if checkpoints is not None:
+                checkpoints.close()
+
+    def load_weights(self, net_directory: Path, epoch: int) -> None:
+        self.predictive_net.load_weights(str(net_directory / self.model_file_name(epoch)))
+        self.load_epoch = epoch
+        self.loaded_net_directory = net_directory
+        self.checkpoint_key = "{}/{}".format(net_directory.name, Path(self.model_file_name(epoch)).stem)
+
     @staticmethod
     def model_file_name(epoch: int) -> str:
         return "weights-epoch{}.h5".format(epoch)
 
     def create_callbacks(self, callback: Callable[[], None], tensor_board_log_directory: Path, net_directory: Path,
-                         callback_step: int = 1, save_step: int = 1) -> List[Callback]:
+                         callback_step: int = 1, save_step: int = 1,
+                         throughput: Optional[TrainingThroughput] = None,
+                         in_flight_leases: Optional[InFlightLeases] = None,
+                         sampler: Optional[EpochSampler] = None,
+                         validation_loss: Optional[Callable[[], float]] = None,
+                         keep_last_checkpoints: int = 3) -> List[Callback]:
+        checkpoints = CheckpointManager(net_directory, file_name=self.model_file_name,
+                                        keep_last=keep_last_checkpoints)
+
         class CustomCallback(Callback):
+            def on_batch_end(self_callback, batch, logs=None):
+                if sampler is not None:
+                    sampler.batch_trained()
+
             def on_epoch_end(self_callback, epoch, logs=()):
                 if epoch % callback_step == 0:
                     callback()
 
                 if epoch % save_step == 0 and epoch > 0:
-                    # not Path.mkdir() for compatibility with Python 3.4
-                    makedirs(str(net_directory), exist_ok=True)
-
-                    self.predictive_net.save_weights(str(net_directory / self.model_file_name(epoch)))
+                    # the snapshot is taken synchronously, writing it happens in the background:
+                    checkpoints.save(epoch, self.weight_snapshot(),
+                                     validation_loss=validation_loss() if validation_loss is not None else None,
+                                     sampler_state=sampler.state_dict() if sampler is not None else None)
+
+            def on_train_end(self_callback, logs=None):
+                checkpoints.close()
+
+        class ThroughputCallback(Callback):
+            def __init__(self_callback):
+                super().__init__()
+                self_callback.log = ThroughputLog(tensor_board_log_directory,
+                                                  use_tensorflow=backend.backend() == 'tensorflow')
+                self_callback.step = 0
+
+            def on_batch_begin(self_callback, batch, logs=None):
+                throughput.batch_begin()
+
+            def on_batch_end(self_callback, batch, logs=None):
+                scalars = throughput.batch_end()
+                if scalars is not None:
+                    self_callback.log.write("batch", scalars, step=self_callback.step)
+                self_callback.step += 1
+
+            def on_epoch_end(self_callback, epoch, logs=None):
+                scalars = throughput.epoch_end()
+                if scalars is not None:
+                    self_callback.log.write("epoch", scalars, step=epoch)
+
+        class BufferReleaseCallback(Callback):
+            def on_batch_end(self_callback, batch, logs=None):
+                in_flight_leases.step_finished()
+
+            def on_train_end(self_callback, logs=None):
+                in_flight_leases.release_all()
 
         tensorboard_if_running_tensorboard = [TensorBoard(log_dir=str(tensor_board_log_directory),
                                                           write_images=True)] if backend.backend() == 'tensorflow' else []
-        return tensorboard_if_running_tensorboard + [CustomCallback()]
-
-    def _input_batch_and_prediction_lengths(self, spectrograms: List[ndarray]):
-        batch_size = len(spectrograms)
-        input_size_per_time_step = spectrograms[0].shape[1]
-        input_lengths = [spectrogram.shape[0] for spectrogram in spectrograms]
-        prediction_lengths = [s // self.input_to_prediction_length_ratio for s in input_lengths]
-        input_batch = zeros((batch_size, max(input_lengths), input_size_per_time_step))
-        for index, spectrogram in enumerate(spectrograms):
-            input_batch[index, :spectrogram.shape[0], :spectrogram.shape[1]] = spectrogram
-
-        return input_batch, prediction_lengths
-
-    def _training_input_dictionary(self, labeled_spectrogram_batch: List[LabeledSpectrogram]) -> dict:
-        spectrograms = [x.spectrogram() for x in labeled_spectrogram_batch]
+        throughput_if_given = [ThroughputCallback()] if throughput is not None else []
+        buffer_release_if_given = [BufferReleaseCallback()] if in_flight_leases is not None else []
+        return tensorboard_if_running_tensorboard + throughput_if_given + buffer_release_if_given + [CustomCallback()]
+
+    def weight_snapshot(self) -> WeightSnapshot:
+        layers = self.predictive_net.layers
+        weights_by_layer = [layer.trainable_weights + layer.non_trainable_weights for layer in layers]
+        values = iter(backend.batch_get_value([weight for weights in weights_by_layer for weight in weights]))
+
+        return WeightSnapshot([(layer.name, [(str(weight.name) if getattr(weight, "name", None) else
+                                              "param_{}".format(index), next(values))
+                                             for index, weight in enumerate(weights)])
+                               for layer, weights in zip(layers, weights_by_layer)],
+                              keras_version=keras.__version__, backend=backend.backend())
+
+    def batch_loss(self, labeled_spectrogram_batch: List[LabeledSpectrogram]) -> float:
+        batch_size = len(labeled_spectrogram_batch)
+        return self.loss_net.evaluate(
+            self._training_input_dictionary(labeled_spectrogram_batch, training_phase=False),
+            zeros((batch_size,)), batch_size=batch_size, verbose=0)
+
+    def _input_batch_and_prediction_lengths(self, spectrograms: List[ndarray],
+                                            buffer_lease: Optional[BufferLease] = None):
+        return input_batch_and_prediction_lengths(spectrograms,
+                                                  input_to_prediction_length_ratio=self.input_to_prediction_length_ratio,
+                                                  dtype=self.dtype_policy.compute_dtype, buffer_lease=buffer_lease)
+
+    def _training_input_dictionary(self, labeled_spectrogram_batch: List[LabeledSpectrogram],
+                                   throughput: Optional[TrainingThroughput] = None,
+                                   training_phase: bool = True,
+                                   buffer_lease: Optional[BufferLease] = None,
+                                   augmentation: Optional[Augmentation] = None) -> dict:
+        spectrograms = augmentation.spectrograms(labeled_spectrogram_batch) if augmentation is not None else [
+            x.spectrogram() for x in labeled_spectrogram_batch]
         labels = [x.label() for x in labeled_spectrogram_batch]
-        input_batch, prediction_lengths = self._input_batch_and_prediction_lengths(spectrograms)
+        input_batch, prediction_lengths = self._input_batch_and_prediction_lengths(spectrograms,
+                                                                                   buffer_lease=buffer_lease)
+        if augmentation is not None:
+            augmentation.mask_batch(input_batch, input_lengths=[spectrogram.shape[0] for spectrogram in spectrograms])
+        if throughput is not None:
+            throughput.batch_prepared(BatchStatistics.from_spectrograms(spectrograms))
+        with metrics.timed("label_encoding"):
+            label_batch = self.grapheme_encoding.encode_label_batch(labels, buffer_lease=buffer_lease)
 
         # Sets learning phase to training to enable dropout (see backend.learning_phase documentation for more info):
-        training_phase_flag_tensor = array([True])
+        training_phase_flag_tensor = array([training_phase])
         return {
             Wav2Letter.InputNames.input_batch: input_batch,
             Wav2Letter.InputNames.prediction_lengths: reshape(array(prediction_lengths),
                                                               (len(labeled_spectrogram_batch), 1)),
-            Wav2Letter.InputNames.label_batch: self.grapheme_encoding.encode_label_batch(labels),
+            Wav2Letter.InputNames.label_batch: label_batch,
             Wav2Letter.InputNames.label_lengths: reshape(array([len(label) for label in labels]),
                                                          (len(labeled_spectrogram_batch), 1)),
             'keras_learning_phase': training_phase_flag_tensor
         }
+
+
+class KerasGradientReplica(GradientReplica):
+    """Computes gradients of the loss net of a Wav2Letter and applies given gradients with its optimizer."""
+
+    def __init__(self, wav2letter: Wav2Letter, augmentation: Optional[Augmentation] = None):
+        self.wav2letter = wav2letter
+        self.augmentation = augmentation
+        loss_net = wav2letter.loss_net
+        self.weights = loss_net.trainable_weights
+        loss = backend.mean(loss_net.outputs[0])
+        self._loss_and_gradients = backend.function(loss_net.inputs + [backend.learning_phase()],
+                                                    [loss] + backend.gradients(loss, self.weights))
+
+        self.gradient_placeholders = [backend.placeholder(shape=backend.int_shape(weight)) for weight in self.weights]
+        optimizer = loss_net.optimizer
+        # makes the optimizer update with the averaged gradients fed in instead of computing its own:
+        optimizer.get_gradients = lambda loss, params: self.gradient_placeholders
+        self._apply_gradients = backend.function(
+            self.gradient_placeholders, [],
+            updates=optimizer.get_updates(self.weights, loss_net.constraints, loss))
+
+    def get_weights(self) -> List[ndarray]:
+        return backend.batch_get_value(self.weights)
+
+    def set_weights(self, weights: List[ndarray]) -> None:
+        backend.batch_set_value(list(zip(self.weights, weights)))
+
+    def loss_and_gradients(self, labeled_spectrogram_batch: List[LabeledSpectrogram]) -> Tuple[float, List[ndarray]]:
+        input_dictionary = self.wav2letter._training_input_dictionary(labeled_spectrogram_batch,
+                                                                      augmentation=self.augmentation)
+        values = self._loss_and_gradients([input_dictionary[name] for name in self.wav2letter.loss_net.input_names] +
+                                          [1.])
+        return float(values[0]), values[1:]
+
+    def apply_gradients(self, gradients: List[ndarray]) -> None:
+        self._apply_gradients(gradients)
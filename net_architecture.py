@@ -0,0 +1,66 @@
+"""
+Layers of the wav2letter network (https://arxiv.org/pdf/1609.03193v2.pdf), described without Keras,
+so that e. g. the parameter count is known to processes that do not import the backend.
+"""
+from typing import List, Optional
+
+
+class ConvolutionSpecification:
+    """
+    A 1D convolution with border mode "same".
+    :param activation: None for the activation of the net.
+    :param never_dropout: Whether no dropout layer precedes this one even if the net uses dropout.
+    """
+
+    def __init__(self, name: str, filter_count: int, filter_length: int, striding: int = 1,
+                 activation: Optional[str] = None, never_dropout: bool = False):
+        self.name = name
+        self.filter_count = filter_count
+        self.filter_length = filter_length
+        self.striding = striding
+        self.activation = activation
+        self.never_dropout = never_dropout
+
+    def parameter_count(self, input_size: int) -> int:
+        """Kernel and bias weights given input_size channels per time step."""
+        return self.filter_length * input_size * self.filter_count + self.filter_count
+
+
+def wav2letter_convolutions(grapheme_set_size: int, output_activation: str = "softmax",
+                            use_raw_wave_input: bool = False) -> List[ConvolutionSpecification]:
+    main_filter_count = 250
+    out_filter_count = 2000
+
+    raw_wave_convolution_if_needed = [ConvolutionSpecification(
+        "wave_conv", filter_count=main_filter_count, filter_length=250, striding=160)] if use_raw_wave_input else []
+
+    return raw_wave_convolution_if_needed + [
+        ConvolutionSpecification("striding_conv", filter_count=main_filter_count, filter_length=48, striding=2)] + [
+        ConvolutionSpecification("inner_conv_{}".format(i), filter_count=main_filter_count, filter_length=7)
+        for i in range(1, 8)] + [
+        ConvolutionSpecification("big_conv_1", filter_count=out_filter_count, filter_length=32, never_dropout=True),
+        ConvolutionSpecification("big_conv_2", filter_count=out_filter_count, filter_length=1, never_dropout=True),
+        ConvolutionSpecification("output_conv", filter_count=grapheme_set_size, filter_length=1,
+                                 activation=output_activation, never_dropout=True)]
+
+
+def trainable_parameter_count(convolutions: List[ConvolutionSpecification], input_size_per_time_step: int,
+                              use_dropout: bool = False, frozen_layer_count: int = 0) -> int:
+    """
+    Count of the weights that are trained, i. e. not in the first frozen_layer_count layers,
+    which include the dropout layers before convolutions if use_dropout.
+    """
+    count = 0
+    layer_index = 0
+    input_size = input_size_per_time_step
+    for convolution in convolutions:
+        if use_dropout and not convolution.never_dropout:
+            layer_index += 1
+
+        if layer_index >= frozen_layer_count:
+            count += convolution.parameter_count(input_size)
+
+        layer_index += 1
+        input_size = convolution.filter_count
+
+    return count
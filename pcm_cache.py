@@ -0,0 +1,175 @@
+from pathlib import Path
+
+import numpy
+from numpy import ndarray
+from typing import Dict, Tuple, List, Iterable
+
+from cache_files import load_or_compute_once, save_array_atomically
+from instrumentation import metrics
+from tools import mkdir
+
+_int16_scale = 32767
+
+
+def _greatest_common_divisor(a: int, b: int) -> int:
+    """
+    Not math.gcd for compatibility with Python 3.4.
+    """
+    while b:
+        a, b = b, a % b
+    return a
+
+
+def decode_audio(audio_file: Path) -> Tuple[ndarray, int]:
+    """Decodes an audio file to mono float32 at its original sample rate, without resampling."""
+    import soundfile
+
+    with metrics.timed("audio_decode"):
+        return _decode_audio(audio_file, soundfile)
+
+
+def _decode_audio(audio_file: Path, soundfile) -> Tuple[ndarray, int]:
+    try:
+        audio, sample_rate = soundfile.read(str(audio_file), dtype='float32', always_2d=True)
+        return audio.mean(axis=1), sample_rate
+    except RuntimeError:
+        # formats not supported by libsndfile:
+        import librosa
+        audio, sample_rate = librosa.load(str(audio_file), sr=None, mono=True)
+        return audio.astype('float32'), sample_rate
+
+
+class PolyphaseResampler:
+    """
+    Resamples with polyphase filtering. The anti-aliasing filter for each pair of source and target sample rate
+    is designed once and reused, which is most of the cost of scipy.signal.resample_poly for ratios like 160/441.
+    Results equal those of resample_poly with its default Kaiser window.
+    """
+
+    def __init__(self, kaiser_beta: float = 5.):
+        self.kaiser_beta = kaiser_beta
+        self._filters_by_ratio = dict()  # type: Dict[Tuple[int, int], ndarray]
+
+    @staticmethod
+    def _ratio(source_rate: int, target_rate: int) -> Tuple[int, int]:
+        divisor = _greatest_common_divisor(source_rate, target_rate)
+        return target_rate // divisor, source_rate // divisor
+
+    def _filter(self, up: int, down: int) -> ndarray:
+        key = (up, down)
+        if key not in self._filters_by_ratio:
+            from scipy.signal import firwin
+
+            max_rate = max(up, down)
+            half_length = 10 * max_rate
+            self._filters_by_ratio[key] = firwin(2 * half_length + 1, 1. / max_rate,
+                                                 window=('kaiser', self.kaiser_beta))
+
+        return self._filters_by_ratio[key]
+
+    @staticmethod
+    def resampled_length(length: int, source_rate: int, target_rate: int) -> int:
+        up, down = PolyphaseResampler._ratio(source_rate, target_rate)
+        return -(-length * up // down)
+
+    def resample(self, audio: ndarray, source_rate: int, target_rate: int) -> ndarray:
+        return self.resample_batch([audio], source_rate=source_rate, target_rate=target_rate)[0]
+
+    def resample_batch(self, audios: List[ndarray], source_rate: int, target_rate: int) -> List[ndarray]:
+        """
+        Resamples several signals of the same source rate in one filter pass over a zero-padded matrix.
+        Since resampling assumes zeros beyond the signal anyway, trimming afterwards yields the same result
+        as resampling each signal separately.
+        """
+        if source_rate == target_rate:
+            return [audio for audio in audios]
+
+        from scipy.signal import resample_poly
+
+        up, down = self._ratio(source_rate, target_rate)
+        lengths = [audio.shape[0] for audio in audios]
+        padded = numpy.zeros((len(audios), max(lengths)), dtype=audios[0].dtype)
+        for index, audio in enumerate(audios):
+            padded[index, :audio.shape[0]] = audio
+
+        with metrics.timed("resample"):
+            resampled = resample_poly(padded, up, down, axis=1, window=self._filter(up, down))
+
+        return [resampled[index, :self.resampled_length(length, source_rate, target_rate)]
+                for index, length in enumerate(lengths)]
+
+
+class PcmCache:
+    """
+    Caches decoded mono audio, resampled to a target sample rate, as int16 .npy files.
+    Files are written via a temporary file and renamed, so readers never see partial entries,
+    and only one of several processes sharing the directory decodes a missing entry, see cache_files.
+    """
+
+    def __init__(self, cache_directory: Path, sample_rate: int = 16000,
+                 resampler: PolyphaseResampler = None):
+        self.sample_rate = sample_rate
+        self.directory = cache_directory / "{}Hz".format(sample_rate)
+        self.resampler = resampler if resampler is not None else PolyphaseResampler()
+        mkdir(self.directory)
+
+    def cache_file(self, id: str) -> Path:
+        return self.directory / "{}.npy".format(id)
+
+    @staticmethod
+    def _to_int16(audio: ndarray) -> ndarray:
+        return numpy.round(numpy.clip(audio, -1, 1) * _int16_scale).astype(numpy.int16)
+
+    @staticmethod
+    def _from_int16(pcm: ndarray) -> ndarray:
+        return pcm.astype(numpy.float32) / _int16_scale
+
+    def _save(self, id: str, audio: ndarray) -> None:
+        save_array_atomically(self.cache_file(id), self._to_int16(audio))
+
+    def audio(self, id: str, audio_file: Path) -> ndarray:
+        """Returns float32 audio in [-1, 1], decoding and resampling only if not yet cached."""
+        cache_file = self.cache_file(id)
+
+        def load() -> ndarray:
+            with metrics.timed("pcm_cache_read"):
+                pcm = numpy.load(str(cache_file))
+            metrics.count("pcm_cache_hits")
+            metrics.count("pcm_cache_bytes_read", pcm.nbytes)
+            return self._from_int16(pcm)
+
+        def decode_and_save() -> ndarray:
+            metrics.count("pcm_cache_misses")
+            decoded, original_sample_rate = decode_audio(audio_file)
+            audio = self.resampler.resample(decoded, source_rate=original_sample_rate, target_rate=self.sample_rate)
+            self._save(id, audio)
+            return self._from_int16(self._to_int16(audio))
+
+        return load_or_compute_once(cache_file, load=load, compute_and_save=decode_and_save, metric_prefix="pcm_cache")
+
+    def fill(self, ids_and_audio_files: Iterable[Tuple[str, Path]], batch_size: int = 32) -> int:
+        """
+        Decodes and caches all entries not yet cached, resampling files of equal original sample rate in batches.
+        :return: Number of newly cached entries.
+        """
+        missing = [(id, audio_file) for id, audio_file in ids_and_audio_files if not self.cache_file(id).exists()]
+
+        pending_by_rate = dict()  # type: Dict[int, List[Tuple[str, ndarray]]]
+
+        def flush(rate: int) -> None:
+            pending = pending_by_rate.pop(rate)
+            resampled = self.resampler.resample_batch([audio for id, audio in pending],
+                                                      source_rate=rate, target_rate=self.sample_rate)
+            for (id, _), audio in zip(pending, resampled):
+                self._save(id, audio)
+
+        for id, audio_file in missing:
+            decoded, original_sample_rate = decode_audio(audio_file)
+            pending_by_rate.setdefault(original_sample_rate, []).append((id, decoded))
+            if len(pending_by_rate[original_sample_rate]) >= batch_size:
+                flush(original_sample_rate)
+
+        for rate in list(pending_by_rate.keys()):
+            flush(rate)
+
+        return len(missing)
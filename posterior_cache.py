@@ -0,0 +1,112 @@
+import json
+from pathlib import Path
+
+import numpy
+import os
+from numpy import ndarray
+from typing import List, Dict, Tuple, Iterable, Optional
+
+from tools import mkdir
+
+
+class PosteriorStore:
+    """
+    Grapheme probabilities of one checkpoint for many utterances, each trimmed to its prediction length.
+    All utterances are appended to one float32 file that is read as a memory map, with an index of
+    (first frame, frame count) by example id in index.json, so reading an utterance only touches its own pages.
+    """
+
+    data_file_name = "posteriors.float32"
+    index_file_name = "index.json"
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.data_file = directory / self.data_file_name
+        self.index_file = directory / self.index_file_name
+        mkdir(directory)
+
+        self.grapheme_count = None  # type: Optional[int]
+        self.frame_ranges_by_id = dict()  # type: Dict[str, Tuple[int, int]]
+        self.frame_count = 0
+        if self.index_file.exists():
+            with self.index_file.open(encoding='utf8') as f:
+                index = json.load(f)
+            self.grapheme_count = index["grapheme_count"]
+            self.frame_ranges_by_id = dict((id, tuple(frame_range)) for id, frame_range in index["frames"].items())
+            self.frame_count = index["frame_count"]
+        self._memory_map = None  # type: Optional[numpy.memmap]
+
+    def __contains__(self, id: str) -> bool:
+        return id in self.frame_ranges_by_id
+
+    def __len__(self):
+        return len(self.frame_ranges_by_id)
+
+    def ids(self) -> List[str]:
+        return sorted(self.frame_ranges_by_id.keys())
+
+    def add_batch(self, ids: List[str], prediction_batch: ndarray, prediction_lengths: List[int]) -> None:
+        """
+        Appends the probabilities of a batch as returned by Wav2Letter.prediction_batch,
+        skipping examples already in the store. Call save() afterwards.
+        """
+        if self.grapheme_count is None:
+            self.grapheme_count = prediction_batch.shape[2]
+        elif self.grapheme_count != prediction_batch.shape[2]:
+            raise ValueError("Expected {} graphemes, got {}.".format(self.grapheme_count, prediction_batch.shape[2]))
+
+        # data beyond the indexed frames can be left by an interrupted run, truncate it:
+        with self.data_file.open('ab') as f:
+            f.truncate(self.frame_count * self.grapheme_count * 4)
+            for index, (id, length) in enumerate(zip(ids, prediction_lengths)):
+                if id in self.frame_ranges_by_id:
+                    continue
+
+                f.write(numpy.ascontiguousarray(prediction_batch[index, :length], dtype=numpy.float32).tobytes())
+                self.frame_ranges_by_id[id] = (self.frame_count, length)
+                self.frame_count += length
+
+        self._memory_map = None
+
+    def save(self) -> None:
+        temporary_file = self.index_file.with_name(".{}.{}".format(self.index_file_name, os.getpid()))
+        with temporary_file.open('w', encoding='utf8') as f:
+            json.dump({"grapheme_count": self.grapheme_count, "frame_count": self.frame_count,
+                       "frames": self.frame_ranges_by_id}, f)
+        os.replace(str(temporary_file), str(self.index_file))
+
+    def _memory_mapped(self) -> ndarray:
+        if self._memory_map is None:
+            self._memory_map = numpy.memmap(str(self.data_file), dtype=numpy.float32, mode='r',
+                                            shape=(self.frame_count, self.grapheme_count))
+        return self._memory_map
+
+    def posteriors(self, id: str) -> ndarray:
+        """In shape (time, grapheme), read-only."""
+        first_frame, frame_count = self.frame_ranges_by_id[id]
+        return self._memory_mapped()[first_frame:first_frame + frame_count]
+
+    def prediction_batch(self, ids: List[str]) -> Tuple[ndarray, List[int]]:
+        """Pads the probabilities of the given examples to a batch of the shape prediction_batch returns."""
+        posteriors = [self.posteriors(id) for id in ids]
+        prediction_lengths = [p.shape[0] for p in posteriors]
+        batch = numpy.zeros((len(ids), max(prediction_lengths, default=0), self.grapheme_count or 0),
+                            dtype=numpy.float32)
+        for index, p in enumerate(posteriors):
+            batch[index, :p.shape[0]] = p
+
+        return batch, prediction_lengths
+
+    def prediction_batches(self, ids: List[str], batch_size: int = 64) -> Iterable[Tuple[ndarray, List[int]]]:
+        for start in range(0, len(ids), batch_size):
+            yield self.prediction_batch(ids[start:start + batch_size])
+
+
+class PosteriorCache:
+    """Posterior stores by checkpoint, e. g. "20170314-134351-adam-small-learning-rate-complete-95/weights-epoch1689"."""
+
+    def __init__(self, cache_directory: Path):
+        self.cache_directory = cache_directory
+
+    def store(self, checkpoint_key: str) -> PosteriorStore:
+        return PosteriorStore(self.cache_directory / checkpoint_key)
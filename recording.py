@@ -1,13 +1,14 @@
 import array
-from itertools import dropwhile
 from pathlib import Path
 from sys import byteorder
 
 import librosa
 import numpy
-from numpy import ndarray, abs, max, flipud, concatenate
+from numpy import ndarray, abs, max, concatenate
+from typing import Optional
 
 from labeled_example import LabeledExample
+from voice_activity import FrameEnergyVoiceActivityDetector, trim_samples_below
 
 
 class Recorder:
@@ -15,26 +16,31 @@ class Recorder:
                  silence_threshold_for_unnormalized_audio: float = .03,
                  chunk_size: int = 1024,
                  sample_rate: int = 16000,
-                 silence_until_terminate_in_s: int = 3):
+                 silence_until_terminate_in_s: int = 3,
+                 voice_activity_detector: Optional[FrameEnergyVoiceActivityDetector] = None):
+        """
+        :param voice_activity_detector: If given, silence is trimmed by frame energy,
+        otherwise samples below the silence threshold are trimmed.
+        """
         self.silence_threshold_for_not_normalized_sound = silence_threshold_for_unnormalized_audio
         self.chunk_size = chunk_size
         self.sample_rate = sample_rate
         self.silence_until_terminate_in_s = silence_until_terminate_in_s
+        self.voice_activity_detector = voice_activity_detector
 
     def _is_silent(self, audio: ndarray):
-        return max(audio) < self.silence_threshold_for_not_normalized_sound
+        return max(abs(audio)) < self.silence_threshold_for_not_normalized_sound
 
     def _normalize(self, audio: ndarray) -> ndarray:
         return audio / max(abs(audio))
 
     def _trim_silence(self, audio: ndarray) -> ndarray:
-        def trim_start(sound: ndarray) -> ndarray:
-            return numpy.array(list(dropwhile(lambda x: x < self.silence_threshold_for_not_normalized_sound, sound)))
+        if self.voice_activity_detector is not None:
+            trimmed = self.voice_activity_detector.trim(audio)
+            print("Trimmed {} silent frames.".format(trimmed.removed_frame_count))
+            return trimmed.audio
 
-        def trim_end(sound: ndarray) -> ndarray:
-            return flipud(trim_start(flipud(sound)))
-
-        return trim_start(trim_end(audio))
+        return trim_samples_below(audio, self.silence_threshold_for_not_normalized_sound)
 
     def record(self):
         """Records from the microphone and returns the data as an array of signed shorts."""
@@ -6,9 +6,17 @@ import numpy
 from numpy import ndarray
 from numpy.core.multiarray import ndarray
 from os import makedirs
-from typing import Callable, List, Iterable
-
+from typing import Callable, List, Iterable, Tuple, Optional
+
+from buffer_pool import BufferLease
+from cache_files import load_or_compute_once, save_array_atomically
+from cache_maintenance import CacheIndex
+from dtype_policy import DtypePolicy, default_dtype_policy
+from epoch_sampler import EpochSampler
+from feature_transforms import FeatureTransform
+from instrumentation import metrics
 from labeled_example import LabeledExample
+from voice_activity import FrameEnergyVoiceActivityDetector
 
 
 def paginate(sequence: List, page_size: int):
@@ -16,9 +24,41 @@ def paginate(sequence: List, page_size: int):
         yield sequence[start:start + page_size]
 
 
+def input_batch_and_prediction_lengths(spectrograms: List[ndarray], input_to_prediction_length_ratio: int,
+                                       dtype: numpy.dtype = default_dtype_policy.compute_dtype,
+                                       buffer_lease: Optional[BufferLease] = None) -> \
+        Tuple[ndarray, List[int]]:
+    """
+    Pads spectrograms of shape (time, frequencies) with zeros at the end to a batch of equal length.
+    :param buffer_lease: If given, the batch is written into a pooled buffer owned by the lease,
+    only clearing the padding instead of zeroing the whole batch. It is then padded further
+    to the rounded length of the buffer, see BufferPool.
+    """
+    with metrics.timed("padding"):
+        batch_size = len(spectrograms)
+        input_size_per_time_step = spectrograms[0].shape[1]
+        input_lengths = [spectrogram.shape[0] for spectrogram in spectrograms]
+        prediction_lengths = [s // input_to_prediction_length_ratio for s in input_lengths]
+        shape = (batch_size, max(input_lengths), input_size_per_time_step)
+        if buffer_lease is None:
+            input_batch = numpy.zeros(shape, dtype=dtype)
+            for index, spectrogram in enumerate(spectrograms):
+                input_batch[index, :spectrogram.shape[0], :spectrogram.shape[1]] = spectrogram
+        else:
+            input_batch = buffer_lease.array(shape, dtype=dtype)
+            for index, spectrogram in enumerate(spectrograms):
+                input_batch[index, :spectrogram.shape[0]] = spectrogram
+                input_batch[index, spectrogram.shape[0]:] = 0
+
+        return input_batch, prediction_lengths
+
+
 class LabeledSpectrogram:
     __metaclass__ = ABCMeta
 
+    @abstractmethod
+    def id(self) -> str: raise NotImplementedError
+
     @abstractmethod
     def label(self) -> str: raise NotImplementedError
 
@@ -27,52 +67,181 @@ class LabeledSpectrogram:
 
 
 class CachedLabeledSpectrogram(LabeledSpectrogram):
+    """Stores spectrograms in the storage type of the dtype policy and returns them in its compute type."""
+
     def __init__(self, example: LabeledExample, spectrogram_cache_directory: Path,
                  spectrogram_from_example: Callable[[LabeledExample], ndarray] =
-                 lambda x: x.z_normalized_transposed_spectrogram()):
+                 lambda x: x.z_normalized_transposed_spectrogram(),
+                 dtype_policy: DtypePolicy = default_dtype_policy,
+                 cache_index: Optional[CacheIndex] = None):
         self.spectrogram_from_example = spectrogram_from_example
+        self.dtype_policy = dtype_policy
+        self.cache_index = cache_index
         self.example = example
         self.spectrogram_cache_file = spectrogram_cache_directory / "{}.npy".format(example.id)
 
+    def id(self) -> str:
+        return self.example.id
+
     def label(self) -> str:
         return self.example.label
 
     def spectrogram(self) -> ndarray:
-        if not self.spectrogram_cache_file.exists():
-            return self._calculate_and_save_spectrogram()
-
-        try:
-            return numpy.load(str(self.spectrogram_cache_file))
-        except ValueError as e:
-            print("Recalculating cached file {} because loading failed.".format(self.spectrogram_cache_file))
-            return self._calculate_and_save_spectrogram()
+        """Safe with several processes or nodes sharing the cache directory, see cache_files."""
+        return load_or_compute_once(self.spectrogram_cache_file, load=self._load_spectrogram,
+                                    compute_and_save=self._calculate_and_save_spectrogram,
+                                    metric_prefix="spectrogram_cache")
+
+    def _load_spectrogram(self) -> ndarray:
+        with metrics.timed("spectrogram_cache_read"):
+            spectrogram = numpy.load(str(self.spectrogram_cache_file))
+        metrics.count("spectrogram_cache_hits")
+        metrics.count("spectrogram_cache_bytes_read", spectrogram.nbytes)
+        self._record_access(spectrogram.nbytes, hit=True)
+        return self.dtype_policy.for_compute(spectrogram)
 
     def _calculate_and_save_spectrogram(self):
-        spectrogram = self.spectrogram_from_example(self.example)
-        numpy.save(str(self.spectrogram_cache_file), spectrogram)
-        return spectrogram
+        metrics.count("spectrogram_cache_misses")
+        with metrics.timed("spectrogram_calculation"):
+            spectrogram = self.spectrogram_from_example(self.example)
+        stored = self.dtype_policy.for_storage(spectrogram)
+        with metrics.timed("spectrogram_cache_write"):
+            save_array_atomically(self.spectrogram_cache_file, stored)
+        metrics.count("spectrogram_cache_bytes_written", stored.nbytes)
+        self._record_access(stored.nbytes, hit=False)
+        # as read from the cache next time:
+        return self.dtype_policy.for_compute(stored)
+
+    def _record_access(self, byte_count: int, hit: bool) -> None:
+        if self.cache_index is not None:
+            self.cache_index.record_access(self.spectrogram_cache_file.name, byte_count=byte_count, hit=hit)
+
+
+class DerivedLabeledSpectrogram(LabeledSpectrogram):
+    """
+    Features derived by a transform from the spectrogram of a CachedLabeledSpectrogram, cached in a subdirectory
+    of its cache directory named by the key of the transform. Computing a missing entry loads the base spectrogram
+    from the cache (or calculates and caches it) instead of decoding the audio again.
+    Since it has no example attribute, waveform augmentation leaves it unperturbed.
+    """
+
+    def __init__(self, base: CachedLabeledSpectrogram, transform: FeatureTransform,
+                 cache_index: Optional[CacheIndex] = None):
+        self.base = base
+        self.transform = transform
+        self.cache_index = cache_index
+        self.spectrogram_cache_file = derived_cache_directory(
+            base.spectrogram_cache_file.parent, transform) / base.spectrogram_cache_file.name
+
+    def id(self) -> str:
+        return self.base.id()
+
+    def label(self) -> str:
+        return self.base.label()
+
+    def spectrogram(self) -> ndarray:
+        return load_or_compute_once(self.spectrogram_cache_file, load=self._load_features,
+                                    compute_and_save=self._derive_and_save_features,
+                                    metric_prefix="derived_feature_cache")
+
+    def _load_features(self) -> ndarray:
+        with metrics.timed("derived_feature_cache_read"):
+            features = numpy.load(str(self.spectrogram_cache_file))
+        metrics.count("derived_feature_cache_hits")
+        self._record_access(features.nbytes, hit=True)
+        return self.base.dtype_policy.for_compute(features)
+
+    def _derive_and_save_features(self) -> ndarray:
+        metrics.count("derived_feature_cache_misses")
+        base_spectrogram = self.base.spectrogram()
+        with metrics.timed("feature_transform"):
+            features = self.transform.apply(base_spectrogram)
+        stored = self.base.dtype_policy.for_storage(features)
+        save_array_atomically(self.spectrogram_cache_file, stored)
+        self._record_access(stored.nbytes, hit=False)
+        return self.base.dtype_policy.for_compute(stored)
+
+    def _record_access(self, byte_count: int, hit: bool) -> None:
+        if self.cache_index is not None:
+            self.cache_index.record_access(self.spectrogram_cache_file.name, byte_count=byte_count, hit=hit)
+
+
+def derived_cache_directory(spectrogram_cache_directory: Path, transform: FeatureTransform) -> Path:
+    return spectrogram_cache_directory / "derived" / transform.key
 
 
 class LabeledSpectrogramBatchGenerator:
     def __init__(self, examples: List[LabeledExample], spectrogram_cache_directory: Path,
                  spectrogram_from_example: Callable[[LabeledExample], ndarray] =
                  lambda x: x.z_normalized_transposed_spectrogram(),
-                 batch_size: int = 64):
+                 batch_size: int = 64,
+                 dtype_policy: DtypePolicy = default_dtype_policy,
+                 cache_index: Optional[CacheIndex] = None,
+                 feature_transform: Optional[FeatureTransform] = None,
+                 voice_activity_detector: Optional[FrameEnergyVoiceActivityDetector] = None):
+        """
+        :param cache_index: If given, accesses to cached spectrograms are recorded in it
+        for cache maintenance, see cache_maintenance.
+        :param feature_transform: If given, batches consist of features derived from the cached spectrograms,
+        see DerivedLabeledSpectrogram. Accesses to them are recorded in an index of their own directory.
+        :param voice_activity_detector: If given, silence is trimmed from the audio of the examples before their
+        spectrograms are calculated. These are cached in a subdirectory named by the detector parameters.
+        """
+        if voice_activity_detector is not None:
+            examples = [example.with_voice_activity_detector(voice_activity_detector) for example in examples]
+            spectrogram_cache_directory = spectrogram_cache_directory / "trimmed" / voice_activity_detector.key
+            if cache_index is not None:
+                cache_index = CacheIndex(spectrogram_cache_directory)
+
         # not Path.mkdir() for compatibility with Python 3.4
         makedirs(str(spectrogram_cache_directory), exist_ok=True)
 
         self.batch_size = batch_size
         self.spectrogram_cache_directory = spectrogram_cache_directory
+        self.cache_index = cache_index
+        self.feature_transform = feature_transform
         self.labeled_spectrograms = [
             CachedLabeledSpectrogram(example, spectrogram_cache_directory=spectrogram_cache_directory,
-                                     spectrogram_from_example=spectrogram_from_example)
-            for example in examples]
+                                     spectrogram_from_example=spectrogram_from_example, dtype_policy=dtype_policy,
+                                     cache_index=cache_index)
+            for example in examples]  # type: List[LabeledSpectrogram]
+
+        if feature_transform is not None:
+            derived_directory = derived_cache_directory(spectrogram_cache_directory, feature_transform)
+            makedirs(str(derived_directory), exist_ok=True)
+            derived_cache_index = CacheIndex(derived_directory) if cache_index is not None else None
+            self.labeled_spectrograms = [
+                DerivedLabeledSpectrogram(base, transform=feature_transform, cache_index=derived_cache_index)
+                for base in self.labeled_spectrograms]
+
+    @property
+    def time_step_reduction(self) -> int:
+        """
+        Factor by which the batches have fewer time steps than the spectrograms have frames,
+        to be passed to Wav2Letter as input_time_step_reduction.
+        """
+        return 1 if self.feature_transform is None else self.feature_transform.time_step_reduction()
 
     def preview_batch(self):
         return self.labeled_spectrograms[:self.batch_size]
 
-    def as_training_batches(self) -> Iterable[List[LabeledSpectrogram]]:
+    def epoch_sampler(self, seed: int = 0, rank: int = 0, world_size: int = 1) -> EpochSampler:
+        return EpochSampler(len(self.labeled_spectrograms), batch_size=self.batch_size, seed=seed, rank=rank,
+                            world_size=world_size)
+
+    def as_training_batches(self, sampler: Optional[EpochSampler] = None) -> Iterable[List[LabeledSpectrogram]]:
+        """
+        :param sampler: If given, batches are drawn epoch by epoch from it, otherwise each batch is sampled
+        independently at random.
+        """
+        if sampler is not None:
+            for indices in sampler.index_batches():
+                metrics.count("training_batches_sampled")
+                yield [self.labeled_spectrograms[index] for index in indices]
+            return
+
         while True:
+            metrics.count("training_batches_sampled")
             yield random.sample(self.labeled_spectrograms, self.batch_size)
 
     def as_validation_batches(self) -> Iterable[List[LabeledSpectrogram]]:
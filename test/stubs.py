@@ -0,0 +1,31 @@
+"""Stand-ins for labeled examples in tests of the spectrogram cache and of what builds on it."""
+import zlib
+
+import numpy
+
+
+class StubExample:
+    """Has what CachedLabeledSpectrogram and the spectrogram gallery use of a LabeledExample, but no audio."""
+
+    def __init__(self, id: str, label: str = "a"):
+        self.id = id
+        self.label = label
+        self.hop_length = 128
+        self.sample_rate = 16000
+
+
+class SeededSpectrogram:
+    """
+    Calculates spectrograms of random values seeded by the example id instead of from audio,
+    counting the calculations. Picklable, e. g. for spawned processes.
+    """
+
+    def __init__(self, frame_count: int = 50, frequency_count: int = 8):
+        self.frame_count = frame_count
+        self.frequency_count = frequency_count
+        self.calculation_count = 0
+
+    def __call__(self, example: StubExample) -> numpy.ndarray:
+        self.calculation_count += 1
+        return numpy.random.RandomState(zlib.crc32(example.id.encode('utf8'))).randn(
+            self.frame_count, self.frequency_count).astype(numpy.float32)
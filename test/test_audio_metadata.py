@@ -0,0 +1,53 @@
+import tempfile
+import wave
+from pathlib import Path
+from unittest import TestCase
+
+import numpy
+import soundfile
+
+from audio_metadata import read_audio_metadata, AudioMetadata, AudioMetadataIndex, AudioMetadataException
+
+
+class AudioMetadataTest(TestCase):
+    def test_wave(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "a.wav"
+            with wave.open(str(path), "wb") as wave_file:
+                wave_file.setnchannels(2)
+                wave_file.setsampwidth(2)
+                wave_file.setframerate(44100)
+                wave_file.writeframes(b"\0\0\0\0" * 22050)
+
+            metadata = read_audio_metadata(path)
+            self.assertEqual(AudioMetadata(sample_rate=44100, channel_count=2, frame_count=22050), metadata)
+            self.assertEqual(.5, metadata.duration_in_s)
+
+    def test_flac(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "a.flac"
+            soundfile.write(str(path), numpy.zeros(24000), samplerate=48000)
+
+            self.assertEqual(AudioMetadata(sample_rate=48000, channel_count=1, frame_count=24000),
+                             read_audio_metadata(path))
+
+    def test_unsupported(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "a.txt"
+            path.write_text("no audio")
+
+            with self.assertRaises(AudioMetadataException):
+                read_audio_metadata(path)
+
+    def test_index_is_persisted(self):
+        with tempfile.TemporaryDirectory() as directory:
+            corpus_directory = Path(directory) / "corpus"
+            corpus_directory.mkdir()
+            path = corpus_directory / "a.flac"
+            soundfile.write(str(path), numpy.zeros(16000), samplerate=16000)
+
+            index = AudioMetadataIndex(corpus_directory)
+            self.assertEqual(1., index.metadata(path).duration_in_s)
+            index.save()
+
+            self.assertEqual(AudioMetadata(16000, 1, 16000), AudioMetadataIndex(corpus_directory).metadata(path))
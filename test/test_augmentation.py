@@ -0,0 +1,104 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import numpy
+import soundfile
+from numpy.random import RandomState
+
+from augmentation import SpecAugment, NoiseBank, WaveformAugmentation, Augmentation
+from instrumentation import metrics
+from labeled_example import LabeledExample
+from spectrogram_batch import CachedLabeledSpectrogram, input_batch_and_prediction_lengths
+
+
+class SpecAugmentTest(TestCase):
+    def test_masks_only_within_lengths(self):
+        input_batch = numpy.full((3, 40, 20), 7., dtype=numpy.float32)
+        lengths = [40, 25, 10]
+        for index, length in enumerate(lengths):
+            input_batch[index, length:] = 0
+
+        SpecAugment(frequency_mask_count=1, max_frequency_mask_width=5, time_mask_count=1,
+                    max_time_mask_fraction=.2, mask_value=-1.).apply(input_batch, lengths, RandomState(0))
+
+        for index, length in enumerate(lengths):
+            self.assertTrue(numpy.all(input_batch[index, length:] == 0))
+            masked = input_batch[index, :length] == -1
+            self.assertTrue(numpy.all(input_batch[index, :length][~masked] == 7))
+            # masked frequencies and time steps form whole bands:
+            masked_frequencies = numpy.all(masked, axis=0)
+            masked_time_steps = numpy.all(masked, axis=1)
+            numpy.testing.assert_array_equal(masked, masked_frequencies[None, :] | masked_time_steps[:, None])
+            self.assertLessEqual(masked_frequencies.sum(), 5)
+            self.assertLessEqual(masked_time_steps.sum(), int(length * .2))
+
+
+class WaveformAugmentationTest(TestCase):
+    def test_change_speed(self):
+        audio = numpy.sin(numpy.arange(16000) / 10).astype(numpy.float32)
+
+        faster = WaveformAugmentation.change_speed(audio, 1.25)
+
+        self.assertEqual(12800, len(faster))
+        self.assertEqual(numpy.float32, faster.dtype)
+        numpy.testing.assert_allclose(faster[:100], numpy.sin(numpy.arange(100) * 1.25 / 10), atol=3e-3)
+
+    def test_add_noise_at_signal_to_noise_ratio(self):
+        random = RandomState(0)
+        audio = random.normal(size=16000).astype(numpy.float32)
+        augmentation = WaveformAugmentation(noise_bank=NoiseBank(random.normal(scale=3, size=50000)))
+
+        noisy = augmentation.add_noise(audio, snr_in_db=20., random=random)
+
+        noise = noisy - audio
+        self.assertAlmostEqual(20., 10 * numpy.log10(numpy.mean(audio ** 2) / numpy.mean(noise ** 2)), places=3)
+
+    def test_noise_bank_round_trip(self):
+        with TemporaryDirectory() as directory:
+            path = Path(directory) / "noise.npy"
+            NoiseBank(numpy.arange(10, dtype=numpy.float32)).save(path)
+
+            segment = NoiseBank.load(path).segment(4, RandomState(0))
+
+        self.assertEqual(4, len(segment))
+        numpy.testing.assert_array_equal(numpy.arange(segment[0], segment[0] + 4), segment)
+
+
+class AugmentationTest(TestCase):
+    def test_workers_draw_different_reproducible_masks(self):
+        spectrograms = [numpy.ones((30, 16), dtype=numpy.float32)] * 4
+        augmentation = Augmentation(SpecAugment(max_frequency_mask_width=4), seed=5)
+
+        def masked(worker_index: int):
+            input_batch, _ = input_batch_and_prediction_lengths(spectrograms, input_to_prediction_length_ratio=1)
+            augmentation.for_worker(worker_index).mask_batch(input_batch, input_lengths=[30] * 4)
+            return input_batch
+
+        numpy.testing.assert_array_equal(masked(0), masked(0))
+        self.assertFalse(numpy.array_equal(masked(0), masked(1)))
+
+    def test_perturbed_spectrograms_are_calculated_from_audio(self):
+        metrics.enable()
+        metrics.reset()
+        try:
+            with TemporaryDirectory() as directory:
+                audio_file = Path(directory) / "example.wav"
+                soundfile.write(str(audio_file), RandomState(0).uniform(-.5, .5, 16000), samplerate=16000)
+                labeled_spectrogram = CachedLabeledSpectrogram(LabeledExample(audio_file),
+                                                               spectrogram_cache_directory=Path(directory))
+                augmentation = Augmentation(spec_augment=None,
+                                            waveform_augmentation=WaveformAugmentation(speed_factors=(2.,)),
+                                            waveform_probability=1.)
+
+                perturbed, = augmentation.spectrograms([labeled_spectrogram])
+                self.assertNotIn("raw_audio", labeled_spectrogram.example.__dict__)
+                original = labeled_spectrogram.spectrogram()
+        finally:
+            snapshot = metrics.snapshot()
+            metrics.disable()
+            metrics.reset()
+
+        self.assertEqual(original.shape[1], perturbed.shape[1])
+        self.assertAlmostEqual(original.shape[0] / 2, perturbed.shape[0], delta=1)
+        self.assertEqual(1, snapshot["histograms"]["augmentation"]["count"])
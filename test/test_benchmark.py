@@ -0,0 +1,29 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from benchmark import SyntheticCorpus, regressions
+
+
+class BenchmarkTest(TestCase):
+    def test_synthetic_corpus(self):
+        with tempfile.TemporaryDirectory() as directory:
+            corpus = SyntheticCorpus(Path(directory), example_count=3, max_duration_in_s=1.5).create()
+
+            librispeech_examples = corpus.librispeech_provider().examples
+            clarin_examples = corpus.clarin_provider().examples
+
+            self.assertEqual(3, len(librispeech_examples))
+            self.assertEqual([e.label for e in librispeech_examples], [e.label for e in clarin_examples])
+            self.assertEqual(16000, librispeech_examples[0].original_sample_rate)
+            self.assertEqual(44100, clarin_examples[0].original_sample_rate)
+            self.assertTrue(1 <= clarin_examples[0].duration_in_s() <= 1.5)
+
+    def test_regressions(self):
+        baseline = {"benchmarks": {"a": {"median_s": 1.}, "b": {"median_s": 1.}, "c": {"median_s": 1.}}}
+        current = {"benchmarks": {"a": {"median_s": 1.1}, "b": {"median_s": 1.5}}}
+
+        found = regressions(baseline, current, tolerance=.2)
+
+        self.assertEqual(1, len(found))
+        self.assertTrue(found[0].startswith("b:"))
@@ -0,0 +1,86 @@
+from unittest import TestCase
+
+import numpy
+
+from buffer_pool import BufferPool, InFlightLeases
+from grapheme_enconding import CtcGraphemeEncoding
+from spectrogram_batch import input_batch_and_prediction_lengths
+
+
+class BufferPoolTest(TestCase):
+    def test_buffers_are_reused_only_after_release(self):
+        pool = BufferPool(length_granularity=8)
+
+        first_lease = pool.lease()
+        first = first_lease.array((2, 5, 3), dtype='float32')
+        second = pool.lease().array((2, 7, 3), dtype='float32')
+        self.assertFalse(numpy.shares_memory(first, second))
+
+        first_lease.release()
+        third = pool.lease().array((2, 6, 3), dtype='float32')
+
+        self.assertTrue(numpy.shares_memory(first, third))
+        self.assertEqual((2, 8, 3), third.shape)
+        self.assertTrue(third.flags['C_CONTIGUOUS'])
+        self.assertEqual(2, pool.allocation_count)
+        self.assertEqual(1, pool.reuse_count)
+
+    def test_size_classes(self):
+        pool = BufferPool(length_granularity=8)
+
+        self.assertEqual(pool.size_class((2, 1, 3), 'float32'), pool.size_class((2, 8, 3), 'float32'))
+        self.assertNotEqual(pool.size_class((2, 8, 3), 'float32'), pool.size_class((2, 9, 3), 'float32'))
+        self.assertNotEqual(pool.size_class((2, 8, 3), 'float32'), pool.size_class((2, 8, 3), 'float16'))
+
+    def test_released_lease_cannot_be_used(self):
+        lease = BufferPool().lease()
+        lease.release()
+
+        with self.assertRaises(RuntimeError):
+            lease.array((1, 1), dtype='int32')
+        with self.assertRaises(RuntimeError):
+            lease.release()
+
+    def test_padding_into_reused_buffer_clears_tails(self):
+        pool = BufferPool()
+        with pool.lease() as lease:
+            input_batch_and_prediction_lengths([numpy.ones((10, 2)), numpy.ones((10, 2))],
+                                               input_to_prediction_length_ratio=2, buffer_lease=lease)
+            CtcGraphemeEncoding().encode_label_batch(["abcd", "abcd"], buffer_lease=lease)
+
+        spectrograms = [numpy.full((4, 2), 2.), numpy.full((7, 2), 3.)]
+        with pool.lease() as lease:
+            pooled, pooled_lengths = input_batch_and_prediction_lengths(
+                spectrograms, input_to_prediction_length_ratio=2, buffer_lease=lease)
+            pooled_labels = CtcGraphemeEncoding().encode_label_batch(["ab", "abc"], buffer_lease=lease)
+
+            expected, expected_lengths = input_batch_and_prediction_lengths(spectrograms,
+                                                                            input_to_prediction_length_ratio=2)
+            # padded to the rounded length of the buffer:
+            self.assertEqual((2, 32, 2), pooled.shape)
+            numpy.testing.assert_array_equal(expected, pooled[:, :7])
+            numpy.testing.assert_array_equal(0, pooled[:, 7:])
+            self.assertEqual(expected_lengths, pooled_lengths)
+            expected_labels = CtcGraphemeEncoding().encode_label_batch(["ab", "abc"])
+            numpy.testing.assert_array_equal(expected_labels, pooled_labels[:, :3])
+            numpy.testing.assert_array_equal(-1, pooled_labels[:, 3:])
+
+        self.assertEqual(2, pool.reuse_count)
+
+
+class InFlightLeasesTest(TestCase):
+    def test_releases_oldest_lease_when_a_step_finished(self):
+        pool = BufferPool()
+        in_flight_leases = InFlightLeases()
+        leases = [pool.lease(), pool.lease()]
+        for lease in leases:
+            lease.array((1, 1), dtype='float32')
+            in_flight_leases.hand_over(lease)
+
+        in_flight_leases.step_finished()
+        self.assertEqual([True, False], [lease.released for lease in leases])
+
+        in_flight_leases.release_all()
+        self.assertEqual([True, True], [lease.released for lease in leases])
+        self.assertEqual(0, len(in_flight_leases))
+        self.assertEqual(2, pool.free_buffer_count())
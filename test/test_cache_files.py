@@ -0,0 +1,84 @@
+import multiprocessing
+import time
+from functools import partial
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import numpy
+import os
+from typing import List, Tuple
+
+from cache_files import CacheEntryClaim, load_or_compute_once
+from spectrogram_batch import CachedLabeledSpectrogram
+from test.stubs import StubExample
+
+entry_count = 4
+process_count = 8
+
+
+def _slow_spectrogram(example: StubExample, log_file: Path) -> numpy.ndarray:
+    with log_file.open('a') as f:
+        f.write("{}\n".format(example.id))
+    time.sleep(.2)
+    return numpy.full((500, 64), float(example.id), dtype=numpy.float32)
+
+
+def _read_all(directory: Path, worker_index: int) -> List[Tuple[str, float, tuple]]:
+    results = []
+    # workers request the entries in different orders:
+    for index in numpy.random.RandomState(worker_index).permutation(entry_count):
+        spectrogram = CachedLabeledSpectrogram(
+            StubExample(str(index)), spectrogram_cache_directory=directory,
+            spectrogram_from_example=partial(_slow_spectrogram, log_file=directory / "computations.log")).spectrogram()
+        results.append((str(index), float(spectrogram.mean()), spectrogram.shape))
+    return results
+
+
+class CacheFilesTest(TestCase):
+    def test_concurrent_workers_compute_each_entry_once(self):
+        with TemporaryDirectory() as directory:
+            directory = Path(directory)
+            with multiprocessing.get_context("spawn").Pool(processes=process_count) as pool:
+                results_by_worker = pool.starmap(_read_all, [(directory, index) for index in range(process_count)])
+
+            computed_ids = (directory / "computations.log").read_text().split()
+            remaining_files = sorted(file.name for file in directory.iterdir())
+
+        self.assertEqual(sorted(str(index) for index in range(entry_count)), sorted(computed_ids))
+        for results in results_by_worker:
+            for id, mean, shape in results:
+                self.assertEqual(float(id), mean)
+                self.assertEqual((500, 64), shape)
+        self.assertEqual(sorted(["computations.log"] + ["{}.npy".format(index) for index in range(entry_count)]),
+                         remaining_files)
+
+    def test_corrupt_entry_is_recomputed(self):
+        with TemporaryDirectory() as directory:
+            entry_file = Path(directory) / "entry.npy"
+            entry_file.write_bytes(b"partial")
+
+            def compute_and_save():
+                numpy.save(str(entry_file), numpy.ones(3))
+                return numpy.ones(3)
+
+            result = load_or_compute_once(entry_file, load=lambda: numpy.load(str(entry_file)),
+                                          compute_and_save=compute_and_save)
+
+            numpy.testing.assert_array_equal(numpy.ones(3), result)
+            numpy.testing.assert_array_equal(numpy.ones(3), numpy.load(str(entry_file)))
+
+    def test_stale_claim_is_taken_over(self):
+        with TemporaryDirectory() as directory:
+            entry_file = Path(directory) / "entry.npy"
+            crashed = CacheEntryClaim(entry_file, stale_after_s=60)
+            self.assertTrue(crashed.try_acquire())
+
+            claim = CacheEntryClaim(entry_file, stale_after_s=60)
+            self.assertFalse(claim.try_acquire())
+
+            an_hour_ago = time.time() - 3600
+            os.utime(str(claim.claim_file), (an_hour_ago, an_hour_ago))
+            self.assertTrue(claim.try_acquire())
+            claim.release()
+            self.assertFalse(claim.exists())
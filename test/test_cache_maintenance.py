@@ -0,0 +1,77 @@
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import numpy
+import os
+
+from cache_maintenance import CacheIndex, CacheMaintenance
+from spectrogram_batch import CachedLabeledSpectrogram
+from test.stubs import StubExample, SeededSpectrogram
+
+
+class CacheMaintenanceTest(TestCase):
+    def _write_entries(self, directory: Path, ids, cache_index: CacheIndex):
+        for id in ids:
+            CachedLabeledSpectrogram(StubExample(id), spectrogram_cache_directory=directory,
+                                     spectrogram_from_example=SeededSpectrogram(frame_count=100, frequency_count=10),
+                                     cache_index=cache_index).spectrogram()
+
+    def test_index_records_hits_and_misses(self):
+        with TemporaryDirectory() as directory:
+            index = CacheIndex(Path(directory), flush_every=1000)
+            self._write_entries(Path(directory), ["a", "b"], index)
+            self._write_entries(Path(directory), ["a", "a"], index)
+
+            entries = dict((e.id, e) for e in index.entries())
+            self.assertEqual((2, 1), (entries["a"].hit_count, entries["a"].miss_count))
+            self.assertEqual((0, 1), (entries["b"].hit_count, entries["b"].miss_count))
+            self.assertEqual(4000, entries["a"].byte_count)
+
+            # accesses of another process are added to the same rows:
+            CacheIndex(Path(directory)).record_access("a.npy", byte_count=4000, hit=True)
+            CacheIndex(Path(directory)).flush()
+            self.assertEqual(2, len(index.entries()))
+
+    def test_evicts_least_recently_used_entries_to_budget(self):
+        with TemporaryDirectory() as directory:
+            index = CacheIndex(Path(directory))
+            for seconds_ago, id in enumerate(["new", "middle", "old"]):
+                numpy.save(os.path.join(directory, id + ".npy"), numpy.zeros(1000, dtype=numpy.float32))
+                index.record_access(id + ".npy", byte_count=4000, hit=False, at=time.time() - 100 * seconds_ago)
+            # written before the index existed, so only its modification time is known:
+            numpy.save(os.path.join(directory, "unindexed.npy"), numpy.zeros(1000, dtype=numpy.float32))
+            os.utime(os.path.join(directory, "unindexed.npy"), (time.time() - 1000, time.time() - 1000))
+            index.flush()
+
+            evicted = CacheMaintenance(Path(directory), disk_budget_bytes=9000, index=index).evict_to_budget()
+
+            self.assertEqual(["unindexed.npy", "old.npy"], [e.file_name for e in evicted])
+            self.assertEqual(["middle.npy", "new.npy"], sorted(e.file_name for e in index.entries()))
+            self.assertFalse(Path(directory, "old.npy").exists())
+            self.assertTrue(Path(directory, "new.npy").exists())
+
+    def test_collects_orphaned_entries_and_reports_by_corpus(self):
+        with TemporaryDirectory() as directory:
+            index = CacheIndex(Path(directory))
+            self._write_entries(Path(directory), ["a1", "a2", "b1", "removed"], index)
+            self._write_entries(Path(directory), ["a1"], index)
+            stale_claim = Path(directory, "a1.npy.claim")
+            stale_claim.touch()
+            os.utime(str(stale_claim), (time.time() - 7200, time.time() - 7200))
+
+            maintenance = CacheMaintenance(Path(directory), index=index)
+            corpora = {"a": ["a1", "a2"], "b": ["b1", "b2"]}
+            statistics = dict((s.corpus, s) for s in maintenance.statistics(corpora))
+            self.assertEqual(2, statistics["a"].entry_count)
+            self.assertEqual(1 / 3, statistics["a"].hit_rate)
+            self.assertEqual(1, statistics[CacheMaintenance.orphaned_corpus_name].entry_count)
+
+            removed = maintenance.collect_garbage(corpora)
+
+            self.assertEqual(["removed"], [e.id for e in removed])
+            self.assertFalse(Path(directory, "removed.npy").exists())
+            self.assertFalse(stale_claim.exists())
+            self.assertEqual(["a1", "a2", "b1"], sorted(e.id for e in index.entries()))
+            self.assertIn("orphaned", maintenance.report(corpora))
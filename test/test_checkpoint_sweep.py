@@ -0,0 +1,93 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+import numpy
+
+from checkpoint_sweep import PreparedBatches, checkpoint_epochs, sweep, table, evaluate_prepared
+from grapheme_enconding import CtcGraphemeEncoding
+
+
+class FakeLabeledSpectrogram:
+    def __init__(self, id: str, label: str, frame_count: int):
+        self._id = id
+        self._label = label
+        self.frame_count = frame_count
+
+    def id(self) -> str:
+        return self._id
+
+    def label(self) -> str:
+        return self._label
+
+    def spectrogram(self):
+        return numpy.ones((self.frame_count, 3))
+
+
+class FakeModel:
+    """Predicts "a" for every frame after loading epoch 1, blanks otherwise."""
+
+    input_to_prediction_length_ratio = 2
+
+    def __init__(self):
+        self.grapheme_encoding = CtcGraphemeEncoding()
+        self.epoch = None
+
+    def load_weights(self, net_directory: Path, epoch: int) -> None:
+        (net_directory / "weights-epoch{}.h5".format(epoch)).read_bytes()
+        self.epoch = epoch
+
+    def prediction_batch(self, input_batch: numpy.ndarray) -> numpy.ndarray:
+        grapheme = self.grapheme_encoding.encode_character("a") if self.epoch == 1 else self.grapheme_encoding.ctc_blank
+        result = numpy.full((input_batch.shape[0], input_batch.shape[1] // 2, self.grapheme_encoding.grapheme_set_size),
+                            .01)
+        result[:, :, grapheme] = 1
+        return result
+
+
+class CheckpointSweepTest(TestCase):
+    def test_sweep(self):
+        with tempfile.TemporaryDirectory() as directory:
+            run_directory = Path(directory) / "run"
+            run_directory.mkdir()
+            for epoch in [1, 2, 10]:
+                (run_directory / "weights-epoch{}.h5".format(epoch)).write_bytes(b"")
+            (run_directory / "checkpoints.json").write_text("{}")
+
+            self.assertEqual([1, 2, 10], checkpoint_epochs(run_directory))
+            self.assertEqual([1, 2], checkpoint_epochs(run_directory, last_epoch=9))
+
+            prepared = PreparedBatches.prepare(
+                [[FakeLabeledSpectrogram("x", "a", 4), FakeLabeledSpectrogram("y", "aa", 6)],
+                 [FakeLabeledSpectrogram("z", "a", 2)]], directory=Path(directory) / "prepared")
+            self.assertEqual((2, 6, 3), prepared.input_batch(0).shape)
+            self.assertEqual([2], prepared.input_lengths(1))
+
+            evaluations = sweep(run_directory, prepared, epochs=[1, 2], worker_count=2, create_model=FakeModel)
+
+            self.assertEqual([1, 2], [e.epoch for e in evaluations])
+            self.assertEqual(.25, evaluations[0].character_error_rate)
+            self.assertEqual(1., evaluations[1].character_error_rate)
+            self.assertIn("epoch", table(evaluations))
+
+            model = FakeModel()
+            model.load_weights(run_directory, 1)
+            report = evaluate_prepared(model, prepared)
+            self.assertEqual(evaluations[0].character_error_rate, report.character_error_rate)
+            self.assertEqual(evaluations[0].loss, report.loss)
+
+    def test_prepare_skips_saved_batches(self):
+        with tempfile.TemporaryDirectory() as directory:
+            prepared_directory = Path(directory) / "prepared"
+            PreparedBatches.prepare([[FakeLabeledSpectrogram("x", "a", 4)]], directory=prepared_directory)
+
+            class UncalculableLabeledSpectrogram(FakeLabeledSpectrogram):
+                def spectrogram(self):
+                    raise AssertionError("batch should have been skipped")
+
+            prepared = PreparedBatches.prepare(
+                [[UncalculableLabeledSpectrogram("x", "a", 4)], [FakeLabeledSpectrogram("y", "aa", 6)]],
+                directory=prepared_directory)
+
+            self.assertEqual([[4], [6]], [prepared.input_lengths(index) for index in range(len(prepared))])
+            self.assertEqual([], [p.name for p in prepared_directory.iterdir() if p.name.startswith(".")])
@@ -0,0 +1,86 @@
+import tempfile
+from pathlib import Path
+from threading import Event
+from unittest import TestCase
+
+import numpy
+
+from checkpoints import CheckpointManager, WeightSnapshot, CheckpointIndex, CheckpointWriteError
+
+
+def write_npz(snapshot: WeightSnapshot, path: Path) -> None:
+    with path.open('wb') as f:
+        numpy.savez(f, **dict(("{}/{}".format(layer_name, weight_name), value)
+                              for layer_name, weights in snapshot.layers for weight_name, value in weights))
+
+
+def snapshot(value: float) -> WeightSnapshot:
+    return WeightSnapshot([("conv", [("kernel", numpy.full((2, 2), value)), ("bias", numpy.zeros(2))])])
+
+
+def file_name(epoch: int) -> str:
+    return "weights-epoch{}.npz".format(epoch)
+
+
+class CheckpointManagerTest(TestCase):
+    def test_retention(self):
+        with tempfile.TemporaryDirectory() as directory:
+            net_directory = Path(directory) / "net"
+            manager = CheckpointManager(net_directory, file_name=file_name, keep_last=2, write=write_npz)
+            for epoch, loss in [(1, 5.), (2, 1.), (3, 4.), (4, 3.), (5, 2.)]:
+                manager.save(epoch, snapshot(epoch), validation_loss=loss)
+            manager.close()
+
+            self.assertEqual([], manager.errors)
+            self.assertEqual({file_name(2), file_name(4), file_name(5), CheckpointIndex.file_name},
+                             set(p.name for p in net_directory.iterdir()))
+
+            index = CheckpointIndex(net_directory)
+            self.assertEqual(2, index.best_epoch())
+            self.assertEqual(5, index.latest().epoch)
+            self.assertEqual(2., numpy.load(str(net_directory / file_name(2)))["conv/kernel"][0, 0])
+
+    def test_without_validation_loss_latest_is_best(self):
+        with tempfile.TemporaryDirectory() as directory:
+            manager = CheckpointManager(Path(directory), file_name=file_name, keep_last=1, write=write_npz)
+            manager.save(1, snapshot(1))
+            manager.save(2, snapshot(2))
+            manager.close()
+
+            self.assertEqual(2, CheckpointIndex(Path(directory)).best_epoch())
+            self.assertIsNone(CheckpointIndex(Path(directory) / "missing").best_epoch())
+
+    def test_save_does_not_wait_for_write(self):
+        writing_may_finish = Event()
+
+        def slow_write(snapshot: WeightSnapshot, path: Path) -> None:
+            writing_may_finish.wait()
+            write_npz(snapshot, path)
+
+        with tempfile.TemporaryDirectory() as directory:
+            manager = CheckpointManager(Path(directory), file_name=file_name, write=slow_write)
+            manager.save(1, snapshot(1))
+
+            self.assertFalse((Path(directory) / file_name(1)).exists())
+            writing_may_finish.set()
+            manager.close()
+            self.assertTrue((Path(directory) / file_name(1)).exists())
+            self.assertEqual([], [p.name for p in Path(directory).iterdir() if p.name.startswith(".")])
+
+    def test_write_errors_are_raised(self):
+        def failing_write(snapshot: WeightSnapshot, path: Path) -> None:
+            raise OSError("disk full")
+
+        with tempfile.TemporaryDirectory() as directory:
+            manager = CheckpointManager(Path(directory), file_name=file_name, write=failing_write)
+            manager.save(1, snapshot(1))
+            manager._queue.join()
+
+            with self.assertRaises(CheckpointWriteError) as context:
+                manager.save(2, snapshot(2))
+            self.assertIn("disk full", str(context.exception))
+
+            manager.save(2, snapshot(2))
+            with self.assertRaises(CheckpointWriteError):
+                manager.close()
+            self.assertIsNone(CheckpointIndex(Path(directory)).latest())
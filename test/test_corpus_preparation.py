@@ -0,0 +1,88 @@
+import tarfile
+import tempfile
+import wave
+from pathlib import Path
+from unittest import TestCase
+
+from corpus_preparation import ConcurrentCorpusPreparation, CorpusPreparation
+from corpus_provider import CorpusProvider, CorpusArchive
+
+
+def create_librispeech_like_archive(source_directory: Path, corpus_name: str, ids_and_labels: dict) -> Path:
+    chapter_directory = source_directory / "unpacked" / "LibriSpeech" / corpus_name / "84" / "121123"
+    chapter_directory.mkdir(parents=True)
+    for id in ids_and_labels.keys():
+        with wave.open(str(chapter_directory / "{}.wav".format(id)), "wb") as wave_file:
+            wave_file.setnchannels(1)
+            wave_file.setsampwidth(2)
+            wave_file.setframerate(16000)
+            wave_file.writeframes(b"\0\0" * 160)
+
+    (chapter_directory / "84-121123.trans.txt").write_text(
+        "".join("{} {}\n".format(id, label.upper()) for id, label in ids_and_labels.items()))
+
+    archive = source_directory / "{}.tar.gz".format(corpus_name)
+    with tarfile.open(str(archive), "w:gz") as tar:
+        tar.add(str(source_directory / "unpacked" / "LibriSpeech"), arcname="LibriSpeech")
+
+    return archive
+
+
+class ConcurrentCorpusPreparationTest(TestCase):
+    def test_prepares_corpora_from_local_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source_directory = Path(directory) / "source"
+            base_directory = Path(directory) / "corpus"
+            corpus_names = ["dev-clean", "dev-other", "test-clean"]
+            for index, corpus_name in enumerate(corpus_names):
+                create_librispeech_like_archive(source_directory / corpus_name, corpus_name,
+                                                {"84-121123-000{}".format(index): "hello world"})
+
+            preparation = ConcurrentCorpusPreparation(fetch_limit=1, unpack_limit=2, index_limit=2)
+            providers = preparation.create_providers(
+                [lambda preparation, corpus_name=corpus_name: CorpusProvider(
+                    base_directory, base_source_url_or_directory=str(source_directory / corpus_name) + "/",
+                    corpus_names=[corpus_name], preparation=preparation)
+                 for corpus_name in corpus_names])
+
+            self.assertEqual([["84-121123-000{}".format(index)] for index in range(len(corpus_names))],
+                             [[example.id for example in provider.examples] for provider in providers])
+            self.assertEqual("hello world", providers[0].examples[0].label)
+            self.assertEqual(sorted(corpus_names), sorted(path.name for path in base_directory.iterdir()
+                                                          if path.is_dir()))
+            self.assertEqual([], [path for path in base_directory.iterdir() if path.name.startswith(".")])
+            for stage in CorpusPreparation.stages:
+                self.assertEqual(len(corpus_names),
+                                 len([s for s, corpus_name, duration in preparation.stage_durations if s == stage]))
+
+    def test_skips_fetching_already_unpacked_corpus(self):
+        with tempfile.TemporaryDirectory() as directory:
+            base_directory = Path(directory)
+            (base_directory / "dev-clean").mkdir()
+
+            preparation = CorpusPreparation()
+            provider = CorpusProvider(base_directory, base_source_url_or_directory="/nonexistent/",
+                                      corpus_names=["dev-clean"], preparation=preparation)
+
+            self.assertEqual([], provider.examples)
+            self.assertEqual(["index"], [stage for stage, corpus_name, duration in preparation.stage_durations])
+
+    def test_unpacking_tolerates_corpus_unpacked_by_another_process(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source_directory = Path(directory) / "source"
+            base_directory = Path(directory) / "corpus"
+            base_directory.mkdir()
+            create_librispeech_like_archive(source_directory, "dev-clean", {"84-121123-0000": "hello"})
+
+            class RacedCorpusArchive(CorpusArchive):
+                def _tar_members_root_directory_skipped_if_specified(self, tar):
+                    (self.target_directory / "84").mkdir(parents=True)
+                    return super()._tar_members_root_directory_skipped_if_specified(tar)
+
+            archive = RacedCorpusArchive("dev-clean", base_directory, str(source_directory) + "/",
+                                         tar_gz_extension=".tar.gz",
+                                         root_compressed_directory_name_to_skip="LibriSpeech/")
+            archive.download_if_not_yet_done()
+
+            self.assertEqual(archive.target_directory, archive.unpack_if_not_yet_done())
+            self.assertEqual([], [path for path in base_directory.iterdir() if path.name.startswith(".")])
@@ -0,0 +1,51 @@
+import tracemalloc
+from pathlib import Path
+from unittest import TestCase
+
+from audio_metadata import AudioMetadata
+from corpus_table import CorpusTable
+
+
+class CorpusTableTest(TestCase):
+    def setUp(self):
+        self.table = CorpusTable([
+            (Path("/corpus/b/2.wav"), "zwei", "zwei <äh>", AudioMetadata(48000, 1, 24000)),
+            (Path("/corpus/a/1.flac"), "eins", "eins", AudioMetadata(16000, 2, 32000)),
+            (Path("/corpus/a/3.flac"), "", "", None)])
+
+    def test_rows(self):
+        self.assertEqual(["1", "2", "3"], [row.id for row in self.table])
+        row = self.table.row("2")
+        self.assertEqual("zwei", row.label)
+        self.assertEqual(1, row.tag_count("<äh>"))
+        self.assertEqual(Path("/corpus/b/2.wav"), row.audio_file)
+        self.assertEqual(.5, row.duration_in_s())
+        self.assertEqual(AudioMetadata(16000, 2, 32000), self.table[0].audio_metadata)
+        self.assertIsNone(self.table[-1].audio_metadata)
+        self.assertEqual("1: eins", str(self.table[0]))
+
+        with self.assertRaises(KeyError):
+            self.table.index_of("4")
+
+    def test_labeled_example(self):
+        example = self.table.row("1").labeled_example(mel_frequency_count=64)
+
+        self.assertEqual("eins", example.label)
+        self.assertEqual(Path("/corpus/a/1.flac"), example.audio_file)
+        self.assertEqual(64, example.mel_frequency_count)
+        self.assertEqual(2., example.duration_in_s())
+
+    def test_compact(self):
+        rows = [(Path("/corpus/speaker{}/{:08}.flac".format(index % 10, index)), "hallo welt", "hallo welt",
+                 AudioMetadata(16000, 1, 16000)) for index in range(10000)]
+
+        tracemalloc.start()
+        try:
+            table = CorpusTable(rows)
+            allocated_bytes = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+
+        self.assertLess(allocated_bytes / len(rows), 100)
+        # the estimate misses only small objects like the directory paths:
+        self.assertLess(abs(table.nbytes() - allocated_bytes) / allocated_bytes, .05)
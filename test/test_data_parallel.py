@@ -0,0 +1,119 @@
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import numpy
+from numpy import ndarray
+from typing import List, Tuple
+
+from all_reduce import SharedMemoryAllReduce
+from data_parallel import GradientReplica, DataParallelTrainer, run_processes, flatten, unflatten
+
+feature_count = 5
+world_size = 3
+steps = 12
+batch_size = 4
+
+
+class LinearRegressionReplica(GradientReplica):
+    """Squared loss of a linear model, updated by gradient descent with momentum."""
+
+    def __init__(self, seed: int):
+        random = numpy.random.RandomState(seed)
+        self.weights = [random.normal(size=(feature_count,)).astype(numpy.float32), numpy.zeros((1,), numpy.float32)]
+        self.velocities = [numpy.zeros_like(w) for w in self.weights]
+
+    def get_weights(self) -> List[ndarray]:
+        return [w.copy() for w in self.weights]
+
+    def set_weights(self, weights: List[ndarray]) -> None:
+        self.weights = [w.copy() for w in weights]
+
+    def loss_and_gradients(self, batch: Tuple[ndarray, ndarray]) -> Tuple[float, List[ndarray]]:
+        inputs, targets = batch
+        errors = inputs.dot(self.weights[0]) + self.weights[1][0] - targets
+        return float(numpy.mean(errors ** 2)), [2 * inputs.T.dot(errors) / len(targets),
+                                                numpy.array([2 * numpy.mean(errors)], dtype=numpy.float32)]
+
+    def apply_gradients(self, gradients: List[ndarray]) -> None:
+        self.velocities = [.9 * v + g for v, g in zip(self.velocities, gradients)]
+        self.weights = [w - .01 * v for w, v in zip(self.weights, self.velocities)]
+
+
+def _batches(rank: int, shard_count: int):
+    """Shard of batches of the same data for any number of shards."""
+    random = numpy.random.RandomState(42)
+    inputs = random.normal(size=(steps, world_size * batch_size, feature_count)).astype(numpy.float32)
+    targets = inputs.dot(numpy.arange(feature_count, dtype=numpy.float32)) + 1
+    return [(inputs[step, rank::shard_count], targets[step, rank::shard_count]) for step in range(steps)]
+
+
+def _train_replica(all_reduce: SharedMemoryAllReduce, result_directory: Path) -> None:
+    # each replica starts with different weights, replaced by those of rank 0:
+    replica = LinearRegressionReplica(seed=all_reduce.rank)
+    losses = []
+    DataParallelTrainer(replica, all_reduce).train(_batches(all_reduce.rank, all_reduce.world_size),
+                                                   steps_per_epoch=steps // 2, epochs=2,
+                                                   on_batch_end=losses.append)
+    numpy.save(str(result_directory / "weights{}.npy".format(all_reduce.rank)), flatten(replica.get_weights()))
+    numpy.save(str(result_directory / "losses{}.npy".format(all_reduce.rank)), numpy.array(losses))
+
+
+class FailingReplica(LinearRegressionReplica):
+    def __init__(self, seed: int, failing_step: int):
+        super().__init__(seed)
+        self.failing_step = failing_step
+        self.step = 0
+
+    def loss_and_gradients(self, batch: Tuple[ndarray, ndarray]) -> Tuple[float, List[ndarray]]:
+        if self.step == self.failing_step:
+            raise RuntimeError("Replica failed.")
+        self.step += 1
+        return super().loss_and_gradients(batch)
+
+
+def _train_failing_replica(all_reduce: SharedMemoryAllReduce) -> None:
+    replica = FailingReplica(seed=all_reduce.rank, failing_step=2 if all_reduce.rank == 1 else -1)
+    DataParallelTrainer(replica, all_reduce).train(_batches(all_reduce.rank, all_reduce.world_size),
+                                                   steps_per_epoch=steps, epochs=1)
+
+
+class DataParallelTest(TestCase):
+    def test_replicas_stay_in_sync_and_match_training_on_whole_batches(self):
+        parameter_count = feature_count + 1
+        with TemporaryDirectory() as directory:
+            exit_codes = run_processes(world_size, size=parameter_count + 1, target=_train_replica,
+                                       arguments=(Path(directory),))
+            self.assertEqual([0] * world_size, exit_codes)
+
+            weights_by_rank = [numpy.load(str(Path(directory) / "weights{}.npy".format(rank)))
+                               for rank in range(world_size)]
+            losses_by_rank = [numpy.load(str(Path(directory) / "losses{}.npy".format(rank)))
+                              for rank in range(world_size)]
+
+        for weights, losses in zip(weights_by_rank[1:], losses_by_rank[1:]):
+            numpy.testing.assert_array_equal(weights_by_rank[0], weights)
+            numpy.testing.assert_array_equal(losses_by_rank[0], losses)
+
+        # with equal batch sizes, the mean of the replica gradients is the gradient of the whole batch:
+        single = LinearRegressionReplica(seed=0)
+        for batch in _batches(rank=0, shard_count=1):
+            single.apply_gradients(single.loss_and_gradients(batch)[1])
+        numpy.testing.assert_allclose(flatten(single.get_weights()), weights_by_rank[0], rtol=1e-4, atol=1e-5)
+
+    def test_failing_replica_lets_all_replicas_fail_fast(self):
+        start = time.time()
+
+        exit_codes = run_processes(world_size, size=feature_count + 2, target=_train_failing_replica)
+
+        self.assertTrue(all(exit_code != 0 for exit_code in exit_codes))
+        self.assertLess(time.time() - start, 60)
+
+    def test_flatten_and_unflatten(self):
+        arrays = [numpy.ones((2, 3), dtype=numpy.float32), numpy.arange(4, dtype=numpy.float32)]
+
+        restored = unflatten(flatten(arrays), like=arrays)
+
+        for array, restored_array in zip(arrays, restored):
+            numpy.testing.assert_array_equal(array, restored_array)
@@ -0,0 +1,53 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import numpy
+import soundfile
+
+from dtype_policy import DtypePolicy
+from labeled_example import LabeledExample
+from spectrogram_batch import CachedLabeledSpectrogram, input_batch_and_prediction_lengths
+from test.stubs import StubExample
+
+
+class DtypePolicyTest(TestCase):
+    def test_rejects_integer_types(self):
+        with self.assertRaises(ValueError):
+            DtypePolicy(storage_dtype='int16')
+
+    def test_labeled_example_spectrogram_has_compute_type(self):
+        with TemporaryDirectory() as directory:
+            audio_file = Path(directory) / "example.wav"
+            soundfile.write(str(audio_file), numpy.random.RandomState(0).uniform(-.5, .5, 16000), samplerate=16000)
+
+            spectrogram = LabeledExample(audio_file).z_normalized_transposed_spectrogram()
+
+        self.assertEqual(numpy.float32, spectrogram.dtype)
+        self.assertEqual(128, spectrogram.shape[1])
+
+    def test_cache_stores_storage_type_and_returns_compute_type(self):
+        computed = numpy.random.RandomState(0).normal(size=(50, 8))
+        with TemporaryDirectory() as directory:
+            cached = CachedLabeledSpectrogram(StubExample("example"), spectrogram_cache_directory=Path(directory),
+                                              spectrogram_from_example=lambda example: computed,
+                                              dtype_policy=DtypePolicy(storage_dtype='float16'))
+
+            calculated = cached.spectrogram()
+            self.assertEqual(numpy.float16, numpy.load(str(cached.spectrogram_cache_file)).dtype)
+            loaded = cached.spectrogram()
+
+        self.assertEqual(numpy.float32, calculated.dtype)
+        self.assertEqual(numpy.float32, loaded.dtype)
+        numpy.testing.assert_array_equal(calculated, loaded)
+        numpy.testing.assert_allclose(computed, loaded, atol=1e-2)
+
+    def test_padded_batch_has_compute_type(self):
+        spectrograms = [numpy.ones((3, 4), dtype=numpy.float16), numpy.ones((5, 4))]
+
+        input_batch, prediction_lengths = input_batch_and_prediction_lengths(spectrograms,
+                                                                             input_to_prediction_length_ratio=2)
+
+        self.assertEqual(numpy.float32, input_batch.dtype)
+        self.assertEqual((2, 5, 4), input_batch.shape)
+        self.assertEqual([1, 2], prediction_lengths)
@@ -0,0 +1,79 @@
+import multiprocessing
+from itertools import islice
+from unittest import TestCase
+
+from typing import List
+
+from checkpoints import Checkpoint
+from epoch_sampler import EpochSampler
+
+example_count = 103
+batch_size = 4
+world_size = 3
+
+
+def _batches_of_rank(rank: int) -> List[List[int]]:
+    """Two epochs of batches, drawn in a separate process standing in for a node."""
+    sampler = EpochSampler(example_count, batch_size=batch_size, seed=7, rank=rank, world_size=world_size)
+    return list(islice(sampler.index_batches(), 2 * sampler.batches_per_epoch))
+
+
+class EpochSamplerTest(TestCase):
+    def test_shards_of_processes_do_not_overlap(self):
+        with multiprocessing.get_context("spawn").Pool(processes=world_size) as pool:
+            batches_by_rank = pool.map(_batches_of_rank, range(world_size))
+
+        batches_per_epoch = example_count // world_size // batch_size
+        for epoch in range(2):
+            epoch_batches_by_rank = [batches[epoch * batches_per_epoch:(epoch + 1) * batches_per_epoch]
+                                     for batches in batches_by_rank]
+            indices_by_rank = [[index for batch in batches for index in batch] for batches in epoch_batches_by_rank]
+
+            self.assertEqual([batches_per_epoch * batch_size] * world_size, [len(i) for i in indices_by_rank])
+            all_indices = [index for indices in indices_by_rank for index in indices]
+            self.assertEqual(len(all_indices), len(set(all_indices)))
+
+        self.assertNotEqual(batches_by_rank[0][:batches_per_epoch], batches_by_rank[0][batches_per_epoch:])
+        self.assertEqual(_batches_of_rank(1), batches_by_rank[1])
+
+    def test_each_example_once_per_epoch_on_a_single_worker(self):
+        sampler = EpochSampler(12, batch_size=4, seed=1)
+        indices = [index for batch in islice(sampler.index_batches(), 3) for index in batch]
+
+        self.assertEqual(list(range(12)), sorted(indices))
+
+    def test_permutes_once_per_epoch(self):
+        class CountingEpochSampler(EpochSampler):
+            shard_count = 0
+
+            def shard(self, epoch: int):
+                self.shard_count += 1
+                return super().shard(epoch)
+
+        sampler = CountingEpochSampler(example_count, batch_size=batch_size, seed=7)
+        batches = list(islice(sampler.index_batches(), 3 * sampler.batches_per_epoch))
+
+        self.assertEqual(3, sampler.shard_count)
+        self.assertEqual([sampler.shard(1)[:batch_size].tolist()], batches[sampler.batches_per_epoch:][:1])
+        self.assertEqual(batches[5], sampler.batch(5))
+
+    def test_resumes_mid_epoch_from_checkpoint(self):
+        uninterrupted = EpochSampler(example_count, batch_size=batch_size, seed=3, rank=1, world_size=world_size)
+        expected = list(islice(uninterrupted.index_batches(), 20))
+
+        interrupted = EpochSampler(example_count, batch_size=batch_size, seed=3, rank=1, world_size=world_size)
+        for _ in range(5):
+            interrupted.batch_trained()
+        checkpoint = Checkpoint.from_dict(Checkpoint(epoch=1, file_name="weights-epoch1.h5",
+                                                     sampler_state=interrupted.state_dict()).as_dict())
+
+        resumed = EpochSampler(example_count, batch_size=batch_size, seed=3, rank=1, world_size=world_size)
+        resumed.load_state_dict(checkpoint.sampler_state)
+
+        self.assertEqual(expected[5:], list(islice(resumed.index_batches(), 15)))
+
+    def test_rejects_state_of_different_configuration(self):
+        state = EpochSampler(example_count, batch_size=batch_size, world_size=2).state_dict()
+
+        with self.assertRaises(ValueError):
+            EpochSampler(example_count, batch_size=batch_size, world_size=3).load_state_dict(state)
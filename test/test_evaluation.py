@@ -0,0 +1,69 @@
+import itertools
+import random
+from unittest import TestCase
+
+import numpy
+
+from evaluation import edit_distances, ctc_losses, Evaluator, EvaluationReport
+from grapheme_enconding import CtcGraphemeEncoding
+
+
+def edit_distance(hypothesis, reference) -> int:
+    previous_row = list(range(len(hypothesis) + 1))
+    for i, reference_token in enumerate(reference):
+        row = [i + 1]
+        for j, hypothesis_token in enumerate(hypothesis):
+            row.append(min(previous_row[j + 1] + 1, row[j] + 1, previous_row[j] + (reference_token != hypothesis_token)))
+        previous_row = row
+    return previous_row[-1]
+
+
+def brute_force_ctc_loss(probabilities: numpy.ndarray, label, blank: int) -> float:
+    normalized = (probabilities + 1e-8) / (probabilities + 1e-8).sum(axis=1, keepdims=True)
+    total = 0.
+    for path in itertools.product(range(probabilities.shape[1]), repeat=probabilities.shape[0]):
+        collapsed = [grapheme for grapheme, _ in itertools.groupby(path) if grapheme != blank]
+        if collapsed == list(label):
+            total += numpy.prod([normalized[time, grapheme] for time, grapheme in enumerate(path)])
+    return -numpy.log(total)
+
+
+class EvaluationTest(TestCase):
+    def test_edit_distances(self):
+        random.seed(42)
+        references = ["".join(random.choice("abc ") for _ in range(random.randint(0, 12))) for _ in range(200)]
+        hypotheses = ["".join(random.choice("abc ") for _ in range(random.randint(0, 12))) for _ in range(200)]
+
+        self.assertEqual([edit_distance(h, r) for h, r in zip(hypotheses, references)],
+                         list(edit_distances(hypotheses, references)))
+        self.assertEqual([1, 0], list(edit_distances([["the", "cat"], []], [["the", "hat"], []])))
+
+    def test_ctc_losses_match_brute_force(self):
+        random_state = numpy.random.RandomState(42)
+        blank = 3
+        prediction_batch = random_state.dirichlet(numpy.ones(4), size=(3, 5))
+        labels = [[0, 1], [2, 2], []]
+        prediction_lengths = [5, 4, 3]
+
+        losses = ctc_losses(prediction_batch, prediction_lengths, labels, blank=blank)
+
+        for index, (label, length) in enumerate(zip(labels, prediction_lengths)):
+            self.assertAlmostEqual(brute_force_ctc_loss(prediction_batch[index, :length], label, blank=blank),
+                                   losses[index])
+
+    def test_evaluator(self):
+        encoding = CtcGraphemeEncoding()
+        prediction_batch = numpy.full((2, 4, encoding.grapheme_set_size), .001)
+        for index, character in enumerate("ab c"):
+            prediction_batch[0, index, encoding.encode_character(character)] = 1
+        for index, character in enumerate("ab b"):
+            prediction_batch[1, index, encoding.encode_character(character)] = 1
+
+        report = EvaluationReport(
+            Evaluator(encoding).evaluate_batch(prediction_batch, prediction_lengths=[4, 4], labels=["ab c", "ab c"]))
+
+        self.assertEqual(["ab c", "ab b"], [e.predicted for e in report.example_evaluations])
+        self.assertEqual(1 / 8, report.character_error_rate)
+        self.assertEqual(1 / 4, report.word_error_rate)
+        self.assertLess(report.example_evaluations[0].loss, report.example_evaluations[1].loss)
+        self.assertIn("2 examples", str(report))
@@ -0,0 +1,76 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import numpy
+
+from feature_transforms import Mfcc, Deltas, StackedFrames, FeaturePipeline, dct_matrix
+from instrumentation import metrics
+from spectrogram_batch import LabeledSpectrogramBatchGenerator, DerivedLabeledSpectrogram
+from test.stubs import StubExample, SeededSpectrogram
+
+
+class FeatureTransformsTest(TestCase):
+    def test_dct_matrix_is_orthonormal(self):
+        matrix = dct_matrix(8, 8)
+        self.assertTrue(numpy.allclose(numpy.eye(8), matrix.T.dot(matrix)))
+
+    def test_mfcc_matches_scipy_dct(self):
+        from scipy.fftpack import dct
+
+        features = numpy.random.RandomState(0).randn(20, 16)
+        self.assertTrue(numpy.allclose(dct(features, type=2, norm='ortho', axis=1)[:, :5], Mfcc(5).apply(features)))
+
+    def test_deltas_of_linear_ramp(self):
+        ramp = numpy.arange(20, dtype=numpy.float64)[:, None] * numpy.array([[1., 2.]])
+        features = Deltas(order=2, width=5).apply(ramp)
+
+        self.assertEqual((20, 6), features.shape)
+        self.assertTrue(numpy.allclose(features[2:-2, 2:4], [[1., 2.]]))
+        self.assertTrue(numpy.allclose(features[4:-4, 4:6], 0))
+
+    def test_stacked_frames(self):
+        features = numpy.arange(7)[:, None] * numpy.array([[1, 10]])
+        stacked = StackedFrames(frame_count=2, subsampling=3).apply(features)
+
+        self.assertEqual([[0, 0, 1, 10], [3, 30, 4, 40], [6, 60, 6, 60]], stacked.tolist())
+        self.assertEqual(3, FeaturePipeline([Mfcc(), StackedFrames()]).time_step_reduction())
+
+    def test_generator_reports_time_step_reduction(self):
+        with TemporaryDirectory() as directory:
+            def generator(feature_transform=None):
+                return LabeledSpectrogramBatchGenerator([StubExample("1")], Path(directory),
+                                                        spectrogram_from_example=SeededSpectrogram(),
+                                                        feature_transform=feature_transform)
+
+            self.assertEqual(1, generator().time_step_reduction)
+            stacked = generator(FeaturePipeline([Mfcc(4), StackedFrames(subsampling=3)]))
+            self.assertEqual(3, stacked.time_step_reduction)
+            self.assertEqual(17, stacked.labeled_spectrograms[0].spectrogram().shape[0])
+
+    def test_derived_features_are_cached_under_their_key(self):
+        transform = FeaturePipeline([Mfcc(4), Deltas(order=1)])
+        base_spectrogram = SeededSpectrogram()
+        with TemporaryDirectory() as directory:
+            def generator():
+                return LabeledSpectrogramBatchGenerator([StubExample("1"), StubExample("2")], Path(directory),
+                                                        spectrogram_from_example=base_spectrogram,
+                                                        feature_transform=transform)
+
+            features = [x.spectrogram() for x in generator().labeled_spectrograms]
+            self.assertEqual(2, base_spectrogram.calculation_count)
+            self.assertEqual((50, 8), features[0].shape)
+            self.assertTrue(numpy.allclose(transform.apply(base_spectrogram(StubExample("1"))), features[0],
+                                           atol=1e-5))
+            self.assertTrue(Path(directory, "derived", "mfcc4-deltas1w9", "1.npy").exists())
+
+            metrics.enable()
+            metrics.reset()
+            try:
+                derived = generator().labeled_spectrograms[1]
+                self.assertIsInstance(derived, DerivedLabeledSpectrogram)
+                self.assertTrue(numpy.array_equal(features[1], derived.spectrogram()))
+                self.assertEqual(1, metrics.snapshot()["counters"]["derived_feature_cache_hits"])
+                self.assertNotIn("spectrogram_cache_hits", metrics.snapshot()["counters"])
+            finally:
+                metrics.disable()
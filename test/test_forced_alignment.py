@@ -0,0 +1,69 @@
+from itertools import groupby, product
+from unittest import TestCase
+
+import numpy
+
+from forced_alignment import CtcForcedAligner
+from grapheme_enconding import CtcGraphemeEncoding
+
+encoding = CtcGraphemeEncoding(allowed_characters=list("ab "))
+
+
+def _best_path_log_probability(predictions: numpy.ndarray, label: str) -> float:
+    """By enumerating all paths."""
+    encoded = encoding.encode(label)
+    best = -numpy.inf
+    for path in product(range(encoding.grapheme_set_size), repeat=predictions.shape[0]):
+        if [g for g, _ in groupby(path) if g != encoding.ctc_blank] == encoded:
+            best = max(best, float(numpy.sum(numpy.log(predictions[numpy.arange(len(path)), path]))))
+
+    return best
+
+
+def _random_predictions(random: numpy.random.RandomState, frame_count: int) -> numpy.ndarray:
+    weights = random.random_sample((frame_count, encoding.grapheme_set_size))
+    return weights / weights.sum(axis=1, keepdims=True)
+
+
+class CtcForcedAlignerTest(TestCase):
+    def setUp(self):
+        self.aligner = CtcForcedAligner(encoding, input_to_prediction_length_ratio=2, hop_length=160,
+                                        sample_rate=16000)
+
+    def test_matches_exhaustive_search_in_padded_batch(self):
+        random = numpy.random.RandomState(0)
+        labels = ["ab", "aa", "a b", "", "b"]
+        lengths = [6, 5, 6, 3, 4]
+        prediction_batch = numpy.zeros((len(labels), 6, encoding.grapheme_set_size))
+        for index, length in enumerate(lengths):
+            prediction_batch[index, :length] = _random_predictions(random, length)
+
+        alignments = self.aligner.align_batch(prediction_batch, lengths, labels)
+
+        for alignment, predictions, length, label in zip(alignments, prediction_batch, lengths, labels):
+            self.assertAlmostEqual(_best_path_log_probability(predictions[:length], label),
+                                   alignment.log_probability)
+            self.assertEqual(label, "".join(span.character for span in alignment.character_spans))
+
+    def test_spans_in_frames_and_seconds(self):
+        a, b, space, blank = range(4)
+        path = [blank, a, a, blank, space, b, b, b, blank, a]
+        predictions = numpy.full((len(path), 4), .01)
+        predictions[numpy.arange(len(path)), path] = .97
+
+        alignment = self.aligner.align(predictions, "a ba")
+
+        self.assertEqual([(1, 3), (4, 5), (5, 8), (9, 10)],
+                         [(s.start_frame, s.end_frame) for s in alignment.character_spans])
+        self.assertEqual(["a", "ba"], [w.word for w in alignment.word_spans])
+        self.assertAlmostEqual(.02, alignment.character_spans[0].start_in_s)
+        self.assertAlmostEqual(.10, alignment.word_spans[1].start_in_s)
+        self.assertAlmostEqual(.20, alignment.word_spans[1].end_in_s)
+
+    def test_impossible_label(self):
+        predictions = _random_predictions(numpy.random.RandomState(1), 2)
+
+        alignment = self.aligner.align(predictions, "aa")
+
+        self.assertFalse(alignment.is_possible)
+        self.assertEqual([], alignment.word_spans)
@@ -0,0 +1,41 @@
+import json
+from unittest import TestCase
+
+from instrumentation import Metrics
+
+
+class MetricsTest(TestCase):
+    def test_disabled_records_nothing(self):
+        metrics = Metrics(enabled=False)
+        metrics.count("hits")
+        with metrics.timed("stft"):
+            pass
+
+        self.assertEqual({"counters": {}, "histograms": {}}, metrics.snapshot())
+
+    def test_enabled(self):
+        metrics = Metrics(enabled=True, bucket_bounds=[.1, 1.])
+        metrics.count("hits")
+        metrics.count("bytes_read", 100)
+        metrics.count("bytes_read", 50)
+        for duration_in_s in [.05, .5, .5, 3.]:
+            metrics.observe("stft", duration_in_s)
+        with metrics.timed("padding"):
+            pass
+
+        snapshot = json.loads(metrics.to_json())
+        self.assertEqual({"hits": 1, "bytes_read": 150}, snapshot["counters"])
+        self.assertEqual(4, snapshot["histograms"]["stft"]["count"])
+        self.assertEqual(1., snapshot["histograms"]["stft"]["p50_s"])
+        self.assertEqual(3., snapshot["histograms"]["stft"]["max_s"])
+        self.assertEqual(1, snapshot["histograms"]["padding"]["count"])
+
+        text = metrics.to_prometheus_text()
+        self.assertIn("speechless_hits_total 1", text)
+        self.assertIn('speechless_stft_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('speechless_stft_seconds_bucket{le="1"} 3', text)
+        self.assertIn('speechless_stft_seconds_bucket{le="+Inf"} 4', text)
+        self.assertIn("speechless_stft_seconds_count 4", text)
+
+        metrics.reset()
+        self.assertEqual({"counters": {}, "histograms": {}}, metrics.snapshot())
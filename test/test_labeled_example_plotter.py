@@ -0,0 +1,47 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import numpy
+
+from labeled_example import LabeledExample, SpectrogramFrequencyScale
+from labeled_example_plotter import LabeledExamplePlotter, render_spectrogram_gallery, downsampled
+from spectrogram_batch import CachedLabeledSpectrogram
+from test.stubs import StubExample, SeededSpectrogram
+
+
+class LabeledExamplePlotterTest(TestCase):
+    def test_render_gallery_in_processes(self):
+        with TemporaryDirectory() as directory:
+            Path(directory, "cache").mkdir()
+            spectrogram = SeededSpectrogram(frame_count=1000, frequency_count=128)
+            labeled_spectrograms = [CachedLabeledSpectrogram(StubExample(str(index)), Path(directory, "cache"),
+                                                             spectrogram_from_example=spectrogram)
+                                    for index in range(6)]
+            labeled_spectrograms[0].spectrogram()
+
+            paths = render_spectrogram_gallery(labeled_spectrograms, Path(directory, "gallery"), process_count=2,
+                                               size_in_inches=(3.2, 2.4), dpi=50, max_time_step_count=100)
+
+            self.assertEqual([Path(directory, "gallery", "{}.png".format(index)) for index in range(6)], paths)
+            import matplotlib.image
+            self.assertEqual((120, 160), matplotlib.image.imread(str(paths[5])).shape[:2])
+            self.assertTrue(all(x.spectrogram_cache_file.exists() for x in labeled_spectrograms))
+
+    def test_downsampled(self):
+        spectrogram = numpy.arange(10, dtype=numpy.float32)[:, None] * numpy.ones((1, 2))
+
+        self.assertEqual([[1, 1], [4, 4], [7, 7], [9, 9]], downsampled(spectrogram, 4).tolist())
+        self.assertIs(spectrogram, downsampled(spectrogram, 10))
+
+    def test_save_spectrogram_leaves_no_pyplot_figures(self):
+        import matplotlib.pyplot as plt
+
+        example = LabeledExample(Path("example.wav"))
+        example.raw_audio = numpy.sin(numpy.arange(8000) * .1).astype(numpy.float32)
+        with TemporaryDirectory() as directory:
+            path = LabeledExamplePlotter(example).save_spectrogram(Path(directory),
+                                                                   frequency_scale=SpectrogramFrequencyScale.mel)
+
+            self.assertTrue(path.exists())
+            self.assertEqual([], plt.get_fignums())
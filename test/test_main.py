@@ -0,0 +1,67 @@
+import os
+import subprocess
+import sys
+import tempfile
+import wave
+from pathlib import Path
+from unittest import TestCase
+
+heavy_modules = ["librosa", "keras", "matplotlib", "tensorflow"]
+
+
+def create_english_corpus(home_directory: Path, example_count: int) -> None:
+    # unpacked like the LibriSpeech archive, into a directory of the corpus name:
+    chapter_directory = home_directory / "speechless-data" / "corpus" / "English" / "dev-clean" / "dev-clean" / "84" / \
+                        "121123"
+    chapter_directory.mkdir(parents=True)
+    ids = ["84-121123-{:04d}".format(index) for index in range(example_count)]
+    for id in ids:
+        with wave.open(str(chapter_directory / "{}.wav".format(id)), "wb") as wave_file:
+            wave_file.setnchannels(1)
+            wave_file.setsampwidth(2)
+            wave_file.setframerate(16000)
+            wave_file.writeframes(b"\1\0" * 16000)
+
+    (chapter_directory / "84-121123.trans.txt").write_text("".join("{} A\n".format(id) for id in ids))
+
+
+def run_main(arguments: list, home_directory: Path) -> subprocess.CompletedProcess:
+    environment = dict(os.environ, HOME=str(home_directory))
+    return subprocess.run([sys.executable, "main.py"] + arguments, cwd=str(Path(__file__).parent.parent),
+                          env=environment, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=600)
+
+
+class MainTest(TestCase):
+    def test_metadata_commands_do_not_import_heavy_modules(self):
+        code = "import sys, main, corpus_provider, german_corpus_provider, corpus_preparation; " \
+               "print(','.join(m for m in {} if m in sys.modules))".format(heavy_modules)
+        output = subprocess.check_output([sys.executable, "-c", code], cwd=str(Path(__file__).parent.parent))
+
+        self.assertEqual("", output.decode().strip())
+
+    def test_help(self):
+        output = subprocess.check_output([sys.executable, "main.py", "--help"], cwd=str(Path(__file__).parent.parent))
+
+        for command in ["train", "validate", "predict", "summarize", "precompute"]:
+            self.assertIn(command, output.decode())
+
+    def test_data_parallel_training_gives_each_replica_a_batch(self):
+        with tempfile.TemporaryDirectory() as directory:
+            create_english_corpus(Path(directory), example_count=6)
+
+            output = run_main(["train", "--processes", "2", "--epochs", "1", "--epoch-size", "1"],
+                              home_directory=Path(directory)).stdout.decode()
+
+            self.assertNotIn("not enough for a batch", output)
+            self.assertNotIn("Cannot train on", output)
+
+    def test_data_parallel_training_fails_up_front_without_enough_examples(self):
+        with tempfile.TemporaryDirectory() as directory:
+            create_english_corpus(Path(directory), example_count=3)
+
+            result = run_main(["train", "--processes", "2"], home_directory=Path(directory))
+
+            self.assertNotEqual(0, result.returncode)
+            self.assertIn("Cannot train on 2 processes: 2 examples are not enough for a batch of 2 on each of 2 "
+                          "workers.", result.stdout.decode())
+            self.assertNotIn("replica-", result.stdout.decode())
@@ -0,0 +1,25 @@
+from unittest import TestCase
+
+from net_architecture import wav2letter_convolutions, trainable_parameter_count
+
+
+class NetArchitectureTest(TestCase):
+    def test_trainable_parameter_count(self):
+        convolutions = wav2letter_convolutions(grapheme_set_size=30)
+        striding_count = 48 * 128 * 250 + 250
+        count = striding_count + 7 * (7 * 250 * 250 + 250) + 32 * 250 * 2000 + 2000 + 2000 * 2000 + 2000 + \
+                2000 * 30 + 30
+
+        self.assertEqual(count, trainable_parameter_count(convolutions, input_size_per_time_step=128))
+        self.assertEqual(count - striding_count,
+                         trainable_parameter_count(convolutions, input_size_per_time_step=128, frozen_layer_count=1))
+
+    def test_frozen_layers_include_dropout_layers(self):
+        convolutions = wav2letter_convolutions(grapheme_set_size=30)
+        count = trainable_parameter_count(convolutions, input_size_per_time_step=128, use_dropout=True)
+
+        self.assertEqual(count, trainable_parameter_count(convolutions, input_size_per_time_step=128,
+                                                          use_dropout=True, frozen_layer_count=1))
+        self.assertEqual(count - (48 * 128 * 250 + 250),
+                         trainable_parameter_count(convolutions, input_size_per_time_step=128, use_dropout=True,
+                                                   frozen_layer_count=2))
@@ -0,0 +1,60 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+import numpy
+import soundfile
+from scipy.signal import resample_poly
+
+from labeled_example import LabeledExample
+from pcm_cache import PolyphaseResampler, PcmCache
+
+
+def sine(sample_rate: int, duration_in_s: float, frequency: float = 440.) -> numpy.ndarray:
+    return .5 * numpy.sin(2 * numpy.pi * frequency * numpy.arange(int(sample_rate * duration_in_s)) / sample_rate)
+
+
+class PolyphaseResamplerTest(TestCase):
+    def test_equals_resample_poly(self):
+        audio = sine(44100, .3)
+        resampled = PolyphaseResampler().resample(audio, source_rate=44100, target_rate=16000)
+
+        self.assertTrue(numpy.allclose(resample_poly(audio, 160, 441), resampled))
+
+    def test_batch_equals_single(self):
+        resampler = PolyphaseResampler()
+        audios = [sine(48000, .1), sine(48000, .25, frequency=1000)]
+
+        for single, batched in zip([resampler.resample(a, 48000, 16000) for a in audios],
+                                   resampler.resample_batch(audios, 48000, 16000)):
+            self.assertEqual(single.shape, batched.shape)
+            self.assertTrue(numpy.allclose(single, batched))
+
+
+class PcmCacheTest(TestCase):
+    def test_caches_resampled_int16(self):
+        with tempfile.TemporaryDirectory() as directory:
+            audio_file = Path(directory) / "a.flac"
+            soundfile.write(str(audio_file), sine(48000, .5), samplerate=48000)
+            cache = PcmCache(Path(directory) / "pcm-cache")
+
+            example = LabeledExample(audio_file, pcm_cache=cache)
+            audio = example.raw_audio
+
+            self.assertEqual((8000,), audio.shape)
+            self.assertEqual(numpy.float32, audio.dtype)
+            self.assertEqual(numpy.int16, numpy.load(str(cache.cache_file("a"))).dtype)
+
+            audio_file.unlink()
+            self.assertTrue(numpy.array_equal(audio, cache.audio("a", audio_file)))
+
+    def test_fill(self):
+        with tempfile.TemporaryDirectory() as directory:
+            files = [Path(directory) / "{}.wav".format(index) for index in range(3)]
+            for index, file in enumerate(files):
+                soundfile.write(str(file), sine(44100, .1 * (index + 1)), samplerate=44100)
+            cache = PcmCache(Path(directory) / "pcm-cache")
+
+            self.assertEqual(3, cache.fill([(file.stem, file) for file in files], batch_size=2))
+            self.assertEqual(0, cache.fill([(file.stem, file) for file in files]))
+            self.assertEqual(3200, cache.audio("1", files[1]).shape[0])
@@ -0,0 +1,65 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+import numpy
+
+from evaluation import Evaluator
+from grapheme_enconding import CtcGraphemeEncoding
+from posterior_cache import PosteriorCache
+
+
+class PosteriorCacheTest(TestCase):
+    def test_store_and_evaluate(self):
+        encoding = CtcGraphemeEncoding()
+        prediction_batch = numpy.random.RandomState(42).dirichlet(numpy.ones(encoding.grapheme_set_size),
+                                                                   size=(2, 5)).astype(numpy.float32)
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = PosteriorCache(Path(directory))
+            store = cache.store("run/weights-epoch3")
+            store.add_batch(["a", "b"], prediction_batch, prediction_lengths=[5, 3])
+            store.save()
+
+            reopened = cache.store("run/weights-epoch3")
+            self.assertEqual(["a", "b"], reopened.ids())
+            self.assertNotIn("a", cache.store("run/weights-epoch4"))
+            numpy.testing.assert_array_equal(prediction_batch[1, :3], reopened.posteriors("b"))
+
+            stored_batch, lengths = reopened.prediction_batch(["b", "a"])
+            self.assertEqual([3, 5], lengths)
+            self.assertEqual((2, 5, encoding.grapheme_set_size), stored_batch.shape)
+
+            evaluator = Evaluator(encoding)
+            expected = evaluator.evaluate_batch(prediction_batch, prediction_lengths=[5, 3], labels=["ab", "c"])
+            report = evaluator.evaluate_stored(reopened, labels_by_id={"a": "ab", "b": "c"})
+            self.assertEqual([e.as_dict() for e in expected], [e.as_dict() for e in report.example_evaluations])
+
+    def test_interrupted_append_is_discarded(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = PosteriorCache(Path(directory)).store("checkpoint")
+            store.add_batch(["a"], numpy.ones((1, 2, 3)), prediction_lengths=[2])
+            store.save()
+            store.add_batch(["b"], numpy.ones((1, 4, 3)), prediction_lengths=[4])
+
+            reopened = PosteriorCache(Path(directory)).store("checkpoint")
+            reopened.add_batch(["c"], numpy.full((1, 1, 3), 2.), prediction_lengths=[1])
+            reopened.save()
+
+            self.assertEqual(["a", "c"], reopened.ids())
+            numpy.testing.assert_array_equal(numpy.full((1, 3), 2.), reopened.posteriors("c"))
+
+    def test_adding_partly_stored_batch_appends_only_new_examples(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = PosteriorCache(Path(directory)).store("checkpoint")
+            store.add_batch(["a"], numpy.ones((1, 2, 3)), prediction_lengths=[2])
+            store.add_batch(["a", "b"], numpy.full((2, 4, 3), 2.), prediction_lengths=[4, 3])
+            store.save()
+
+            self.assertEqual(2 + 3, store.frame_count)
+            numpy.testing.assert_array_equal(numpy.ones((2, 3)), store.posteriors("a"))
+            numpy.testing.assert_array_equal(numpy.full((3, 3), 2.), store.posteriors("b"))
+
+            batch, lengths = store.prediction_batch([])
+            self.assertEqual((0, 0, 3), batch.shape)
+            self.assertEqual([], lengths)
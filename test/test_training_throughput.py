@@ -0,0 +1,54 @@
+import json
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+import numpy
+
+from training_throughput import BatchStatistics, TrainingThroughput, ThroughputLog
+
+
+class TrainingThroughputTest(TestCase):
+    def test_batch_statistics(self):
+        statistics = BatchStatistics.from_spectrograms([numpy.zeros((3, 5)), numpy.zeros((1, 5))])
+
+        self.assertEqual(2, statistics.example_count)
+        self.assertEqual(4, statistics.frame_count)
+        self.assertEqual(6, statistics.padded_frame_count)
+        self.assertAlmostEqual(2 / 3, statistics.padding_ratio)
+
+    def test_throughput(self):
+        throughput = TrainingThroughput(seconds_per_frame=.5)
+        throughput.batch_prepared(BatchStatistics(example_count=2, frame_count=4, padded_frame_count=8))
+        throughput.batch_prepared(BatchStatistics(example_count=2, frame_count=6, padded_frame_count=8))
+
+        throughput.batch_begin(now=0.)
+        first = throughput.batch_end(now=1.)
+        throughput.batch_begin(now=2.)
+        second = throughput.batch_end(now=3.)
+
+        self.assertEqual(2., first["samples_per_s"])
+        self.assertEqual(2., first["audio_s_per_s"])
+        self.assertEqual(0., first["generator_wait_s"])
+        self.assertEqual(.5, first["padding_ratio"])
+        self.assertEqual(1., second["generator_wait_s"])
+        self.assertEqual(1., second["compute_s"])
+        self.assertEqual(.5, second["generator_wait_fraction"])
+
+        epoch = throughput.epoch_end()
+        self.assertEqual(4 / 3, epoch["samples_per_s"])
+        self.assertEqual(10 / 16, epoch["padding_ratio"])
+        self.assertIsNone(throughput.epoch_end())
+
+    def test_step_without_prepared_batch(self):
+        throughput = TrainingThroughput()
+        throughput.batch_begin(now=0.)
+        self.assertIsNone(throughput.batch_end(now=1.))
+
+    def test_log(self):
+        with tempfile.TemporaryDirectory() as directory:
+            log = ThroughputLog(Path(directory) / "run", use_tensorflow=False)
+            log.write("batch", {"padding_ratio": .5}, step=3)
+
+            lines = log.json_file.read_text(encoding='utf8').splitlines()
+            self.assertEqual([{"padding_ratio": .5, "tag": "batch", "step": 3}], [json.loads(l) for l in lines])
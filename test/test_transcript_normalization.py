@@ -0,0 +1,56 @@
+import random
+from functools import reduce
+from unittest import TestCase
+
+from german_corpus_provider import UmlautDecoder, _clarin_normalizer, _voxforge_normalizer, _tags_to_ignore
+from transcript_normalization import TranscriptNormalizer
+
+
+def random_texts(alphabet: str, count: int = 3000, max_length: int = 20):
+    random.seed(42)
+    return ["".join(random.choice(alphabet) for _ in range(random.randint(0, max_length))) for _ in range(count)]
+
+
+class TranscriptNormalizerTest(TestCase):
+    def assertMatchesSequential(self, normalizer: TranscriptNormalizer, alphabet: str):
+        texts = random_texts(alphabet)
+        expected = [reduce(lambda text, replacement: text.replace(*replacement), normalizer.replacements,
+                           text.lower() if normalizer.lowercase else text) for text in texts]
+
+        self.assertEqual(expected, [normalizer(text) for text in texts])
+        self.assertEqual(expected, normalizer.normalize_all(texts))
+
+    def test_clarin_matches_previous_implementation(self):
+        def previous(text: str) -> str:
+            text = text.lower().replace('é', 'e').replace('xe4', 'ä').replace('.', ' ').replace('-', ' ')
+            text = text.replace('\\"a', 'ä').replace('\\"o', 'ö').replace('\\"u', 'ü').replace('\\"s', 'ß'). \
+                replace('"a', 'ä').replace('"o', 'ö').replace('"u', 'ü').replace('"s', 'ß')
+            return text.replace('a\\"', 'ä').replace('o\\"', 'ö').replace('u\\"', 'ü').replace('s\\"', 'ß'). \
+                replace('a"', 'ä').replace('o"', 'ö').replace('u"', 'ü').replace('s"', 'ß')
+
+        normalizer = _clarin_normalizer.then(UmlautDecoder.try_quote_before_umlaut_then_after)
+        texts = random_texts('xXe4éÉ.-"\\aous ')
+
+        self.assertEqual([previous(text) for text in texts], normalizer.normalize_all(texts))
+        self.assertEqual([previous(text) for text in texts], [normalizer(text) for text in texts])
+
+    def test_voxforge(self):
+        normalizer = _clarin_normalizer.then(UmlautDecoder.none).then(_voxforge_normalizer)
+        self.assertEqual("co zwei in setubal", normalizer("CO2 in Setúbal"))
+        self.assertMatchesSequential(_voxforge_normalizer, "co2 xe4é.-țšęł")
+
+    def test_tag_removal_matches_previous_implementation(self):
+        normalizer = TranscriptNormalizer.removing(_tags_to_ignore)
+        texts = random_texts("<>%*$~#garbehmusäh ")
+        texts += ["<h<äh>m> ok", "#gar<a>bage#garbage#", "<ä<hm>h>"]
+
+        self.assertEqual([reduce(lambda text, tag: text.replace(tag, ""), _tags_to_ignore, text) for text in texts],
+                         normalizer.normalize_all(texts))
+
+    def test_lowercase_in_between(self):
+        normalizer = TranscriptNormalizer([("A", "B")]).then(TranscriptNormalizer([("b", "c")], lowercase=True))
+        self.assertEqual(["c", "ac"], normalizer.normalize_all(["A", "aB"]))
+
+    def test_overlapping_patterns(self):
+        self.assertMatchesSequential(TranscriptNormalizer([("bc", "x"), ("ab", "y"), ("b", "")]), "abc")
+        self.assertMatchesSequential(TranscriptNormalizer([("ab", ""), ("aabb", "z"), ("a", "b")]), "ab")
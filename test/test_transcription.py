@@ -0,0 +1,98 @@
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from unittest import TestCase
+
+import numpy
+
+from transcription import Transcriber, transcribe_to_jsonl, completed_files, audio_files_from_arguments, \
+    run_pipeline, Stage, PipelineStageException, wav2letter_transcriber
+
+
+def write_tone(path: Path, duration_in_s: float, sample_rate: int = 16000) -> None:
+    import soundfile
+
+    t = numpy.arange(int(duration_in_s * sample_rate)) / sample_rate
+    soundfile.write(str(path), (.1 * numpy.sin(2 * numpy.pi * 440 * t)).astype(numpy.float32), sample_rate)
+
+
+def fake_transcriber(inferred_batch_sizes: list) -> Transcriber:
+    def infer(spectrograms):
+        inferred_batch_sizes.append(len(spectrograms))
+        lengths = [s.shape[0] for s in spectrograms]
+        return numpy.zeros((len(spectrograms), max(lengths), 1)), lengths
+
+    return Transcriber(infer=infer,
+                       decode=lambda prediction_batch, lengths: ["{} frames".format(l) for l in lengths],
+                       # one frame per 1000 samples:
+                       spectrogram_from_audio=lambda file, audio: numpy.zeros((audio.shape[0] // 1000, 2)),
+                       batch_size=2, audio_decode_worker_count=3, feature_worker_count=2)
+
+
+class TranscriptionTest(TestCase):
+    def test_transcribe_and_resume(self):
+        with tempfile.TemporaryDirectory() as directory:
+            audio_directory = Path(directory) / "audio"
+            audio_directory.mkdir()
+            for index, duration in enumerate([1., .5, 2., .25, 1.5]):
+                write_tone(audio_directory / "{}.wav".format(index), duration)
+            (audio_directory / "broken.wav").write_bytes(b"no audio")
+            output = Path(directory) / "transcripts.jsonl"
+
+            audio_files = audio_files_from_arguments([audio_directory])
+            self.assertEqual(6, len(audio_files))
+
+            batch_sizes = []
+            self.assertEqual(6, transcribe_to_jsonl(fake_transcriber(batch_sizes), audio_files, output,
+                                                    print_status=False))
+            self.assertEqual(6, sum(batch_sizes) + 1)
+
+            results = dict((Path(r["file"]).name, r) for r in
+                           (json.loads(line) for line in output.read_text(encoding='utf8').splitlines()))
+            self.assertEqual("32 frames", results["2.wav"]["transcript"])
+            self.assertEqual(2., results["2.wav"]["duration_in_s"])
+            self.assertIn("error", results["broken.wav"])
+
+            # simulates a crash while writing a line:
+            content = output.read_text(encoding='utf8')
+            last_line_start = content.rstrip("\n").rfind("\n") + 1
+            output.write_text(content[:last_line_start + 5], encoding='utf8')
+            self.assertEqual(5, len(completed_files(output)))
+
+            self.assertEqual(1, transcribe_to_jsonl(fake_transcriber([]), audio_files, output, print_status=False))
+            self.assertEqual(6, len(output.read_text(encoding='utf8').splitlines()))
+            self.assertEqual(0, transcribe_to_jsonl(fake_transcriber([]), audio_files, output, print_status=False))
+
+            # the same files given by relative paths:
+            working_directory = os.getcwd()
+            os.chdir(directory)
+            try:
+                relative_files = audio_files_from_arguments([Path("audio")])
+                self.assertEqual(0, transcribe_to_jsonl(fake_transcriber([]), relative_files, output,
+                                                        print_status=False))
+            finally:
+                os.chdir(working_directory)
+
+    def test_failing_stage_fails_pipeline(self):
+        def fail_on_three(x: int) -> int:
+            if x == 3:
+                raise RuntimeError("three")
+            return x
+
+        start = time.perf_counter()
+        with self.assertRaises(PipelineStageException) as context:
+            list(run_pipeline(range(100), [Stage("first", lambda x: x, worker_count=2), Stage("failing", fail_on_three),
+                                           Stage("last", lambda x: x, worker_count=3)]))
+
+        self.assertEqual("failing", context.exception.stage_name)
+        self.assertIsInstance(context.exception.cause, RuntimeError)
+        self.assertLess(time.perf_counter() - start, 5)
+
+    def test_transcriber_without_checkpoint_index_requires_epoch(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertRaises(ValueError) as context:
+                wav2letter_transcriber(Path(directory))
+
+        self.assertIn("--epoch", str(context.exception))
@@ -0,0 +1,81 @@
+from itertools import dropwhile
+from pathlib import Path
+from unittest import TestCase
+
+import numpy
+from numpy import flipud
+
+from labeled_example import LabeledExample
+from recording import Recorder
+from voice_activity import FrameEnergyVoiceActivityDetector, trim_samples_below
+
+
+def _trim_silence_by_dropwhile(audio: numpy.ndarray, threshold: float) -> numpy.ndarray:
+    """The former implementation of Recorder._trim_silence."""
+
+    def trim_start(sound: numpy.ndarray) -> numpy.ndarray:
+        return numpy.array(list(dropwhile(lambda x: x < threshold, sound)))
+
+    def trim_end(sound: numpy.ndarray) -> numpy.ndarray:
+        return flipud(trim_start(flipud(sound)))
+
+    return trim_start(trim_end(audio))
+
+
+def _speech_between_silence(random: numpy.random.RandomState, leading: int, speech: int, trailing: int):
+    voiced = numpy.sin(numpy.arange(speech) * .3) * .5 + random.randn(speech) * .05
+    return numpy.concatenate([random.randn(leading) * .001, voiced, random.randn(trailing) * .001]).astype(
+        numpy.float32)
+
+
+class VoiceActivityTest(TestCase):
+    def test_trimming_samples_matches_former_implementation(self):
+        random = numpy.random.RandomState(0)
+        for _ in range(20):
+            audio = _speech_between_silence(random, random.randint(0, 2000), random.randint(1, 3000),
+                                            random.randint(0, 2000))
+            # the former implementation treated loud negative samples as silence:
+            loud = numpy.flatnonzero(numpy.abs(audio) >= .03)
+            audio[loud[0]] = audio[loud[-1]] = .5
+
+            self.assertTrue(numpy.array_equal(_trim_silence_by_dropwhile(audio, .03),
+                                              Recorder()._trim_silence(audio)))
+
+        silence = random.randn(1000).astype(numpy.float32) * .001
+        self.assertEqual(0, len(Recorder()._trim_silence(silence)))
+
+    def test_trimming_samples_keeps_negative_peaks(self):
+        audio = numpy.array([0., -.5, .01, .2, -.4, .01, 0.])
+
+        self.assertEqual([-.5, .01, .2, -.4], trim_samples_below(audio, .03).tolist())
+        self.assertFalse(Recorder()._is_silent(numpy.array([0., -.5, .01])))
+
+    def test_frame_energy_trimming(self):
+        audio = _speech_between_silence(numpy.random.RandomState(1), leading=16000, speech=8000, trailing=4000)
+        detector = FrameEnergyVoiceActivityDetector(frame_length=512, hop_length=128, padding_frame_count=2)
+
+        trimmed = detector.trim(audio)
+
+        frame_energies = [numpy.mean(numpy.square(audio[start:start + 512], dtype=numpy.float64))
+                          for start in range(0, len(audio) - 512 + 128, 128)]
+        self.assertTrue(numpy.allclose(frame_energies, detector.frame_energies(audio)))
+        # the first voiced frame is the first that overlaps the speech by a quarter, minus two for the padding:
+        self.assertEqual(16000 // 128 - 3 - 2, trimmed.removed_leading_frame_count)
+        # the last voiced frame is the last starting within the speech, the last of all frames being partial:
+        self.assertEqual(4000 // 128 - 3 - 2, trimmed.removed_trailing_frame_count)
+        self.assertEqual(detector.frame_count(len(audio)) - detector.frame_count(len(trimmed.audio)),
+                         trimmed.removed_frame_count)
+        self.assertTrue(8000 < len(trimmed.audio) < 8000 + 12 * 128)
+
+    def test_labeled_example_trims_decoded_audio(self):
+        audio = _speech_between_silence(numpy.random.RandomState(2), leading=8000, speech=4000, trailing=8000)
+        example = LabeledExample(Path("example.flac"))
+        example.raw_audio = audio
+
+        trimmed = example.with_voice_activity_detector(FrameEnergyVoiceActivityDetector())
+        trimmed._decoded_audio = lambda: audio
+
+        self.assertTrue(len(trimmed.raw_audio) < 4000 + 12 * 128)
+        self.assertEqual(len(audio), len(example.raw_audio))
+        self.assertGreater(trimmed.removed_silence_frame_count, 100)
+        self.assertEqual(len(trimmed.raw_audio) / 16000, trimmed.duration_in_s())
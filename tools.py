@@ -26,6 +26,14 @@ def read_text(path: Path, encoding=None):
         return f.read()
 
 
+def write_text(path: Path, text: str, encoding=None):
+    """
+    Not Path.write_text for compatibility with Python 3.4.
+    """
+    with path.open('w', encoding=encoding) as f:
+        f.write(text)
+
+
 def mkdir(directory: Path):
     """
     Not Path.mkdir() for compatibility with Python 3.4.
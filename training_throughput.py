@@ -0,0 +1,142 @@
+import json
+import time
+from collections import deque
+from pathlib import Path
+from threading import Lock
+
+from numpy import ndarray
+from typing import List, Dict, Optional
+
+from tools import mkdir
+
+
+class BatchStatistics:
+    def __init__(self, example_count: int, frame_count: int, padded_frame_count: int):
+        self.example_count = example_count
+        self.frame_count = frame_count
+        self.padded_frame_count = padded_frame_count
+
+    @staticmethod
+    def from_spectrograms(spectrograms: List[ndarray]) -> 'BatchStatistics':
+        """For spectrograms of shape (time, frequencies) padded to the longest one, as in the input batch."""
+        input_lengths = [spectrogram.shape[0] for spectrogram in spectrograms]
+        return BatchStatistics(example_count=len(input_lengths), frame_count=sum(input_lengths),
+                               padded_frame_count=len(input_lengths) * max(input_lengths))
+
+    @property
+    def padding_ratio(self) -> float:
+        """Real frames divided by padded frames, 1 if no computation is wasted on padding."""
+        return self.frame_count / self.padded_frame_count
+
+
+class TrainingThroughput:
+    """
+    Relates the batches prepared by the training generator to the training steps that consume them.
+
+    The generator reports each prepared batch via batch_prepared. Since Keras may run the generator in another thread
+    ahead of training, batches are queued and matched to steps in order. Time between the end of one step and the
+    begin of the next is counted as waiting for the generator, time within a step as computation.
+    """
+
+    def __init__(self, seconds_per_frame: float = 128 / 16000):
+        self.seconds_per_frame = seconds_per_frame
+        self._lock = Lock()
+        self._prepared_batches = deque()
+        self._last_batch_end = None  # type: Optional[float]
+        self._batch_begin = None  # type: Optional[float]
+        self._wait_duration = 0.
+        self.reset_epoch()
+
+    def reset_epoch(self) -> None:
+        self.epoch_example_count = 0
+        self.epoch_frame_count = 0
+        self.epoch_padded_frame_count = 0
+        self.epoch_wait_duration = 0.
+        self.epoch_compute_duration = 0.
+
+    def batch_prepared(self, statistics: BatchStatistics) -> None:
+        with self._lock:
+            self._prepared_batches.append(statistics)
+
+    def batch_begin(self, now: float = None) -> None:
+        now = time.perf_counter() if now is None else now
+        self._wait_duration = 0. if self._last_batch_end is None else now - self._last_batch_end
+        self._batch_begin = now
+
+    def batch_end(self, now: float = None) -> Optional[Dict[str, float]]:
+        """
+        :return: Scalars for the finished step, or None if the step was not started via batch_begin or
+        no prepared batch was reported for it.
+        """
+        now = time.perf_counter() if now is None else now
+        self._last_batch_end = now
+        if self._batch_begin is None:
+            return None
+
+        compute_duration = now - self._batch_begin
+        self._batch_begin = None
+        with self._lock:
+            if not self._prepared_batches:
+                return None
+            statistics = self._prepared_batches.popleft()
+
+        self.epoch_example_count += statistics.example_count
+        self.epoch_frame_count += statistics.frame_count
+        self.epoch_padded_frame_count += statistics.padded_frame_count
+        self.epoch_wait_duration += self._wait_duration
+        self.epoch_compute_duration += compute_duration
+
+        return self._scalars(example_count=statistics.example_count, frame_count=statistics.frame_count,
+                             padded_frame_count=statistics.padded_frame_count,
+                             wait_duration=self._wait_duration, compute_duration=compute_duration)
+
+    def epoch_end(self) -> Optional[Dict[str, float]]:
+        if self.epoch_padded_frame_count == 0:
+            return None
+
+        scalars = self._scalars(example_count=self.epoch_example_count, frame_count=self.epoch_frame_count,
+                                padded_frame_count=self.epoch_padded_frame_count,
+                                wait_duration=self.epoch_wait_duration, compute_duration=self.epoch_compute_duration)
+        self.reset_epoch()
+        return scalars
+
+    def _scalars(self, example_count: int, frame_count: int, padded_frame_count: int,
+                 wait_duration: float, compute_duration: float) -> Dict[str, float]:
+        duration = wait_duration + compute_duration
+        return {
+            "samples_per_s": example_count / duration if duration > 0 else 0.,
+            "audio_s_per_s": frame_count * self.seconds_per_frame / duration if duration > 0 else 0.,
+            "generator_wait_s": wait_duration,
+            "compute_s": compute_duration,
+            "generator_wait_fraction": wait_duration / duration if duration > 0 else 0.,
+            "padding_ratio": frame_count / padded_frame_count
+        }
+
+
+class ThroughputLog:
+    """
+    Writes throughput scalars into the TensorBoard log directory, as TensorFlow summaries if TensorFlow is available
+    and additionally as JSON lines in throughput.jsonl.
+    """
+
+    def __init__(self, log_directory: Path, use_tensorflow: bool):
+        self.log_directory = log_directory
+        self.json_file = log_directory / "throughput.jsonl"
+        mkdir(log_directory)
+        self._summary_writer = None
+        if use_tensorflow:
+            import tensorflow
+
+            self._summary_writer = tensorflow.summary.FileWriter(str(log_directory))
+
+    def write(self, tag_prefix: str, scalars: Dict[str, float], step: int) -> None:
+        if self._summary_writer is not None:
+            import tensorflow
+
+            self._summary_writer.add_summary(tensorflow.Summary(value=[
+                tensorflow.Summary.Value(tag="{}/{}".format(tag_prefix, name), simple_value=value)
+                for name, value in sorted(scalars.items())]), step)
+            self._summary_writer.flush()
+
+        with self.json_file.open('a', encoding='utf8') as f:
+            f.write(json.dumps(dict(scalars, tag=tag_prefix, step=step), sort_keys=True) + "\n")
@@ -0,0 +1,86 @@
+import re
+from functools import reduce
+
+from typing import List, Tuple, Iterable
+
+
+class TranscriptNormalizer:
+    """
+    Applies a sequence of text replacements (including removals) with the same result as
+    consecutive str.replace calls, but compiled for labels that mostly need no change:
+    A single combined regex detects whether any pattern occurs at all, and whole corpora are normalized
+    in one pass per replacement over all labels joined together (see normalize_all).
+    Instances are callable, so they can be used wherever a Callable[[str], str] is expected.
+    """
+
+    def __init__(self, replacements: Iterable[Tuple[str, str]] = (), lowercase: bool = False):
+        """
+        :param replacements: Pairs of pattern and replacement, applied in order.
+        :param lowercase: Whether to lowercase the text before applying the replacements.
+        """
+        self.replacements = list(replacements)
+        self.lowercase = lowercase
+
+        for pattern, replacement in self.replacements:
+            if pattern == "":
+                raise ValueError("Empty pattern to replace by '{}'.".format(replacement))
+
+        # Replacements can only create new matches after a first one, so if no pattern occurs, nothing changes:
+        self._any_pattern_regex = re.compile("|".join(re.escape(pattern) for pattern, _ in self.replacements)) \
+            if self.replacements else None
+
+    @staticmethod
+    def removing(texts_to_remove: Iterable[str]) -> 'TranscriptNormalizer':
+        return TranscriptNormalizer((text, "") for text in texts_to_remove)
+
+    def then(self, other: 'TranscriptNormalizer') -> 'TranscriptNormalizer':
+        if other.lowercase or isinstance(other, _ChainedTranscriptNormalizer):
+            return _ChainedTranscriptNormalizer([self, other])
+
+        return TranscriptNormalizer(self.replacements + other.replacements, lowercase=self.lowercase)
+
+    def _replace_all(self, text: str) -> str:
+        return reduce(lambda text, replacement: text.replace(*replacement), self.replacements, text)
+
+    def __call__(self, text: str) -> str:
+        if self.lowercase:
+            text = text.lower()
+
+        if self._any_pattern_regex is None or self._any_pattern_regex.search(text) is None:
+            return text
+
+        return self._replace_all(text)
+
+    def normalize_all(self, texts: List[str], separator: str = "\n") -> List[str]:
+        """
+        Normalizes many texts at once by running each replacement over all of them joined by a separator.
+        Falls back to normalizing one by one if the separator occurs in any text, pattern or replacement.
+        """
+        if any(separator in pattern or separator in replacement for pattern, replacement in self.replacements) or \
+                any(separator in text for text in texts):
+            return [self(text) for text in texts]
+
+        if len(texts) == 0:
+            return []
+
+        normalized = self(separator.join(texts)).split(separator)
+        assert len(normalized) == len(texts)
+        return normalized
+
+
+class _ChainedTranscriptNormalizer(TranscriptNormalizer):
+    """Needed if lowercasing happens in between replacements."""
+
+    def __init__(self, normalizers: List[TranscriptNormalizer]):
+        super().__init__()
+        self.normalizers = normalizers
+
+    def then(self, other: TranscriptNormalizer) -> TranscriptNormalizer:
+        return _ChainedTranscriptNormalizer(self.normalizers + [other])
+
+    def __call__(self, text: str) -> str:
+        return reduce(lambda text, normalizer: normalizer(text), self.normalizers, text)
+
+    def normalize_all(self, texts: List[str], separator: str = "\n") -> List[str]:
+        return reduce(lambda texts, normalizer: normalizer.normalize_all(texts, separator=separator),
+                      self.normalizers, texts)
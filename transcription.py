@@ -0,0 +1,395 @@
+"""
+Transcribes many audio files with a trained net:
+
+    python3 transcription.py ~/recordings --output transcripts.jsonl --net-directory ~/speechless-data/nets/<run>
+
+Audio decoding, feature extraction, inference and grapheme decoding run as overlapping stages,
+each with its own worker threads connected by bounded queues. Files are batched sorted by duration
+to keep padding low. Each result is appended to the JSONL output as soon as it is available;
+running the same command again skips all files already in the output, so a crashed run can be resumed.
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from queue import Queue
+from threading import Thread, Lock
+
+from numpy import ndarray
+from typing import List, Callable, Tuple, Set, Iterable, Optional, Dict
+
+from audio_metadata import read_audio_metadata, AudioMetadataException
+
+audio_file_extensions = [".wav", ".flac", ".mp3", ".ogg", ".m4a"]
+
+_end_of_stream = object()
+
+
+def audio_files_in(directory: Path) -> List[Path]:
+    return sorted(file for file in directory.glob("**/*") if file.suffix.lower() in audio_file_extensions)
+
+
+def audio_files_from_arguments(paths: List[Path]) -> List[Path]:
+    """Directories are searched for audio files, other files are read as lists of audio files, one per line."""
+    result = []
+    for path in paths:
+        if path.is_dir():
+            result += audio_files_in(path)
+        elif path.suffix.lower() in audio_file_extensions:
+            result.append(path)
+        else:
+            with path.open(encoding='utf8') as f:
+                result += [Path(line.strip()) for line in f if line.strip()]
+
+    return result
+
+
+def estimated_duration_in_s(audio_file: Path) -> float:
+    """From the file header if possible, otherwise estimated from the file size as 16 bit audio at 16kHz."""
+    try:
+        return read_audio_metadata(audio_file).duration_in_s
+    except (AudioMetadataException, OSError):
+        return audio_file.stat().st_size / (2 * 16000)
+
+
+def length_sorted_batches(audio_files: List[Path], batch_size: int) -> List[List[Path]]:
+    sorted_files = sorted(audio_files, key=estimated_duration_in_s)
+    return [sorted_files[start:start + batch_size] for start in range(0, len(sorted_files), batch_size)]
+
+
+def completed_files(output_file: Path) -> Set[str]:
+    """
+    Files already transcribed in the JSONL output, as written. An incomplete last line, as left by a crash, is removed.
+    """
+    if not output_file.exists():
+        return set()
+
+    result = set()
+    complete_length = 0
+    with output_file.open('rb') as f:
+        for line in f:
+            try:
+                result.add(json.loads(line.decode('utf8'))["file"])
+                complete_length += len(line)
+            except (ValueError, KeyError):
+                break
+
+    if complete_length < output_file.stat().st_size:
+        with output_file.open('r+b') as f:
+            f.truncate(complete_length)
+
+    return result
+
+
+class TranscriptionItem:
+    def __init__(self, batch_index: int, audio_file: Path):
+        self.batch_index = batch_index
+        self.audio_file = audio_file
+        self.audio = None  # type: Optional[ndarray]
+        self.spectrogram = None  # type: Optional[ndarray]
+        self.transcript = None  # type: Optional[str]
+        self.error = None  # type: Optional[str]
+        self.duration_in_s = 0.
+
+    def as_dict(self) -> dict:
+        result = {"file": str(self.audio_file), "duration_in_s": self.duration_in_s}
+        if self.error is None:
+            result["transcript"] = self.transcript
+        else:
+            result["error"] = self.error
+        return result
+
+
+class TranscriptionBatch:
+    def __init__(self, items: List[TranscriptionItem]):
+        self.items = items
+        self.prediction_batch = None  # type: Optional[ndarray]
+        self.prediction_lengths = None  # type: Optional[List[int]]
+
+    @property
+    def valid_items(self) -> List[TranscriptionItem]:
+        return [item for item in self.items if item.error is None]
+
+
+class Stage:
+    def __init__(self, name: str, function: Callable, worker_count: int = 1):
+        self.name = name
+        self.function = function
+        self.worker_count = worker_count
+
+
+class PipelineStageException(Exception):
+    def __init__(self, stage_name: str, cause: BaseException):
+        super().__init__("Stage {} failed: {}".format(stage_name, cause))
+        self.stage_name = stage_name
+        self.cause = cause
+
+
+class _StageFailure:
+    """Passed on through the following stages in place of a result, to be raised by run_pipeline."""
+
+    def __init__(self, exception: PipelineStageException):
+        self.exception = exception
+
+
+def _start_stage(stage: Stage, inputs: Queue, outputs: Queue) -> List[Thread]:
+    remaining_workers = [stage.worker_count]
+    lock = Lock()
+
+    def finish() -> None:
+        with lock:
+            remaining_workers[0] -= 1
+            if remaining_workers[0] == 0:
+                outputs.put(_end_of_stream)
+
+    def work():
+        while True:
+            item = inputs.get()
+            if item is _end_of_stream:
+                # leave the end marker for the other workers of this stage:
+                inputs.put(_end_of_stream)
+                finish()
+                return
+
+            if isinstance(item, _StageFailure):
+                outputs.put(item)
+                continue
+
+            try:
+                result = stage.function(item)
+            except BaseException as e:
+                # the worker stops, but the failure and the end of stream still reach run_pipeline:
+                outputs.put(_StageFailure(PipelineStageException(stage.name, e)))
+                finish()
+                return
+
+            outputs.put(result)
+
+    threads = [Thread(target=work, name="{}-{}".format(stage.name, index), daemon=True)
+               for index in range(stage.worker_count)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def run_pipeline(items: Iterable, stages: List[Stage], queue_size: int = 4) -> Iterable:
+    """
+    Yields the results of the last stage in order of completion.
+    Raises PipelineStageException once the first exception raised by a stage function arrives at the end.
+    """
+    queues = [Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    for stage, inputs, outputs in zip(stages, queues, queues[1:]):
+        _start_stage(stage, inputs, outputs)
+
+    def feed():
+        for item in items:
+            queues[0].put(item)
+        queues[0].put(_end_of_stream)
+
+    Thread(target=feed, name="pipeline-input", daemon=True).start()
+
+    while True:
+        result = queues[-1].get()
+        if result is _end_of_stream:
+            return
+        if isinstance(result, _StageFailure):
+            raise result.exception from result.exception.cause
+        yield result
+
+
+class Transcriber:
+    """
+    :param infer: Yields grapheme probabilities and prediction lengths for spectrograms of shape (time, frequencies).
+    :param decode: Transcribes grapheme probabilities given prediction lengths.
+    """
+
+    def __init__(self, infer: Callable[[List[ndarray]], Tuple[ndarray, List[int]]],
+                 decode: Callable[[ndarray, List[int]], List[str]],
+                 spectrogram_from_audio: Callable[[Path, ndarray], ndarray],
+                 batch_size: int = 16, audio_decode_worker_count: int = 2, feature_worker_count: int = 2,
+                 inference_worker_count: int = 1, decode_worker_count: int = 1, sample_rate: int = 16000):
+        self.infer = infer
+        self.decode = decode
+        self.spectrogram_from_audio = spectrogram_from_audio
+        self.batch_size = batch_size
+        self.audio_decode_worker_count = audio_decode_worker_count
+        self.feature_worker_count = feature_worker_count
+        self.inference_worker_count = inference_worker_count
+        self.decode_worker_count = decode_worker_count
+        self.sample_rate = sample_rate
+
+        from pcm_cache import PolyphaseResampler
+        self.resampler = PolyphaseResampler()
+
+    def _decode_audio(self, item: TranscriptionItem) -> TranscriptionItem:
+        from pcm_cache import decode_audio
+
+        try:
+            audio, original_sample_rate = decode_audio(item.audio_file)
+            item.audio = self.resampler.resample(audio, source_rate=original_sample_rate,
+                                                 target_rate=self.sample_rate)
+            item.duration_in_s = item.audio.shape[0] / self.sample_rate
+        except Exception as e:
+            item.error = "Decoding audio failed: {}".format(e)
+        return item
+
+    def _extract_features(self, item: TranscriptionItem) -> TranscriptionItem:
+        if item.error is None:
+            try:
+                item.spectrogram = self.spectrogram_from_audio(item.audio_file, item.audio)
+            except Exception as e:
+                item.error = "Extracting features failed: {}".format(e)
+            item.audio = None
+        return item
+
+    def _infer(self, batch: TranscriptionBatch) -> TranscriptionBatch:
+        if batch.valid_items:
+            batch.prediction_batch, batch.prediction_lengths = self.infer(
+                [item.spectrogram for item in batch.valid_items])
+        return batch
+
+    def _decode_graphemes(self, batch: TranscriptionBatch) -> TranscriptionBatch:
+        if batch.valid_items:
+            for item, transcript in zip(batch.valid_items,
+                                        self.decode(batch.prediction_batch, batch.prediction_lengths)):
+                item.transcript = transcript
+        return batch
+
+    def transcribe(self, audio_files: List[Path]) -> Iterable[TranscriptionItem]:
+        """Yields transcribed items, batch by batch, as soon as a batch is decoded."""
+        batches = length_sorted_batches(audio_files, batch_size=self.batch_size)
+        items = [TranscriptionItem(batch_index, audio_file)
+                 for batch_index, batch in enumerate(batches) for audio_file in batch]
+
+        # collects items of each batch, which may arrive in any order from the parallel workers:
+        pending_items_by_batch = dict()  # type: Dict[int, List[TranscriptionItem]]
+        lock = Lock()
+
+        def collect(item: TranscriptionItem) -> Optional[TranscriptionBatch]:
+            with lock:
+                pending = pending_items_by_batch.setdefault(item.batch_index, [])
+                pending.append(item)
+                if len(pending) < len(batches[item.batch_index]):
+                    return None
+                del pending_items_by_batch[item.batch_index]
+            return TranscriptionBatch(pending)
+
+        def skip_incomplete(function: Callable) -> Callable:
+            return lambda batch: None if batch is None else function(batch)
+
+        stages = [Stage("audio-decode", self._decode_audio, self.audio_decode_worker_count),
+                  Stage("features", self._extract_features, self.feature_worker_count),
+                  Stage("batching", collect),
+                  Stage("inference", skip_incomplete(self._infer), self.inference_worker_count),
+                  Stage("grapheme-decode", skip_incomplete(self._decode_graphemes), self.decode_worker_count)]
+
+        for batch in run_pipeline(items, stages):
+            if batch is not None:
+                yield from batch.items
+
+
+class ThroughputPrinter:
+    def __init__(self, total_file_count: int):
+        self.total_file_count = total_file_count
+        self.file_count = 0
+        self.audio_duration_in_s = 0.
+        self.start = time.perf_counter()
+
+    def add(self, item: TranscriptionItem) -> None:
+        self.file_count += 1
+        self.audio_duration_in_s += item.duration_in_s
+
+    def audio_hours_per_hour(self) -> float:
+        elapsed = time.perf_counter() - self.start
+        return self.audio_duration_in_s / elapsed if elapsed > 0 else 0.
+
+    def status(self) -> str:
+        return "{}/{} files, {:.3f} audio hours, {:.1f} audio-hours/hour".format(
+            self.file_count, self.total_file_count, self.audio_duration_in_s / 3600, self.audio_hours_per_hour())
+
+
+def transcribe_to_jsonl(transcriber: Transcriber, audio_files: List[Path], output_file: Path,
+                        print_status: bool = True) -> int:
+    """
+    Appends transcriptions of all audio files not yet in the output file.
+    :return: Number of files transcribed.
+    """
+    # compared resolved, since the output may have been written with relative paths or through symbolic links:
+    completed = set(str(Path(file).resolve()) for file in completed_files(output_file))
+    remaining = [file for file in audio_files if str(file.resolve()) not in completed]
+    if print_status and completed:
+        print("Resuming: {} of {} files already transcribed.".format(len(audio_files) - len(remaining),
+                                                                     len(audio_files)))
+
+    throughput = ThroughputPrinter(total_file_count=len(remaining))
+    with output_file.open('a', encoding='utf8') as f:
+        for item in transcriber.transcribe(remaining):
+            f.write(json.dumps(item.as_dict(), ensure_ascii=False) + "\n")
+            f.flush()
+            throughput.add(item)
+            if print_status:
+                print(throughput.status())
+
+    return throughput.file_count
+
+
+def wav2letter_transcriber(net_directory: Path, epoch: Optional[int] = None, mel_frequency_count: int = 128,
+                           use_asg: bool = False, **kwargs) -> Transcriber:
+    from checkpoints import CheckpointIndex
+
+    if epoch is None:
+        epoch = CheckpointIndex(net_directory).best_epoch()
+        if epoch is None:
+            raise ValueError("No checkpoints are recorded in {}, specify the epoch to load with --epoch.".format(
+                net_directory))
+
+    from labeled_example import LabeledExample
+    from net import Wav2Letter
+    from spectrogram_batch import input_batch_and_prediction_lengths
+
+    wav2letter = Wav2Letter(input_size_per_time_step=mel_frequency_count, use_asg=use_asg,
+                            load_model_from_directory=net_directory, load_epoch=epoch)
+
+    def infer(spectrograms: List[ndarray]) -> Tuple[ndarray, List[int]]:
+        input_batch, prediction_lengths = input_batch_and_prediction_lengths(
+            spectrograms, input_to_prediction_length_ratio=wav2letter.input_to_prediction_length_ratio)
+        return wav2letter.prediction_batch(input_batch), prediction_lengths
+
+    def spectrogram_from_audio(audio_file: Path, audio: ndarray) -> ndarray:
+        example = LabeledExample(audio_file, mel_frequency_count=mel_frequency_count)
+        # already decoded and resampled:
+        example.raw_audio = audio
+        return example.z_normalized_transposed_spectrogram()
+
+    return Transcriber(infer=infer, decode=wav2letter.grapheme_encoding.decode_prediction_batch,
+                       spectrogram_from_audio=spectrogram_from_audio, **kwargs)
+
+
+def main(arguments: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Transcribes audio files with a trained net into a JSONL file.")
+    parser.add_argument("inputs", type=Path, nargs="+",
+                        help="Audio files, directories to search for audio files or text files listing audio files.")
+    parser.add_argument("--output", type=Path, required=True, help="JSONL file to append transcriptions to.")
+    parser.add_argument("--net-directory", type=Path, required=True)
+    parser.add_argument("--epoch", type=int, help="Defaults to the best checkpoint recorded in the net directory.")
+    parser.add_argument("--mel-frequency-count", type=int, default=128)
+    parser.add_argument("--use-asg", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--audio-decode-workers", type=int, default=2)
+    parser.add_argument("--feature-workers", type=int, default=2)
+    parser.add_argument("--inference-workers", type=int, default=1)
+    parser.add_argument("--decode-workers", type=int, default=1)
+    args = parser.parse_args(arguments)
+
+    transcriber = wav2letter_transcriber(
+        args.net_directory, epoch=args.epoch, mel_frequency_count=args.mel_frequency_count, use_asg=args.use_asg,
+        batch_size=args.batch_size, audio_decode_worker_count=args.audio_decode_workers,
+        feature_worker_count=args.feature_workers, inference_worker_count=args.inference_workers,
+        decode_worker_count=args.decode_workers)
+    transcribe_to_jsonl(transcriber, audio_files_from_arguments(args.inputs), output_file=args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
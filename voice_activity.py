@@ -0,0 +1,78 @@
+"""
+Trimming of leading and trailing silence, vectorized over samples or frames instead of iterating in Python,
+so that neither the network nor the spectrogram calculation process silence.
+"""
+import numpy
+from numpy import ndarray
+
+from instrumentation import metrics
+
+
+def trim_samples_below(audio: ndarray, threshold: float) -> ndarray:
+    """Removes leading and trailing samples with an absolute value below the threshold."""
+    loud = numpy.flatnonzero(numpy.abs(audio) >= threshold)
+    if len(loud) == 0:
+        return audio[:0]
+
+    return audio[loud[0]:loud[-1] + 1]
+
+
+class TrimmedAudio:
+    def __init__(self, audio: ndarray, removed_leading_frame_count: int, removed_trailing_frame_count: int):
+        self.audio = audio
+        self.removed_leading_frame_count = removed_leading_frame_count
+        self.removed_trailing_frame_count = removed_trailing_frame_count
+
+    @property
+    def removed_frame_count(self) -> int:
+        return self.removed_leading_frame_count + self.removed_trailing_frame_count
+
+
+class FrameEnergyVoiceActivityDetector:
+    """
+    Considers frames voiced whose mean energy is at most threshold_in_db below that of the loudest frame,
+    and keeps the audio from the first to the last voiced frame, extended by padding_frame_count frames on each side.
+    Frames have the window and hop length of the spectrograms by default, so removed frames are spectrogram time steps.
+    """
+
+    def __init__(self, threshold_in_db: float = -40., frame_length: int = 512, hop_length: int = 128,
+                 padding_frame_count: int = 2):
+        self.threshold_in_db = threshold_in_db
+        self.frame_length = frame_length
+        self.hop_length = hop_length
+        self.padding_frame_count = padding_frame_count
+
+    @property
+    def key(self) -> str:
+        return "vad{:g}db{}h{}p{}".format(self.threshold_in_db, self.frame_length, self.hop_length,
+                                          self.padding_frame_count)
+
+    def frame_count(self, sample_count: int) -> int:
+        return 1 + max(0, sample_count - self.frame_length + self.hop_length - 1) // self.hop_length
+
+    def frame_energies(self, audio: ndarray) -> ndarray:
+        """Mean squared amplitude of each frame, from cumulative sums instead of a copy of each frame."""
+        cumulative = numpy.concatenate([[0.], numpy.cumsum(numpy.square(audio, dtype=numpy.float64))])
+        starts = numpy.arange(self.frame_count(len(audio))) * self.hop_length
+        ends = numpy.minimum(starts + self.frame_length, len(audio))
+        return (cumulative[ends] - cumulative[starts]) / numpy.maximum(ends - starts, 1)
+
+    def voiced(self, audio: ndarray) -> ndarray:
+        energies = self.frame_energies(audio)
+        loudest = energies.max() if len(energies) else 0.
+        if loudest == 0:
+            return numpy.ones(len(energies), dtype=bool)
+
+        return energies >= loudest * 10 ** (self.threshold_in_db / 10)
+
+    def trim(self, audio: ndarray) -> TrimmedAudio:
+        voiced = numpy.flatnonzero(self.voiced(audio))
+        frame_count = self.frame_count(len(audio))
+        first_frame = max(0, voiced[0] - self.padding_frame_count)
+        last_frame = min(frame_count - 1, voiced[-1] + self.padding_frame_count)
+
+        trimmed = TrimmedAudio(audio[first_frame * self.hop_length:last_frame * self.hop_length + self.frame_length],
+                               removed_leading_frame_count=int(first_frame),
+                               removed_trailing_frame_count=int(frame_count - 1 - last_frame))
+        metrics.count("vad_removed_frames", trimmed.removed_frame_count)
+        return trimmed